@@ -0,0 +1,124 @@
+import hashlib
+import json
+import numpy as np
+import os
+import scipy.sparse
+
+from functools import lru_cache
+from vocab_index import VocabIndex
+
+
+# Part of the cache file names: bump it whenever clean_review or the tokenization changes.
+TOKENIZER_VERSION = 1
+
+_review_table = str.maketrans({c: None for c in ',."\'!?()'})
+_review_table[ord('/')] = ' '
+
+
+def clean_review(text):
+    ''' Lowercases an IMDB review and strips the html line breaks and punctuation, as the sentiment task always did. '''
+    text = text.lower().replace('<br />', '')
+    return text.translate(_review_table)
+
+
+class RaggedCorpus(object):
+    '''
+    Tokenized documents, stored as one flat int32 array of token ids plus document offsets:
+    the tokens of document i are `tokens.index2word[flat[offsets[i]:offsets[i + 1]]]`.
+
+    `tokens` is the corpus' own token table (a VocabIndex), so the cache does not depend on any embedding;
+    mapping the corpus onto an embedding vocab only needs one lookup per distinct token, see `count_matrix`.
+    '''
+    def __init__(self, tokens, flat, offsets, labels):
+        self.tokens = tokens
+        self.flat = flat
+        self.offsets = offsets
+        self.labels = labels
+
+    @classmethod
+    def from_documents(cls, documents, labels):
+        ''' `documents` is an iterable of token lists. '''
+        token_ids = {}
+        ids = []
+        offsets = [0]
+        for doc in documents:
+            for token in doc:
+                ids.append(token_ids.setdefault(token, len(token_ids)))
+            offsets.append(len(ids))
+        counts = np.bincount(np.array(ids, dtype=np.int64), minlength=len(token_ids))
+        tokens = VocabIndex(list(token_ids), counts)
+        return cls(tokens, np.array(ids, dtype=np.int32), np.array(offsets, dtype=np.int64), np.asarray(labels))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def count_matrix(self, vocab, dtype=np.float32):
+        '''
+        Sparse (documents x |vocab|) CSR matrix of token counts; tokens not in `vocab` are dropped.
+        `count_matrix(vocab).dot(embedding_mat)` is the sum of the word vectors of every document.
+        '''
+        remap = vocab.encode(self.tokens.index2word, drop_unknown=False)
+        ids = remap[self.flat]
+        known = ids >= 0
+        indptr = np.concatenate([[0], np.cumsum(known)])[self.offsets]
+        data = np.ones(int(known.sum()), dtype=dtype)
+        matrix = scipy.sparse.csr_matrix((data, ids[known], indptr), shape=(len(self), len(vocab)))
+        matrix.sum_duplicates()
+        return matrix
+
+    def save(self, fname):
+        ''' Writes `fname.npz` (ids, offsets, labels) and the token table next to it (see VocabIndex.save). '''
+        np.savez(fname + '.npz', flat=self.flat, offsets=self.offsets, labels=self.labels)
+        self.tokens.save(fname + '.tokens')
+
+    @staticmethod
+    def exists(fname):
+        return os.path.exists(fname + '.npz') and VocabIndex.exists(fname + '.tokens')
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname + '.npz') as data:
+            flat, offsets, labels = data['flat'], data['offsets'], data['labels']
+        return cls(VocabIndex.load(fname + '.tokens', mmap=False), flat, offsets, labels)
+
+
+def _imdb_fingerprint(split_type, data_dir):
+    '''
+    Hash of what a tokenized IMDB split depends on: the review directory, the names, sizes and mtimes
+    of its review files, and TOKENIZER_VERSION. Only stats the files, it doesn't read them.
+    '''
+    sha = hashlib.sha1(json.dumps([os.path.abspath(data_dir), split_type, TOKENIZER_VERSION]).encode('utf-8'))
+    for sub_dir in ['pos', 'neg']:
+        review_dir = os.path.join(data_dir, split_type, sub_dir)
+        for review_fname in sorted(os.listdir(review_dir)):
+            stat = os.stat(os.path.join(review_dir, review_fname))
+            sha.update('{}/{} {} {}\n'.format(sub_dir, review_fname, stat.st_size, stat.st_mtime).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+@lru_cache(maxsize=8)
+def load_imdb_split(split_type, data_dir='aclImdb', cache_dir='cache'):
+    '''
+    IMDB reviews of `split_type` ('train' or 'test') as a RaggedCorpus with boolean labels (True = positive),
+    positive reviews first, each directory in file name order.
+    The review files are only read and tokenized the first time: the result is cached in `cache_dir`,
+    and in memory for the rest of the process. The cache file is named after `data_dir`, the review files
+    and TOKENIZER_VERSION (see `_imdb_fingerprint`), so changing any of them rebuilds it.
+    '''
+    if split_type not in ['train', 'test']:
+        raise ValueError('Unrecognized split type {}'.format(split_type))
+    fname = os.path.join(cache_dir, 'aclImdb_{}_{}'.format(split_type, _imdb_fingerprint(split_type, data_dir)))
+    if RaggedCorpus.exists(fname):
+        return RaggedCorpus.load(fname)
+    documents = []
+    labels = []
+    for label, sub_dir in [(True, 'pos'), (False, 'neg')]:
+        review_dir = os.path.join(data_dir, split_type, sub_dir)
+        for review_fname in sorted(os.listdir(review_dir)):
+            with open(os.path.join(review_dir, review_fname), 'r') as f:
+                documents.append(clean_review(' '.join(x.strip() for x in f)).split())
+            labels.append(label)
+    corpus = RaggedCorpus.from_documents(documents, np.array(labels, dtype=bool))
+    os.makedirs(cache_dir, exist_ok=True)
+    corpus.save(fname)
+    return corpus
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ This script compares approximate nearest neighbor search (web.ann.IVFIndex) with the exact
+ search (web.neighbors.NeighborIndex) on an embedding: recall@k and queries per second for
+ several values of n_probe.
+
+ Usage: ./benchmark_ann.py -f <path to file> [-k 10] [-q 1000] [-l <n_lists>] [-n 1,2,4,8,16,32]
+
+ Without a file, a random clustered matrix is used instead.
+"""
+from optparse import OptionParser
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from web.ann import IVFIndex
+from web.embeddings import load_embedding
+from web.neighbors import NeighborIndex
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.WARNING, datefmt='%I:%M:%S')
+logger = logging.getLogger(__name__)
+
+parser = OptionParser()
+parser.add_option("-f", "--file", dest="filename",
+                  help="Path to the file with embedding (.npy, .bin or .txt). If not given, uses random vectors.",
+                  default=None)
+
+parser.add_option("-k", "--k", dest="k", type="int",
+                  help="Number of neighbors per query.",
+                  default=10)
+
+parser.add_option("-q", "--queries", dest="n_queries", type="int",
+                  help="Number of query words (sampled from the vocabulary).",
+                  default=1000)
+
+parser.add_option("-l", "--lists", dest="n_lists", type="int",
+                  help="Number of IVF lists (default: 4 * sqrt(vocabulary size)).",
+                  default=None)
+
+parser.add_option("-n", "--probes", dest="probes",
+                  help="Comma separated values of n_probe to benchmark.",
+                  default="1,2,4,8,16,32")
+
+parser.add_option("-s", "--size", dest="size", type="int",
+                  help="Number of random vectors when no file is given.",
+                  default=200000)
+
+
+def random_embedding(n, d=300, n_clusters=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(n_clusters, d).astype(np.float32)
+    vectors = centers[rng.randint(n_clusters, size=n)] + 0.5 * rng.randn(n, d).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed(f):
+    start = time.time()
+    result = f()
+    return result, time.time() - start
+
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+
+    if options.filename:
+        format = {".npy": "npy", ".bin": "word2vec_bin"}.get(os.path.splitext(options.filename)[1], "word2vec")
+        matrix = load_embedding(options.filename, format=format, normalize=True, lower=False,
+                                clean_words=False, load_kwargs={}).vectors
+    else:
+        matrix = random_embedding(options.size)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    print("Embedding: {} x {}".format(*matrix.shape))
+
+    query_ids = np.random.RandomState(0).choice(len(matrix), min(options.n_queries, len(matrix)), replace=False)
+    (exact_ids, _), exact_time = timed(lambda: NeighborIndex(matrix).query_ids(query_ids, k=options.k))
+
+    index, build_time = timed(lambda: IVFIndex(matrix, n_lists=options.n_lists))
+    print("Built {} IVF lists in {:.1f}s".format(index.n_lists, build_time))
+
+    rows = [{"index": "exact", "n_probe": None, "recall@{}".format(options.k): 1.0,
+             "queries/s": len(query_ids) / exact_time}]
+    for n_probe in [int(p) for p in options.probes.split(",")]:
+        index.n_probe = n_probe
+        (approx_ids, _), approx_time = timed(lambda: index.query_ids(query_ids, k=options.k))
+        recall = np.mean([len(set(a) & set(e)) / float(options.k) for a, e in zip(approx_ids, exact_ids)])
+        rows.append({"index": "ivf", "n_probe": n_probe, "recall@{}".format(options.k): recall,
+                     "queries/s": len(query_ids) / approx_time})
+    print(pd.DataFrame(rows).to_string(index=False))
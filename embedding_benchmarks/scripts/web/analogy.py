@@ -13,7 +13,7 @@ from itertools import product
 logger = logging.getLogger(__name__)
 import sklearn
 from .datasets.analogy import *
-from .utils import batched
+from .neighbors import solve_analogies
 from web.embedding import Embedding
 
 class SimpleAnalogySolver(sklearn.base.BaseEstimator):
@@ -29,23 +29,30 @@ class SimpleAnalogySolver(sklearn.base.BaseEstimator):
       with Lessons Learned from Word Embeddings" O. Levy et al. 2014.
 
     batch_size : int
-      Batch size to use while computing accuracy. This is because of extensive memory usage.
+      Number of questions scored at once, against blocks of the vocabulary (see web.neighbors.solve_analogies).
+      Bounds memory usage.
 
     k: int
       If not None will select k top most frequent words from embedding before doing analogy prediction
       (this can offer significant speedups)
 
+    index : NeighborIndex or IVFIndex, optional
+      Neighbor index over the rows of `w.vectors` (see web.neighbors and web.ann). If given, answers
+      are searched through it instead of by a full dot product; an approximate index such as
+      `IVFIndex` trades some accuracy for speed. Only supported with method="add".
+
     Note
     ----
     It is suggested to normalize and standardize embedding before passing it to SimpleAnalogySolver.
     To speed up code consider installing OpenBLAS and setting OMP_NUM_THREADS.
     """
 
-    def __init__(self, w, method="add", batch_size=300, k=None):
+    def __init__(self, w, method="add", batch_size=300, k=None, index=None):
         self.w = w
         self.batch_size = batch_size
         self.method = method
         self.k = k
+        self.index = index
 
     def score(self, X, y):
         """
@@ -80,11 +87,12 @@ class SimpleAnalogySolver(sklearn.base.BaseEstimator):
         y_pred : array-like, shape (n_samples, )
           Predicted words.
         """
+        if self.index is not None and (self.method != "add" or self.k):
+            raise ValueError("index is only supported with method='add' and k=None")
         w = self.w.most_frequent(self.k) if self.k else self.w
         words = self.w.vocabulary.words
         word_id = self.w.vocabulary.word_id
         #mean_vector = np.mean(w.vectors, axis=0)
-        output = []
 
         missing_words = 0
         n_words = 0
@@ -96,36 +104,19 @@ class SimpleAnalogySolver(sklearn.base.BaseEstimator):
         if missing_words > 0:
             logger.warning("Missing {}% of words ({} / {} missing).".format(missing_words / n_words, missing_words, n_words))
 
-        # Batch due to memory constaints (in dot operation)
-        for id_batch, batch in enumerate(batched(range(len(X)), self.batch_size)):
-            ids = list(batch)
-            X_b = X[ids]
-            X_b = np.array([triple for triple in X_b if triple[0] in w and triple[1] in w and triple[2] in w])
-            if id_batch % np.floor(len(X) / (10. * self.batch_size)) == 0:
-                logger.info("Processing {}/{} batch".format(int(np.ceil(ids[1] / float(self.batch_size))),
-                                                            int(np.ceil(X.shape[0] / float(self.batch_size)))))
-
-            if len(X_b) == 0:
-                continue
-            A = np.vstack(w.get(word) for word in X_b[:, 0])
-            B = np.vstack(w.get(word) for word in X_b[:, 1])
-            C = np.vstack(w.get(word) for word in X_b[:, 2])
-
-            if self.method == "add":
-                D = np.dot(w.vectors, (B - A + C).T)
-            elif self.method == "mul":
-                D_A = np.log((1.0 + np.dot(w.vectors, A.T)) / 2.0 + 1e-5)
-                D_B = np.log((1.0 + np.dot(w.vectors, B.T)) / 2.0 + 1e-5)
-                D_C = np.log((1.0 + np.dot(w.vectors, C.T)) / 2.0 + 1e-5)
-                D = D_B - D_A + D_C
-            else:
-                raise RuntimeError("Unrecognized method parameter")
-
-            # Remove words that were originally in the query
-            for id, row in enumerate(X_b):
-                D[[w.vocabulary.word_id[r] for r in row if r in
-                   w.vocabulary.word_id], id] = np.finfo(np.float32).min
-
-            output.append([words[id] for id in D.argmax(axis=0)])
-
-        return np.array([item for sublist in output for item in sublist])
+        X = np.array([triple for triple in X if triple[0] in w and triple[1] in w and triple[2] in w])
+        if len(X) == 0:
+            return np.array([])
+        ids = np.array([[w.vocabulary.word_id[word] for word in triple] for triple in X]).reshape(-1, 3)
+
+        if self.index is not None:
+            A, B, C = (w.vectors[ids[:, i]] for i in range(3))
+            answers, _ = self.index.query(B - A + C, k=1, exclude=ids)
+        elif self.method in ("add", "mul"):
+            # Blocked over questions and vocabulary, so memory does not grow with len(X) x len(w)
+            answers, _ = solve_analogies(w.vectors, ids[:, 0], ids[:, 1], ids[:, 2], method=self.method,
+                                         query_batch_size=self.batch_size)
+        else:
+            raise RuntimeError("Unrecognized method parameter")
+
+        return np.array([words[id] for id in answers[:, 0]])
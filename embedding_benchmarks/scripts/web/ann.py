@@ -0,0 +1,201 @@
+"""
+Approximate nearest neighbor search (NumPy only).
+
+`IVFIndex` is an inverted-file index: rows are clustered by k-means, and a query only scores the rows
+of the `n_probe` clusters whose centroids are closest to it. It has the same `query` / `query_ids`
+interface as `web.neighbors.NeighborIndex`, so either can be plugged in where neighbors are searched,
+and a `most_similar` method so it can be passed as `indexer` to gensim's `Word2Vec.most_similar`.
+"""
+
+import json
+
+import numpy as np
+
+from .neighbors import inverse_row_norms, top_k
+
+
+def _assign(points, centroids, block_size=50000):
+    """Id of the nearest (euclidean) centroid of every point."""
+    half_sq_norms = 0.5 * np.sum(centroids ** 2, axis=1)
+    labels = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), block_size):
+        scores = np.dot(points[start:start + block_size], centroids.T) - half_sq_norms
+        labels[start:start + block_size] = scores.argmax(axis=1)
+    return labels
+
+
+def kmeans(points, n_clusters, n_iter=10, random_state=0):
+    """
+    Lloyd's k-means, initialized with random points. Empty clusters are re-seeded with random points.
+
+    Returns
+    -------
+      centroids: array, shape (n_clusters, d)
+    """
+    rng = np.random.RandomState(random_state)
+    points = np.asarray(points, dtype=np.float32)
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(points, centroids)
+        order = np.argsort(labels, kind="mergesort")
+        counts = np.bincount(labels, minlength=n_clusters)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        centroids[nonempty] = np.add.reduceat(points[order], starts, axis=0) / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex(object):
+    """
+    Approximate dot product (or cosine) neighbor search by inverted lists.
+
+    Parameters
+    ----------
+      matrix: array, shape (n, d)
+        Vectors to search. Not copied (it may be memory-mapped), and not stored by `save`.
+
+      n_lists: int, default: None
+        Number of k-means clusters. Defaults to about 4 * sqrt(n).
+
+      n_probe: int, default: 8
+        Number of clusters scored per query: the recall / speed knob. Can be changed at any time;
+        `n_probe >= n_lists` gives exact results.
+
+      normalize: bool, default: False
+        If True, scores are cosine similarities. Leave False for matrices whose rows are already normalized.
+
+      labels: list, default: None
+        Label of every row, only needed for `most_similar`.
+
+      n_iter: int, default: 10
+        Number of k-means iterations.
+
+      sample_size: int, default: 64 * n_lists
+        Number of rows the centroids are trained on (all rows are then assigned to a list).
+
+      random_state: int, default: 0
+    """
+
+    def __init__(self, matrix, n_lists=None, n_probe=8, normalize=False, labels=None, n_iter=10,
+                 sample_size=None, random_state=0, block_size=50000):
+        self.matrix = matrix
+        self.n_probe = n_probe
+        self.normalize = normalize
+        self.labels = labels
+        self.block_size = block_size
+        self.row_scale = None
+        if normalize:
+            self.row_scale = inverse_row_norms(matrix, block_size)
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(len(matrix)))
+        n_lists = max(1, min(n_lists, len(matrix)))
+        if sample_size is None:
+            sample_size = 64 * n_lists
+        rng = np.random.RandomState(random_state)
+        sample = np.sort(rng.choice(len(matrix), min(sample_size, len(matrix)), replace=False))
+        self.centroids = kmeans(self._rows(sample), n_lists, n_iter=n_iter, random_state=random_state)
+
+        list_ids = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), block_size):
+            rows = np.arange(start, min(start + block_size, len(matrix)))
+            list_ids[rows] = _assign(self._rows(rows), self.centroids)
+        self.list_rows = np.argsort(list_ids, kind="mergesort")
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(list_ids, minlength=n_lists))])
+
+    def _rows(self, ids):
+        rows = np.asarray(self.matrix[ids], dtype=np.float32)
+        if self.row_scale is not None:
+            rows = rows * self.row_scale[ids, None]
+        return rows
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def query(self, queries, k=1, exclude=None):
+        """
+        Approximate `k` nearest rows of each query vector, see `web.neighbors.top_k`. Returns (ids, scores).
+        If the probed lists hold fewer than `k` rows, the answer is padded with id -1 and score -inf.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        single = queries.ndim == 1
+        queries = np.atleast_2d(queries)
+        if self.normalize:
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.where(norms > 0, norms, 1.)
+        n_probe = min(self.n_probe, self.n_lists)
+        probes, _ = top_k(self.centroids, queries, k=n_probe)
+
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, (query, query_probes) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.list_rows[self.list_offsets[p]:self.list_offsets[p + 1]]
+                                         for p in query_probes])
+            if exclude is not None and len(exclude[i]):
+                candidates = candidates[~np.in1d(candidates, exclude[i])]
+            candidates = np.sort(candidates)  # sequential reads of a memory-mapped matrix
+            candidate_scores = np.dot(self._rows(candidates), query)
+            n_found = min(k, len(candidates))
+            if n_found == 0:
+                continue
+            best = np.argpartition(-candidate_scores, n_found - 1)[:n_found]
+            best = best[np.argsort(-candidate_scores[best], kind="mergesort")]
+            ids[i, :n_found] = candidates[best]
+            scores[i, :n_found] = candidate_scores[best]
+
+        if single:
+            return ids[0], scores[0]
+        return ids, scores
+
+    def query_ids(self, ids, k=1, exclude=None):
+        """
+        Approximate `k` nearest rows of the rows `ids`, never returning a query row itself. Returns (ids, scores).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if exclude is None:
+            exclude = [[i] for i in ids]
+        else:
+            exclude = [list(e) + [i] for i, e in zip(ids, exclude)]
+        return self.query(np.asarray(self.matrix[ids]), k=k, exclude=exclude)
+
+    def most_similar(self, vector, num_neighbors):
+        """(label, similarity) of the top-N rows, the interface of gensim's `indexer` argument."""
+        ids, scores = self.query(vector, k=num_neighbors)
+        return [(self.labels[i], float(s)) for i, s in zip(ids, scores) if i >= 0]
+
+    def save(self, fname):
+        """
+        Writes the index structure (not the matrix) to `fname` (.npz).
+        """
+        params = {"n_probe": self.n_probe, "normalize": self.normalize, "block_size": self.block_size}
+        np.savez(fname, centroids=self.centroids, list_rows=self.list_rows, list_offsets=self.list_offsets,
+                 params=np.frombuffer(json.dumps(params).encode("utf-8"), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, fname, matrix, labels=None):
+        """
+        Loads an index written by `save`, over the same `matrix` it was built on.
+        """
+        with np.load(fname) as data:
+            params = json.loads(data["params"].tobytes().decode("utf-8"))
+            if data["list_offsets"][-1] != len(matrix):
+                raise ValueError("Index was built on {} rows, got {}".format(data["list_offsets"][-1], len(matrix)))
+            index = cls.__new__(cls)
+            index.matrix = matrix
+            index.labels = labels
+            index.n_probe = params["n_probe"]
+            index.normalize = params["normalize"]
+            index.block_size = params["block_size"]
+            index.centroids = data["centroids"]
+            index.list_rows = data["list_rows"]
+            index.list_offsets = data["list_offsets"]
+        index.row_scale = None
+        if index.normalize:
+            index.row_scale = inverse_row_norms(matrix, index.block_size)
+        return index
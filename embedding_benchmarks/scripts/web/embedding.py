@@ -6,6 +6,7 @@ NOTE: This file was adapted from the polyglot package
 
 import logging
 import numpy as np
+from os import path
 
 from six import text_type
 from six import PY2
@@ -17,6 +18,7 @@ from six.moves import cPickle as pickle
 from six.moves import range
 from functools import partial
 from .utils import standardize_string, to_utf8
+from .neighbors import NeighborIndex
 
 from sklearn.metrics import pairwise_distances
 
@@ -178,15 +180,20 @@ class Embedding(object):
         else:
             v = word
 
-        D = pairwise_distances(self.vectors, v.reshape(1, -1), metric=metric)
-
+        excluded = [self.vocabulary.word_id[w] for w in exclude]
         if isinstance(word, string_types):
-            D[self.vocabulary.word_id[word]] = D.max()
+            excluded.append(self.vocabulary.word_id[word])
 
-        for w in exclude:
-            D[self.vocabulary.word_id[w]] = D.max()
+        if metric == "cosine":
+            ids, _ = NeighborIndex(self.vectors, normalize=True).query(v, k=k, exclude=[excluded])
+        else:
+            D = pairwise_distances(self.vectors, v.reshape(1, -1), metric=metric).ravel()
+            D[excluded] = np.inf
+            k = min(k, len(D))
+            ids = np.argpartition(D, k - 1)[:k]
+            ids = ids[np.argsort(D[ids], kind="mergesort")]
 
-        return [self.vocabulary.id_word[id] for id in D.argsort(axis=0).flatten()[0:k]]
+        return [self.vocabulary.id_word[id] for id in ids[0:k]]
 
     @staticmethod
     def from_gensim(model):
@@ -212,33 +219,40 @@ class Embedding(object):
         return CountedVocabulary(word_count=counts)
 
     @staticmethod
-    def _from_word2vec_binary(fname):
+    def _from_word2vec_binary(fname, chunk_size=1 << 20):
         with _open(fname, 'rb') as fin:
-            words = []
             header = fin.readline()
             vocab_size, layer1_size = list(map(int, header.split()))  # throws for invalid file format
             logger.info("Loading #{} words with {} dim".format(vocab_size, layer1_size))
+
+            words = []
             vectors = np.zeros((vocab_size, layer1_size), dtype=np.float32)
             binary_len = np.dtype("float32").itemsize * layer1_size
+            # stream the file through a bounded buffer instead of reading it whole
+            data, pos = b'', 0
             for line_no in range(vocab_size):
                 # mixed text and binary: read text first, then binary
-                word = []
                 while True:
-                    ch = fin.read(1)
-                    if ch == b' ':
+                    while data[pos:pos + 1] == b'\n':  # ignore newlines in front of words (some binary files have newline, some don't)
+                        pos += 1
+                    end = data.find(b' ', pos)
+                    if end != -1 and end + 1 + binary_len <= len(data):
                         break
-                    if ch != b'\n':  # ignore newlines in front of words (some binary files have newline, some don't)
-                        word.append(ch)
+                    more = fin.read(max(chunk_size, binary_len + 1))
+                    if not more:
+                        break
+                    data, pos = data[pos:] + more, 0
+                if end == -1 or end + 1 + binary_len > len(data):
+                    break
+                words.append(data[pos:end].decode("latin-1"))
+                vectors[line_no, :] = np.frombuffer(data, dtype=np.float32, count=layer1_size, offset=end + 1)
+                pos = end + 1 + binary_len
 
-                words.append(b''.join(word).decode("latin-1"))
-                vectors[line_no, :] = np.fromstring(fin.read(binary_len), dtype=np.float32)
+        if len(words) < vocab_size:
+            logger.warning("Omitted {} words".format(vocab_size - len(words)))
+            vectors = vectors[0:len(words)]
 
-            if len(words) < vocab_size:
-                logger.warning("Omitted {} words".format(vocab_size - len(words)))
-            elif len(words) > vocab_size:
-                raise RuntimeError("Read too many words, incorrect file")
-
-            return words, vectors
+        return words, vectors
 
     @staticmethod
     def _from_word2vec_text(fname):
@@ -317,6 +331,25 @@ class Embedding(object):
             d[k] = np.array(d[k]).flatten()
         return Embedding(vectors=list(d.values()), vocabulary=Vocabulary(d.keys()))
 
+    @staticmethod
+    def from_npy(fname, mmap=False):
+        """
+        Load a raw .npy embedding matrix. The vocabulary is read from `<name>.words.npy`
+        next to `<name>.npy` (utf-8 encoded words separated by newlines, stored as a uint8 array).
+
+        Parameters
+        ----------
+        mmap: bool, default: False
+          If true the matrix is memory-mapped read-only instead of read into memory.
+        """
+        base = path.splitext(fname)[0]
+        blob = np.load(base + ".words.npy")
+        words = blob.tobytes().decode("utf-8").split("\n") if len(blob) else []
+        vectors = np.load(fname, mmap_mode="r" if mmap else None)
+        if not mmap:
+            vectors = vectors.astype(np.float32, copy=False)
+        return Embedding(vocabulary=OrderedVocabulary(words=words), vectors=vectors)
+
     @staticmethod
     def to_word2vec(w, fname, binary=False):
         """
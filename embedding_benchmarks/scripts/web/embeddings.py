@@ -19,7 +19,8 @@ def load_embedding(fname, format="word2vec_bin", normalize=True,
 
     format: string
       Format of the embedding. Possible values are:
-      'word2vec_bin', 'word2vec', 'glove', 'dict'
+      'word2vec_bin', 'word2vec', 'glove', 'dict', 'npy'
+      ('npy' is a raw .npy matrix with its vocabulary in `<name>.words.npy` next to it, see `Embedding.from_npy`)
 
     normalize: bool, default: True
       If true will normalize all vector to unit length
@@ -32,7 +33,7 @@ def load_embedding(fname, format="word2vec_bin", normalize=True,
       Additional parameters passed to load function. Mostly useful for 'glove' format where you
       should pass vocab_size and dim.
     """
-    assert format in ['word2vec_bin', 'word2vec', 'glove', 'dict'], "Unrecognized format"
+    assert format in ['word2vec_bin', 'word2vec', 'glove', 'dict', 'npy'], "Unrecognized format"
     if format == "word2vec_bin":
         w = Embedding.from_word2vec(fname, binary=True)
     elif format == "word2vec":
@@ -42,6 +43,8 @@ def load_embedding(fname, format="word2vec_bin", normalize=True,
     elif format == "dict":
         d = pickle.load(open(fname, "rb"))
         w = Embedding.from_dict(d)
+    elif format == "npy":
+        w = Embedding.from_npy(fname)
     if normalize:
         w.normalize_words(inplace=True)
     if lower or clean_words:
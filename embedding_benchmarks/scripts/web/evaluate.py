@@ -14,6 +14,38 @@ from web.embedding import Embedding
 
 logger = logging.getLogger(__name__)
 
+
+def _word_ids(w, words):
+    """
+    Rows of the given words in the embedding, looked up once in its vocabulary map.
+
+    Parameters
+    ----------
+    w: Embedding
+      Embedding to look the words up in.
+
+    words: array-like of strings
+      Words, any shape.
+
+    Returns
+    -------
+    ids: array of int64, same shape as words
+      Row of every word in w.vectors, -1 for the words that are not in the embedding.
+    """
+    words = np.asarray(words, dtype=object)
+    word_id = w.vocabulary.word_id
+    return np.array([word_id.get(word, -1) for word in words.ravel()], dtype=np.int64).reshape(words.shape)
+
+
+def _vectors_or_default(w, ids, default):
+    """
+    Rows `ids` (see _word_ids) of w.vectors as one matrix, with `default` for missing (-1) words.
+    """
+    vectors = w.vectors[np.maximum(ids, 0)]
+    vectors[ids < 0] = default
+    return vectors
+
+
 def calculate_purity(y_true, y_pred):
     """
     Calculate purity for given true and predicted cluster labels.
@@ -85,7 +117,7 @@ def evaluate_categorization(w, X, y, method="all", seed=None):
     assert method in ["all", "kmeans", "agglomerative"], "Uncrecognized method"
 
     mean_vector = np.mean(w.vectors, axis=0, keepdims=True)
-    words = np.vstack(w.get(word, mean_vector) for word in X.flatten())
+    words = _vectors_or_default(w, _word_ids(w, X.flatten()), mean_vector)
     ids = np.random.RandomState(seed).choice(range(len(X)), len(X), replace=False)
 
     # Evaluate clustering on several hyperparameters of AgglomerativeClustering and
@@ -140,12 +172,14 @@ def evaluate_on_semeval_2012_2(w):
     for c in categories:
         # Get mean of left and right vector
         prototypes = data.X_prot[c]
-        prot_left = np.mean(np.vstack(w.get(word, mean_vector) for word in prototypes[:, 0]), axis=0)
-        prot_right = np.mean(np.vstack(w.get(word, mean_vector) for word in prototypes[:, 1]), axis=0)
+        prototype_ids = _word_ids(w, prototypes[:, :2])
+        prot_left = np.mean(_vectors_or_default(w, prototype_ids[:, 0], mean_vector), axis=0)
+        prot_right = np.mean(_vectors_or_default(w, prototype_ids[:, 1], mean_vector), axis=0)
 
         questions = data.X[c]
-        question_left, question_right = np.vstack(w.get(word, mean_vector) for word in questions[:, 0]), \
-                                        np.vstack(w.get(word, mean_vector) for word in questions[:, 1])
+        question_ids = _word_ids(w, questions[:, :2])
+        question_left = _vectors_or_default(w, question_ids[:, 0], mean_vector)
+        question_right = _vectors_or_default(w, question_ids[:, 1], mean_vector)
 
         scores = np.dot(prot_left - prot_right, (question_left - question_right).T)
 
@@ -223,6 +257,37 @@ def evaluate_analogy(w, X, y, method="add", k=None, category=None, batch_size=10
         return np.mean(y_pred == y)
 
 
+def _wordrep_questions(X_cat):
+    """
+    Analogy questions of a WordRep category: every ordered pair of distinct word pairs
+    (left, right) gives the question (left[0], left[1], right[0]) with answer right[1].
+
+    Parameters
+    ----------
+    X_cat: array, shape: (n_pairs, 2)
+      Word pairs of the category.
+
+    Returns
+    -------
+    X: array, shape: (n_pairs * (n_pairs - 1), 3)
+      Questions, in the order of itertools.product(X_cat, X_cat). Rows left over by
+      duplicated pairs are zeros.
+
+    y: array, shape: (n_pairs * (n_pairs - 1),)
+      Answers.
+    """
+    size = X_cat.shape[0] * (X_cat.shape[0] - 1)
+    X = np.zeros(shape=(size, 3), dtype="object")
+    y = np.zeros(shape=(size,), dtype="object")
+    X_cat = np.asarray(X_cat, dtype="object")
+    different = ~np.all(X_cat[:, None, :] == X_cat[None, :, :], axis=2)
+    left, right = np.nonzero(different)
+    X[:len(left), 0:2] = X_cat[left]
+    X[:len(left), 2] = X_cat[right, 0]
+    y[:len(left)] = X_cat[right, 1]
+    return X, y
+
+
 def evaluate_on_WordRep(w, max_pairs=1000, solver_kwargs={}):
     """
     Evaluate on WordRep dataset
@@ -262,16 +327,8 @@ def evaluate_on_WordRep(w, max_pairs=1000, solver_kwargs={}):
                                                                        , X_cat.shape[0] * (X_cat.shape[0] - 1)))
 
         # For each category construct question-answer pairs
-        size = X_cat.shape[0] * (X_cat.shape[0] - 1)
-        X = np.zeros(shape=(size, 3), dtype="object")
-        y = np.zeros(shape=(size,), dtype="object")
-        id = 0
-        for left, right in product(X_cat, X_cat):
-            if not np.array_equal(left, right):
-                X[id, 0:2] = left
-                X[id, 2] = right[0]
-                y[id] = right[1]
-                id += 1
+        X, y = _wordrep_questions(X_cat)
+        size = X.shape[0]
 
         # Run solver
         solver = SimpleAnalogySolver(w=w, **solver_kwargs)
@@ -298,7 +355,7 @@ def evaluate_on_WordRep(w, max_pairs=1000, solver_kwargs={}):
                       pd.Series(count, name="count")], axis=1)
 
 
-def evaluate_similarity(w, X, y):
+def evaluate_similarity(w, X, y, ids=None):
     """
     Calculate Spearman correlation between cosine similarity of the model
     and human rated similarity of word pairs
@@ -314,49 +371,34 @@ def evaluate_similarity(w, X, y):
     y: vector, shape: (n_samples,)
       Human ratings
 
+    ids: array, shape: (n_samples, 2), default: None
+      Rows of the words of X in w.vectors, -1 for missing words (see evaluate_on_all,
+      which looks up the words of all the datasets at once). Looked up if not given.
+
     Returns
     -------
     cor: float
       Spearman correlation
+
+    Notes
+    -----
+    Pairs with a missing word are skipped. Scores are the dot products of the word vectors
+    (cosine similarities for normalized embeddings).
     """
     if isinstance(w, dict):
         w = Embedding.from_dict(w)
 
-    total_words = 0
-    missing_words = 0
-    words = w.vocabulary.word_id
-    for query in X:
-        for query_word in query:
-            total_words += 1
-            if query_word not in words:
-                missing_words += 1
+    if ids is None:
+        ids = _word_ids(w, X)
+    missing_words = int(np.sum(ids < 0))
     if missing_words > 0:
-        logger.info("Missing {} words out of {} total words in test ({}% of words are missing).".format(missing_words, total_words, missing_words / total_words * 100.0))
-        #logger.warning("Missing {} words. Will replace them with mean vector".format(missing_words))
+        logger.info("Missing {} words out of {} total words in test ({}% of words are missing).".format(missing_words, ids.size, missing_words / ids.size * 100.0))
 
-
-    '''
-    mean_vector = np.mean(w.vectors, axis=0, keepdims=True)
-    A = np.vstack(w.get(word, mean_vector) for word in X[:, 0])
-    B = np.vstack(w.get(word, mean_vector) for word in X[:, 1])
-    scores = np.array([v1.dot(v2.T) for v1, v2 in zip(A, B)])
-    return scipy.stats.spearmanr(scores, y).correlation
-    '''
-    words = zip(X[:, 0], X[:, 1])
-    A = []
-    B = []
-    new_y = []
-    for (w1, w2), score in zip(words, y):
-        if w1 in w and w2 in w:
-            A.append(w[w1])
-            B.append(w[w2])
-            new_y.append(score)
-    A = np.vstack(A)
-    B = np.vstack(B)
-    y = np.vstack(new_y)
-    assert len(A) == len(B) == len(y)
-    scores = np.array([v1.dot(v2.T) for v1, v2 in zip(A, B)])
-    return scipy.stats.spearmanr(scores, y).correlation
+    known = np.all(ids >= 0, axis=1)
+    A = w.vectors[ids[known, 0]]
+    B = w.vectors[ids[known, 1]]
+    scores = np.einsum("ij,ij->i", A, B)
+    return scipy.stats.spearmanr(scores, np.asarray(y)[known]).correlation
 
 
 def evaluate_on_all(w, categorization=True):
@@ -391,8 +433,11 @@ def evaluate_on_all(w, categorization=True):
 
     similarity_results = {}
 
-    for name, data in iteritems(similarity_tasks):
-        similarity_results[name] = evaluate_similarity(w, data.X, data.y)
+    # Look the words of all the datasets up in one pass
+    all_ids = _word_ids(w, np.concatenate([data.X[:, :2] for data in similarity_tasks.values()]))
+    offsets = np.cumsum([0] + [len(data.X) for data in similarity_tasks.values()])
+    for (name, data), start, end in zip(iteritems(similarity_tasks), offsets[:-1], offsets[1:]):
+        similarity_results[name] = evaluate_similarity(w, data.X, data.y, ids=all_ids[start:end])
         logger.info("Spearman correlation of scores on {} {}".format(name, similarity_results[name]))
 
     '''
@@ -0,0 +1,286 @@
+"""
+Exact nearest neighbor search over an embedding matrix.
+
+Scores are dot products (cosine similarities for normalized rows), computed by blocked
+matrix multiplication so that memory stays bounded by `query_batch_size` x `block_size`,
+and the top-k of every block is selected with `argpartition` instead of a full sort.
+"""
+
+import numpy as np
+
+
+def _take_rows(a, idx):
+    """`a[i, idx[i]]` for every row i (np.take_along_axis needs numpy >= 1.15)."""
+    return a[np.arange(idx.shape[0])[:, None], idx]
+
+
+def _merge_top_k(best_ids, best_scores, ids, scores, k):
+    """Keeps the `k` highest scores (per row) of the running best and the new candidates."""
+    if best_ids is not None:
+        ids = np.concatenate([best_ids, ids], axis=1)
+        scores = np.concatenate([best_scores, scores], axis=1)
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        ids = _take_rows(ids, part)
+        scores = _take_rows(scores, part)
+    return ids, scores
+
+
+def _block_top_k(scores, offset, k):
+    """Column ids (shifted by `offset`) and values of the `k` highest scores in each row of `scores`."""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return part + offset, _take_rows(scores, part)
+    ids = np.broadcast_to(np.arange(offset, offset + scores.shape[1]), scores.shape)
+    return ids, scores
+
+
+def _sort_top_k(ids, scores):
+    order = np.argsort(-scores, axis=1, kind='mergesort')
+    return _take_rows(ids, order), _take_rows(scores, order)
+
+
+def _flatten_exclude(exclude, n_queries):
+    if exclude is None:
+        return None, None
+    if len(exclude) != n_queries:
+        raise ValueError("Got {} exclusion lists for {} queries".format(len(exclude), n_queries))
+    exclude = [np.asarray(e, dtype=np.int64).ravel() for e in exclude]
+    ex_queries = np.repeat(np.arange(n_queries), [len(e) for e in exclude])
+    ex_rows = np.concatenate(exclude) if len(exclude) else np.empty(0, dtype=np.int64)
+    return ex_queries, ex_rows
+
+
+def top_k(matrix, queries, k=1, exclude=None, row_scale=None, block_size=50000, query_batch_size=1024):
+    """
+    Rows of `matrix` with the highest dot product with each query.
+
+    Parameters
+    ----------
+      matrix: array, shape (n, d)
+        Vectors to search (may be memory-mapped, it is only read block by block).
+
+      queries: array, shape (q, d) or (d,)
+        Query vectors.
+
+      k: int, default: 1
+        Number of neighbors to return (at most n).
+
+      exclude: list of lists of ints, default: None
+        For each query, row ids that must not be returned. If fewer than `k` rows remain,
+        excluded rows fill the end of the answer with a score of -inf.
+
+      row_scale: array, shape (n,), default: None
+        Scores of row i are multiplied by row_scale[i] (e.g. inverse row norms for cosine similarity).
+
+      block_size: int, default: 50000
+        Number of rows of `matrix` scored at once.
+
+      query_batch_size: int, default: 1024
+        Number of queries scored at once.
+
+    Returns
+    -------
+      ids: array, shape (q, k) or (k,)
+        Row ids, by decreasing score.
+
+      scores: array, shape (q, k) or (k,)
+        Corresponding scores.
+    """
+    queries = np.asarray(queries)
+    single = queries.ndim == 1
+    queries = np.atleast_2d(queries)
+    dtype = np.result_type(matrix.dtype, queries.dtype, np.float32)
+    queries = queries.astype(dtype, copy=False)
+
+    def score_block(q_start, q_end, block, start, end):
+        block_scores = np.dot(queries[q_start:q_end], block.T)
+        if row_scale is not None:
+            block_scores *= row_scale[start:end]
+        return block_scores
+
+    ids, scores = _blocked_top_k(matrix, len(queries), score_block, k, exclude, dtype, block_size, query_batch_size)
+    if single:
+        return ids[0], scores[0]
+    return ids, scores
+
+
+def _blocked_top_k(matrix, n_queries, score_block, k, exclude, dtype, block_size, query_batch_size):
+    """
+    Running top-k over the rows of `matrix`, `query_batch_size` queries x `block_size` rows at a time.
+    `score_block(q_start, q_end, block, start, end)` returns the scores of queries [q_start, q_end) against
+    `block`, the rows [start, end) of `matrix`.
+    """
+    n = len(matrix)
+    k = min(k, n)
+    ids = np.empty((n_queries, k), dtype=np.int64)
+    scores = np.empty((n_queries, k), dtype=dtype)
+    ex_queries, ex_rows = _flatten_exclude(exclude, n_queries)
+
+    for q_start in range(0, n_queries, query_batch_size):
+        q_end = min(q_start + query_batch_size, n_queries)
+        if ex_queries is not None:
+            in_batch = (ex_queries >= q_start) & (ex_queries < q_end)
+            batch_ex_queries, batch_ex_rows = ex_queries[in_batch] - q_start, ex_rows[in_batch]
+        best_ids, best_scores = None, None
+        for start in range(0, n, block_size):
+            end = min(start + block_size, n)
+            block_scores = score_block(q_start, q_end, np.asarray(matrix[start:end], dtype=dtype), start, end)
+            if ex_queries is not None:
+                in_block = (batch_ex_rows >= start) & (batch_ex_rows < end)
+                block_scores[batch_ex_queries[in_block], batch_ex_rows[in_block] - start] = -np.inf
+            block_ids, block_scores = _block_top_k(block_scores, start, k)
+            best_ids, best_scores = _merge_top_k(best_ids, best_scores, block_ids, block_scores, k)
+        ids[q_start:q_end], scores[q_start:q_end] = _sort_top_k(best_ids, best_scores)
+    return ids, scores
+
+
+def solve_analogies(matrix, a, b, c, method="add", k=1, exclude_inputs=True, row_scale=None,
+                    block_size=50000, query_batch_size=1024):
+    """
+    Answers analogy questions "`a` is to `b` as `c` is to ?" by exact search over the rows of `matrix`.
+
+    Memory is bounded by `query_batch_size` x `block_size` scores (three such blocks for "mul"), whatever
+    the number of questions or the vocabulary size: only the best `k` answers of each question are kept
+    while the vocabulary is scanned. The products are single float32 matrix multiplies, so a multithreaded
+    BLAS uses all cores.
+
+    Parameters
+    ----------
+      matrix: array, shape (n, d)
+        Word vectors (may be memory-mapped).
+
+      a, b, c: arrays of ints, shape (q,)
+        Row ids of the words of each question.
+
+      method: {"add", "mul"}, default: "add"
+        "add" is 3CosAdd (highest x . (b - a + c)), "mul" is 3CosMul (highest
+        log s(x, b) - log s(x, a) + log s(x, c) with s = (1 + cos) / 2 + 1e-5), see "Improving
+        Distributional Similarity with Lessons Learned from Word Embeddings" O. Levy et al. 2014.
+
+      k: int, default: 1
+        Number of answers per question.
+
+      exclude_inputs: bool, default: True
+        If True, the three question words are never returned.
+
+      row_scale: array, shape (n,), default: None
+        Inverse row norms (see `inverse_row_norms`) if the rows of `matrix` are not normalized.
+
+    Returns
+    -------
+      ids: array, shape (q, k)
+        Row ids of the answers, best first.
+
+      scores: array, shape (q, k)
+        Corresponding scores.
+    """
+    a, b, c = (np.asarray(x, dtype=np.int64) for x in (a, b, c))
+    dtype = np.result_type(matrix.dtype, np.float32)
+
+    def rows(ids):
+        vectors = np.asarray(matrix[ids], dtype=dtype)
+        if row_scale is not None:
+            vectors = vectors * row_scale[ids, None].astype(dtype)
+        return vectors
+
+    A, B, C = rows(a), rows(b), rows(c)
+    exclude = np.stack([a, b, c], axis=1) if exclude_inputs else None
+
+    if method == "add":
+        def score_block(q_start, q_end, block, start, end):
+            block_scores = np.dot(B[q_start:q_end] - A[q_start:q_end] + C[q_start:q_end], block.T)
+            if row_scale is not None:
+                block_scores *= row_scale[start:end]
+            return block_scores
+    elif method == "mul":
+        def score_block(q_start, q_end, block, start, end):
+            if row_scale is not None:
+                block = block * row_scale[start:end, None].astype(dtype)
+            sims = [np.log((1.0 + np.dot(X[q_start:q_end], block.T)) / 2.0 + 1e-5) for X in (A, B, C)]
+            return sims[1] - sims[0] + sims[2]
+    else:
+        raise ValueError("Unrecognized method {}".format(method))
+
+    return _blocked_top_k(matrix, len(a), score_block, k, exclude, dtype, block_size, query_batch_size)
+
+
+def row_norms(matrix, block_size=50000):
+    """L2 norm of every row of `matrix`, computed block by block."""
+    norms = np.empty(len(matrix), dtype=np.float64)
+    for start in range(0, len(matrix), block_size):
+        norms[start:start + block_size] = np.linalg.norm(matrix[start:start + block_size], axis=1)
+    return norms
+
+
+def inverse_row_norms(matrix, block_size=50000):
+    """1 / L2 norm of every row of `matrix` (0 for all-zero rows), the `row_scale` for cosine similarity."""
+    norms = row_norms(matrix, block_size)
+    return np.divide(1., norms, out=np.zeros_like(norms), where=norms > 0)
+
+
+class NeighborIndex(object):
+    """
+    Exact neighbor search over a fixed matrix.
+
+    Parameters
+    ----------
+      matrix: array, shape (n, d)
+        Vectors to search. Not copied, so it must not be modified while the index is in use.
+
+      normalize: bool, default: False
+        If True, scores are cosine similarities (row norms are computed once, the matrix is not rescaled).
+        Leave False for matrices whose rows are already normalized.
+
+      block_size: int, default: 50000
+        Number of rows scored at once, see `top_k`.
+    """
+
+    def __init__(self, matrix, normalize=False, block_size=50000):
+        self.matrix = matrix
+        self.normalize = normalize
+        self.block_size = block_size
+        self.row_scale = None
+        if normalize:
+            self.row_scale = inverse_row_norms(matrix, block_size)
+        self._dimension_ids = None
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def query(self, queries, k=1, exclude=None):
+        """
+        `k` nearest rows of each query vector, see `top_k`. Returns (ids, scores).
+        """
+        queries = np.asarray(queries)
+        if self.normalize:
+            norms = np.linalg.norm(queries, axis=-1, keepdims=True)
+            queries = queries / np.where(norms > 0, norms, 1.)
+        return top_k(self.matrix, queries, k=k, exclude=exclude, row_scale=self.row_scale,
+                     block_size=self.block_size)
+
+    def query_ids(self, ids, k=1, exclude=None):
+        """
+        `k` nearest rows of the rows `ids`, never returning a query row itself. Returns (ids, scores).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if exclude is None:
+            exclude = [[i] for i in ids]
+        else:
+            exclude = [list(e) + [i] for i, e in zip(ids, exclude)]
+        return self.query(np.asarray(self.matrix[ids]), k=k, exclude=exclude)
+
+    def top_k_per_dimension(self, k):
+        """
+        Ids of the `k` rows with the largest value in each dimension, as an array of shape (d, k),
+        by decreasing value. Cached: the matrix is scanned again only when a larger `k` is asked for.
+        """
+        k = min(k, len(self.matrix))
+        if self._dimension_ids is None or self._dimension_ids.shape[1] < k:
+            best_ids, best_scores = None, None
+            for start in range(0, len(self.matrix), self.block_size):
+                block = np.asarray(self.matrix[start:start + self.block_size]).T
+                block_ids, block_scores = _block_top_k(block, start, k)
+                best_ids, best_scores = _merge_top_k(best_ids, best_scores, block_ids, block_scores, k)
+            self._dimension_ids = _sort_top_k(best_ids, best_scores)[0]
+        return self._dimension_ids[:, :k]
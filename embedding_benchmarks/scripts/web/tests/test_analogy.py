@@ -8,7 +8,9 @@ import numpy as np
 from web.datasets.utils import _fetch_file
 from web.embedding import Embedding
 from web.datasets.analogy import fetch_google_analogy
-from web.evaluate import evaluate_analogy, evaluate_on_semeval_2012_2, evaluate_on_WordRep
+from itertools import product
+
+from web.evaluate import evaluate_analogy, evaluate_on_semeval_2012_2, evaluate_on_WordRep, _wordrep_questions
 
 
 # TODO: takes too long
@@ -53,3 +55,14 @@ def test_analogy_solver():
     assert results_mul['accuracy']['all'] >= results_add['accuracy']['all']
     assert results_mul['accuracy']['syntactic'] >= results_add['accuracy']['syntactic']
     assert results_mul['accuracy']['semantic'] >= results_add['accuracy']['semantic']
+
+
+def test_wordrep_questions():
+    X_cat = np.array([["a", "b"], ["c", "d"], ["a", "b"], ["e", "f"]], dtype=object)
+    X, y = _wordrep_questions(X_cat)
+    expected = [(list(left) + [right[0]], right[1]) for left, right in product(X_cat, X_cat)
+                if not np.array_equal(left, right)]
+    assert X.shape == (12, 3)
+    assert [(list(q), a) for q, a in zip(X[:len(expected)], y)] == expected
+    assert np.all(X[len(expected):] == 0)
+
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+ Tests for approximate nearest neighbor search
+"""
+import tempfile
+from os import path
+
+import numpy as np
+
+from web.analogy import SimpleAnalogySolver
+from web.ann import IVFIndex
+from web.embedding import Embedding
+from web.neighbors import NeighborIndex
+from web.vocabulary import Vocabulary
+
+
+def _clustered(n=2000, d=16, n_clusters=20, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(n_clusters, d)
+    return (centers[rng.randint(n_clusters, size=n)] + 0.1 * rng.randn(n, d)).astype(np.float32)
+
+
+def test_ivf_recall():
+    matrix = _clustered()
+    queries = matrix[:50] + 0.01
+    exact, _ = NeighborIndex(matrix, normalize=True).query(queries, k=10)
+    index = IVFIndex(matrix, n_lists=20, n_probe=3, normalize=True)
+    approx, _ = index.query(queries, k=10)
+    recall = np.mean([len(set(a) & set(e)) / 10. for a, e in zip(approx, exact)])
+    assert recall > 0.9
+
+    index.n_probe = index.n_lists
+    approx, _ = index.query(queries, k=10)
+    assert np.array_equal(approx, exact)
+
+
+def test_ivf_exclude_and_save():
+    matrix = _clustered(n=500)
+    index = IVFIndex(matrix, n_lists=10, n_probe=10, labels=[str(i) for i in range(500)])
+    ids, _ = index.query_ids([0, 1], k=5)
+    assert 0 not in ids[0] and 1 not in ids[1]
+
+    fname = path.join(tempfile.mkdtemp(), "index.npz")
+    index.save(fname)
+    loaded = IVFIndex.load(fname, matrix, labels=index.labels)
+    assert loaded.n_probe == 10
+    assert np.array_equal(loaded.query_ids([0, 1], k=5)[0], ids)
+    assert [w for w, _ in loaded.most_similar(matrix[3], 2)][0] == "3"
+
+
+def test_analogy_solver_with_index():
+    vectors = np.array([[1., 0., 0.], [0., 1., 0.], [1., 1., 0.], [0., 0., 1.], [1., 1., 1.]])
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    w = Embedding(Vocabulary(["a", "b", "c", "d", "e"]), vectors)
+    X = np.array([["a", "c", "d"]])
+    expected = SimpleAnalogySolver(w).predict(X)
+    index = IVFIndex(w.vectors, n_lists=2, n_probe=2)
+    assert np.array_equal(SimpleAnalogySolver(w, index=index).predict(X), expected)
@@ -49,6 +49,27 @@ def test_save_2():
     e2 = Embedding.from_word2vec(path.join(dirpath, "test.bin"), binary=True)
     assert np.array_equal(e2.vectors, vectors)
 
+def test_load_word2vec_binary_streamed():
+    dirpath = tempfile.mkdtemp()
+    w = ["a", "bb", "ccc", "d"]
+    vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+    Embedding.to_word2vec(Embedding(Vocabulary(w), vectors), path.join(dirpath, "test.bin"), binary=True)
+    # buffer smaller than a row: rows straddle refills
+    words, loaded = Embedding._from_word2vec_binary(path.join(dirpath, "test.bin"), chunk_size=5)
+    assert words == w
+    assert np.array_equal(loaded, vectors)
+
+def test_load_npy():
+    dirpath = tempfile.mkdtemp()
+    words = [u"a", u"b", u"c"]
+    vectors = np.array([[1., 2.], [2., 3.], [3., 4.]], dtype=np.float16)
+    np.save(path.join(dirpath, "test.npy"), vectors)
+    np.save(path.join(dirpath, "test.words.npy"), np.frombuffer(u"\n".join(words).encode("utf-8"), dtype=np.uint8))
+    e = Embedding.from_npy(path.join(dirpath, "test.npy"))
+    assert e.vocabulary.words == words
+    assert e.vectors.dtype == np.float32
+    assert np.array_equal(e["b"], [2., 3.])
+
 def test_save():
     url = "https://www.dropbox.com/s/5occ4p7k28gvxfj/ganalogy-sg-wiki-en-400.bin?dl=1"
     file_name = _fetch_file(url, "test")
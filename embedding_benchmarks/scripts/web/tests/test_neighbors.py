@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+ Tests for nearest neighbor search
+"""
+import numpy as np
+
+from web.embedding import Embedding
+from web.neighbors import NeighborIndex, solve_analogies, top_k
+from web.vocabulary import Vocabulary
+
+
+def test_top_k_matches_full_sort():
+    rng = np.random.RandomState(0)
+    matrix = rng.randn(1000, 20)
+    queries = rng.randn(30, 20)
+    exclude = [rng.choice(1000, 5, replace=False) for _ in range(30)]
+    ids, scores = top_k(matrix, queries, k=7, exclude=exclude, block_size=64, query_batch_size=8)
+
+    full = np.dot(queries, matrix.T)
+    for i, excluded in enumerate(exclude):
+        full[i, excluded] = -np.inf
+    expected = np.argsort(-full, axis=1)[:, :7]
+    assert np.array_equal(ids, expected)
+    assert np.allclose(scores, full[np.arange(len(full))[:, None], expected])
+
+
+def test_top_k_small_matrix():
+    matrix = np.array([[1., 0.], [0., 1.], [1., 1.]])
+    ids, scores = top_k(matrix, [1., 0.], k=10, exclude=[[0]])
+    assert list(ids) == [2, 1, 0]
+    assert scores[-1] == -np.inf
+
+
+def test_neighbor_index():
+    matrix = np.array([[1., 0.], [10., 2.], [0., 1.], [-1., -0.1]])
+    index = NeighborIndex(matrix, normalize=True, block_size=3)
+    ids, _ = index.query_ids([0, 2], k=2)
+    assert ids.tolist() == [[1, 2], [1, 0]]
+    assert index.top_k_per_dimension(2).tolist() == [[1, 0], [1, 2]]
+    assert index.top_k_per_dimension(1).tolist() == [[1], [1]]
+
+
+def test_solve_analogies_matches_dense():
+    rng = np.random.RandomState(0)
+    matrix = rng.randn(500, 10)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    questions = rng.randint(500, size=(40, 3))
+    A, B, C = (matrix[questions[:, i]] for i in range(3))
+    sims = lambda X: np.log((1.0 + np.dot(matrix, X.T)) / 2.0 + 1e-5)
+    for method, D in [("add", np.dot(matrix, (B - A + C).T)), ("mul", sims(B) - sims(A) + sims(C))]:
+        for i, row in enumerate(questions):
+            D[row, i] = -np.inf
+        ids, _ = solve_analogies(matrix, questions[:, 0], questions[:, 1], questions[:, 2], method=method,
+                                 block_size=128, query_batch_size=16)
+        assert np.array_equal(ids[:, 0], D.argmax(axis=0))
+
+
+def test_embedding_nearest_neighbors():
+    vectors = np.array([[1., 0.], [10., 2.], [0., 1.], [-1., -0.1]])
+    e = Embedding(Vocabulary(["a", "b", "c", "d"]), vectors)
+    assert e.nearest_neighbors("a", k=2) == ["b", "c"]
+    assert e.nearest_neighbors("a", k=2, exclude=["b"]) == ["c", "d"]
+    assert e.nearest_neighbors("a", k=1, metric="euclidean") == ["c"]
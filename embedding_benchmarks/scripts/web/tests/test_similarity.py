@@ -3,10 +3,14 @@
 """
  Tests for similarity solvers
 """
+import numpy as np
+import scipy.stats
+
 from web.datasets.utils import _fetch_file
 from web.embedding import Embedding
 from web.datasets.similarity import fetch_SimLex999
-from web.evaluate import evaluate_similarity
+from web.evaluate import evaluate_similarity, evaluate_categorization
+from web.vocabulary import Vocabulary
 
 def test_similarity():
     url = "https://www.dropbox.com/s/rm756kjvckxa5ol/top100-sgns-googlenews-300.bin?dl=1"
@@ -20,3 +24,24 @@ def test_similarity():
     assert result_2 > 0
     assert result_1 == result_2, "evaluate_similarity should return same result for dict and Embedding instance"
 
+
+def test_similarity_batched():
+    rng = np.random.RandomState(0)
+    words = ["w{}".format(i) for i in range(20)]
+    w = Embedding(Vocabulary(words), rng.randn(20, 5).astype(np.float32))
+    X = np.array([[words[rng.randint(20)], words[rng.randint(20)]] for _ in range(30)] +
+                 [["w1", "missing"], ["missing", "w2"]], dtype=object)
+    y = rng.rand(len(X))
+
+    scores = [w[a].dot(w[b]) for a, b in X[:30]]
+    expected = scipy.stats.spearmanr(scores, y[:30]).correlation
+    assert abs(evaluate_similarity(w, X, y) - expected) < 1e-10
+    assert evaluate_similarity(dict(zip(words, w.vectors)), X, y) == evaluate_similarity(w, X, y)
+
+
+def test_categorization_missing_words():
+    w = Embedding(Vocabulary(["a", "b", "c", "d"]), np.array([[1., 0.], [1., .1], [0., 1.], [.1, 1.]]))
+    X = np.array(["a", "b", "c", "d", "missing"])
+    y = np.array([0, 0, 1, 1, 1])
+    assert evaluate_categorization(w, X, y, seed=0, method="kmeans") >= 0.8
+
@@ -67,7 +67,11 @@ def batched(iterable, size):
     sourceiter = iter(iterable)
     while True:
         batchiter = islice(sourceiter, size)
-        yield chain([next(batchiter)], batchiter)
+        try:
+            first = next(batchiter)
+        except StopIteration:  # a StopIteration escaping a generator is an error since Python 3.7
+            return
+        yield chain([first], batchiter)
 
 
 def _open(file_, mode='r'):
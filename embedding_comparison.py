@@ -1,14 +1,18 @@
 import dill
-from embedding_benchmarks.scripts.web.embeddings import load_embedding
-from embedding_benchmarks.scripts.web.evaluate import evaluate_on_all
+import hashlib
 import heapq
 import numpy as np
+import os
 import pandas as pd
 import random
 import sys
 import time
 
-from embedding_evaluation import EmbeddingTaskEvaluator, evaluate_vectors_from_path
+from embedding_evaluation import EmbeddingTaskEvaluator, evaluate_vectors_from_path, web_scores
+from embedding_io import save_embedding
+from evaluation_scheduler import make_job, register_evaluator, run_jobs
+from result_store import ResultStore
+from vocab_index import intersect_vocabs
 
 class EmbeddingComparison(object):
     def __init__(self, num_sents, min_count, methods, comparison_name, embedding_dim=None, embedding_dim_list=None, normalize=True, fname=None):
@@ -28,29 +32,48 @@ class EmbeddingComparison(object):
         self.min_count = min_count
         self.embedding_dim_list = embedding_dim_list
         self.comparison_name = comparison_name
+        self.normalize = normalize
+        self.result_store = ResultStore()
 
         diff_dims = len(set(embedding_dim_list)) != 1  # if we are comparing embeddings of multiple dimensions, add the dimension to the method (for keeping track)
         for method, dim in zip(methods, embedding_dim_list):
             if method == 'word2vec':
                 fname = '../word2vec.txt'
             else:
-                fname = 'runs/{}/{}_{}_{}/vectors.txt'.format(method, num_sents, min_count, dim)
+                run_dir = 'runs/{}/{}_{}_{}/'.format(method, num_sents, min_count, dim)
+                fnames = [run_dir + 'vectors' + ext for ext in ['.npy', '.bin', '.txt']]
+                fname = next((f for f in fnames if os.path.exists(f)), fnames[-1])
             if diff_dims:
                 method += '_{}'.format(dim)
-            self.evaluators.append(EmbeddingTaskEvaluator(method=method, fname=fname, normalize_vects=normalize))
+            self.evaluators.append(EmbeddingTaskEvaluator(method=method, fname=fname, normalize_vects=normalize, result_store=self.result_store))
         print('intersecting vocabs...')
-        vocab_sets = [set(evaluator.embedding_dict.keys()) for evaluator in self.evaluators]
-        self.vocab_set = set.intersection(*vocab_sets)
-        print('intersected vocab len: {}'.format(len(self.vocab_set)))
-        print('intersecting embedding dicts...')
-        for evaluator in self.evaluators:
-            d = evaluator.embedding_dict
-            keys = [x for x in d.keys()]
-            for k in keys:
-                if k not in self.vocab_set:
-                    d.pop(k, None)
+        self.vocab, rows = intersect_vocabs([evaluator.vocab for evaluator in self.evaluators])
+        print('intersected vocab len: {}'.format(len(self.vocab)))
+        print('intersecting embedding matrices...')
+        for evaluator, evaluator_rows in zip(self.evaluators, rows):
+            evaluator.restrict_rows(self.vocab, evaluator_rows)
         print('done initializing!')
 
+    def share_matrices(self, shared_dir='shared_vectors'):
+        '''
+        Writes every evaluator's aligned, preprocessed matrix (restricted to the shared vocab) as .npy + vocab sidecar
+        in `shared_dir`, for worker processes to memory-map read-only. Files are named after their content, so
+        unchanged matrices are only written once. Returns {method: path}.
+        '''
+        os.makedirs(shared_dir, exist_ok=True)
+        words = '\n'.join(self.vocab.index2word).encode('utf-8')
+        paths = {}
+        for evaluator in self.evaluators:
+            mat = np.ascontiguousarray(evaluator.embedding_mat, dtype=np.float32)
+            sha = hashlib.sha1(words)
+            sha.update(mat.data)
+            path = os.path.join(shared_dir, '{}.npy'.format(sha.hexdigest()))
+            if not os.path.exists(path):
+                save_embedding(mat, self.vocab, path)
+            paths[evaluator.method] = path
+            register_evaluator(evaluator, path, self.normalize)
+        return paths
+
     def print_method(self, method):
         print()
         print("===={}====".format(method))
@@ -61,46 +84,37 @@ class EmbeddingComparison(object):
         Qualitative evaluation. gets the top 5 dimensions of each word in `words`, then prints the top 3 words in those dimensions.
         `words` is a list of strings
         '''
+        k = 3
+        n = 2
         for evaluator in self.evaluators:
             self.print_method(evaluator.method)
+            top_words = evaluator.neighbors.top_k_per_dimension(k + 1)  # one extra in case `word` is among them
             for word in words:
                 vec = evaluator.embedding_dict[word]
-                k = 3
-                n = 2
                 top_n_dims = vec.argsort()[-n:][::-1]
                 print('Word: {}'.format(word))
                 for i in range(n):
-                    print('top words in dimension {}: {}'.format(top_n_dims[i], ','.join([w for (w,v) in heapq.nlargest(k+1, evaluator.embedding_dict.items(), key=lambda x: x[1][top_n_dims[i]]) if w != word][:k])))
+                    dim_words = [w for w in evaluator.vocab.decode(top_words[top_n_dims[i]]) if w != word][:k]
+                    print('top words in dimension {}: {}'.format(top_n_dims[i], ','.join(dim_words)))
 
-    def compare_nearest_neighbors(self, words):
+    def compare_nearest_neighbors(self, words, n=5):
         print("\n==================================")
         '''
         Qualitative evaluation. Prints the nearest vectors to each word in `words`
         `words` is a list of strings
         '''
-        def closest_neighbors(evaluator, word, n=5):
-            embedding_dict = evaluator.embedding_dict
-            cos_sims = []
-            if word not in embedding_dict:
-                print('{} not in vocab'.format(word))
-                return []
-            vec = embedding_dict[word]
-            for word2, vec2 in embedding_dict.items():
-                if word == word2:
-                    continue
-                cos_sim = np.dot(vec, vec2) / (np.linalg.norm(vec) * np.linalg.norm(vec2))
-                cos_sims.append((cos_sim, word2))
-            nlargest = heapq.nlargest(n, cos_sims)
-            nlargest = [word for (sim, word) in nlargest]
-            return nlargest
-
         for evaluator in self.evaluators:
             self.print_method(evaluator.method)
+            query_words = [word for word in words if word in evaluator.vocab]
+            closest = {}
+            if query_words:  # all queries in one batch
+                neighbor_ids, _ = evaluator.neighbors.query_ids(evaluator.vocab.encode(query_words), k=n)
+                closest = dict(zip(query_words, neighbor_ids))
             for word in words:
-                nlargest = closest_neighbors(evaluator, word)
-                if not nlargest:
+                if word not in closest:
+                    print('{} not in vocab'.format(word))
                     continue
-                print('Closest words to {}: {}'.format(word, ', '.join(nlargest)))
+                print('Closest words to {}: {}'.format(word, ', '.join(evaluator.vocab.decode(closest[word]))))
 
     def compare_web(self, normalize=True):
         print("\n==================================")
@@ -108,9 +122,8 @@ class EmbeddingComparison(object):
         for evaluator in self.evaluators:
             self.print_method(evaluator.method)
             vecpath = evaluator.fname
-            w = load_embedding(vecpath, format='word2vec', normalize=normalize, lower=True, clean_words=False, load_kwargs={})
-            results = evaluate_on_all(w, categorization=False)
-            results.index = [evaluator.method]
+            scores = self.result_store.get_or_compute(vecpath, 'web', lambda: web_scores(vecpath, normalize=normalize), normalize=normalize)
+            results = pd.DataFrame([scores], index=[evaluator.method], columns=list(scores))
             frames.append(results)
             print(results)
         all_results = pd.concat(frames)
@@ -139,7 +152,7 @@ class EmbeddingComparison(object):
         return score_dict
 
     def compare_analogy(self, train_pct, iter_pct=1.0, is_sem_only=False, reg_param=0.001, regularize_all=False,
-                        multiplicative=False):
+                        multiplicative=False, batch_size=25, solver='adam'):
         print("\n==================================")
         sem_dict = {}
         syn_dict = {}
@@ -151,6 +164,8 @@ class EmbeddingComparison(object):
                 reg_param=reg_param,
                 regularize_all=regularize_all,
                 multiplicative=multiplicative,
+                batch_size=batch_size,
+                solver=solver,
             )
             print("Analogy sem/syn scores: {}".format((sem_score, syn_score)))
             method = evaluator.method
@@ -193,12 +208,7 @@ class EmbeddingComparison(object):
                         return rand_word
             
         def top_n_words_for_dim(evaluator, dim, n=5):
-            embedding_dict = evaluator.embedding_dict
-            dim_values = []
-            for word, vec in embedding_dict.items():
-                dim_values.append((vec[dim], word))
-            topn = heapq.nlargest(n, dim_values)
-            return [word for (val, word) in topn]
+            return evaluator.vocab.decode(evaluator.neighbors.top_k_per_dimension(n)[dim])
 
         for evaluator in self.evaluators:
             rand_dim = np.random.randint(0, evaluator.embedding_dim)
@@ -209,7 +219,47 @@ class EmbeddingComparison(object):
                 get_outlier(evaluator, rand_dim),
             ))
 
-    def compare_all(self, num_runs=1):
+    # (row name, task, task parameters, result -> score) of the quantitative part of compare_all, fastest to slowest
+    quantitative_rows = [
+        ('Sentiment analysis (10%)', 'sentiment', {'train_pct': .1}, None),
+        ('Sentiment analysis (30%)', 'sentiment', {'train_pct': .3}, None),
+        ('Sentiment analysis (50%)', 'sentiment', {'train_pct': .5}, None),
+        ('Sentiment analysis (100%)', 'sentiment', {'train_pct': 1.0}, None),
+
+        ('PoS classification (10%)', 'pos', {'train_pct': .1}, None),
+        ('PoS classification (30%)', 'pos', {'train_pct': .3}, None),
+        ('PoS classification (50%)', 'pos', {'train_pct': .5}, None),
+        ('PoS classification (100%)', 'pos', {'train_pct': 1.0}, None),
+
+        ('OD2 OPP', 'outlier', {'n': 2}, lambda r: r[0] / 100.0),
+        ('OD2 acc', 'outlier', {'n': 2}, lambda r: r[1] / 100.0),
+        ('OD3 OPP', 'outlier', {'n': 3}, lambda r: r[0] / 100.0),
+        ('OD3 acc', 'outlier', {'n': 3}, lambda r: r[1] / 100.0),
+    ]
+
+    def _quantitative_job(self, evaluator, shared_path, task, params, seed):
+        # outlier detection and WEB read the original vectors file (full vocab), the other tasks the shared matrix
+        fname = evaluator.fname if task in ['outlier', 'web'] else shared_path
+        normalize = True if task == 'web' else self.normalize
+        return make_job(evaluator.method, fname, task, seed=seed, normalize=normalize, **params)
+
+    def compare_all(self, num_runs=1, n_jobs=1, include_web=True):
+        '''
+        Runs every quantitative task for every method and seed as independent jobs on `n_jobs` processes
+        (see evaluation_scheduler), skipping results already in the result store, then prints the qualitative
+        comparisons and writes the scores averaged over the `num_runs` seeds to an excel file.
+        '''
+        shared_paths = self.share_matrices()
+        jobs = {}
+        for run_index in range(num_runs):
+            for evaluator in self.evaluators:
+                path = shared_paths[evaluator.method]
+                for (name, task, params, _) in self.quantitative_rows:
+                    jobs[(run_index, name, evaluator.method)] = self._quantitative_job(evaluator, path, task, params, run_index)
+                if include_web:
+                    jobs[(run_index, 'web', evaluator.method)] = self._quantitative_job(evaluator, path, 'web', {}, run_index)
+        results = run_jobs(jobs.values(), n_jobs=n_jobs, store=self.result_store)
+
         all_dfs = []  # allow for random resets
         for run_index in range(num_runs):
             for evaluator in self.evaluators:
@@ -217,66 +267,26 @@ class EmbeddingComparison(object):
 
             print('qualitative:')
             self.compare_coherency(n=3)
-            words = random.sample(list(self.vocab_set), 5)
+            words = random.sample(self.vocab.index2word.tolist(), 5)
             #self.compare_word_dimensions(words)
             self.compare_nearest_neighbors(words)
 
             print('quantitative:')
-            # this should be fastest to slowest
-            sentiment_analysis_10_results = self.compare_sentiment_analysis(train_pct=.1)
-            sentiment_analysis_30_results = self.compare_sentiment_analysis(train_pct=.3)
-            sentiment_analysis_50_results = self.compare_sentiment_analysis(train_pct=.5)
-            sentiment_analysis_results = self.compare_sentiment_analysis()
-
-            word_class_10_results = self.compare_word_classification(train_pct=.1)
-            word_class_30_results = self.compare_word_classification(train_pct=.3)
-            word_class_50_results = self.compare_word_classification(train_pct=.5)
-            word_class_results = self.compare_word_classification(train_pct=1.0)
-
-            outlier_det2_opps, outlier_det2_accs = self.compare_outlier_detection(n=2)
-            outlier_det3_opps, outlier_det3_accs = self.compare_outlier_detection(n=3)
-
-            #analogy_sem_results_10, analogy_syn_results_10 = self.compare_analogy(.1)
-            #analogy_sem_results_30, analogy_syn_results_30 = self.compare_analogy(.3)
-            #analogy_sem_results_50, analogy_syn_results_50 = self.compare_analogy(.5)
-            #analogy_sem_results, analogy_syn_results = self.compare_analogy(1.0)
-
-            result_name_pairs = [
-                #(analogy_sem_results_10, 'Analogy 10% (sem)'),
-                #(analogy_sem_results_30, 'Analogy 30% (sem)'),
-                #(analogy_sem_results_50, 'Analogy 50% (sem)'),
-                #(analogy_sem_results, 'Analogy 100% (sem)'),
-
-                #(analogy_syn_results_10, 'Analogy 10% (syn)'),
-                #(analogy_syn_results_30, 'Analogy 30% (syn)'),
-                #(analogy_syn_results_50, 'Analogy 50% (syn)'),
-                #(analogy_syn_results, 'Analogy 100% (syn)'),
-
-                (sentiment_analysis_10_results, 'Sentiment analysis (10%)'), 
-                (sentiment_analysis_30_results, 'Sentiment analysis (30%)'), 
-                (sentiment_analysis_50_results, 'Sentiment analysis (50%)'), 
-                (sentiment_analysis_results, 'Sentiment analysis (100%)'), 
-
-                (word_class_10_results, 'PoS classification (10%)'), 
-                (word_class_30_results, 'PoS classification (30%)'), 
-                (word_class_50_results, 'PoS classification (50%)'), 
-                (word_class_results, 'PoS classification (100%)'), 
-
-                (outlier_det2_opps, 'OD2 OPP'), 
-                (outlier_det2_accs, 'OD2 acc'), 
-                (outlier_det3_opps, 'OD3 OPP'), 
-                (outlier_det3_accs, 'OD3 acc'), 
-            ]
-            df = pd.DataFrame([ d for (d, name) in result_name_pairs ])
-            df.index = [ name for (d, name) in result_name_pairs ]
-            df = df.transpose()
-
-            if True:
-                web_results = self.compare_web()
+            scores = {}
+            for (name, task, params, transform) in self.quantitative_rows:
+                scores[name] = {}
+                for evaluator in self.evaluators:
+                    result = results[jobs[(run_index, name, evaluator.method)]]
+                    scores[name][evaluator.method] = transform(result) if transform else result
+            df = pd.DataFrame(scores)  # methods x scores
+
+            if include_web:
+                web_results = pd.DataFrame({evaluator.method: results[jobs[(run_index, 'web', evaluator.method)]] for evaluator in self.evaluators}).transpose()
                 all_df = web_results.join(df)
                 all_df = all_df.transpose()  # excel likes it better this way
             else:
                 all_df = df.transpose()
+            print(all_df)
 
             all_df = all_df[self.methods]  # Reorder columns to be in initial order
             all_dfs.append(all_df)
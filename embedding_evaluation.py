@@ -7,36 +7,24 @@ import sys
 import tensorflow as tf
 import time
 
+import hashlib
+
+from collections.abc import Mapping
+from dataset_cache import load_imdb_split
+from embedding_benchmarks.scripts.web.neighbors import NeighborIndex, inverse_row_norms, row_norms, solve_analogies
+from embedding_io import guess_format, load_embedding, save_embedding
 from gensim.models import word2vec
 from sklearn.linear_model import LogisticRegression
 from sklearn.neural_network import MLPClassifier
-from functools import lru_cache
-
-def write_embedding_to_file(embedding, model, fname='vectors.txt'):
-    vectors = {}
-    for word in model.vocab:
-        word_vocab = model.vocab[word]
-        word_vect = embedding[word_vocab.index]
-        vect_list = ['{:.7f}'.format(x) for x in word_vect]
-        vectors[word] = ' '.join(vect_list)
-    count = 0
-    with open(fname, 'w') as f:
-        for word in vectors:
-            if not word:
-                continue
-            try:
-                f.write(word.encode('utf-8') + ' ' + vectors[word] + '\n')
-                count += 1
-            except TypeError:
-                f.write(word + ' ' + vectors[word] + '\n')
-                count += 1
-            except:
-                pass
-    with open(fname, 'r+') as f:
-        content = f.read()
-        f.seek(0, 0)
-        f.write('{} {}\n'.format(count, embedding.shape[1]))  # write the number of vects
-        f.write(content)
+from result_store import ResultStore
+from vocab_index import VocabIndex
+
+def write_embedding_to_file(embedding, model, fname='vectors.txt', dtype=np.float32):
+    '''
+    `model` is a VocabIndex (or gensim model) whose `index2word` gives the row order of `embedding`.
+    The format is picked from the extension of `fname` (.npy, .bin or text), see embedding_io.save_embedding.
+    '''
+    save_embedding(embedding, model, fname, dtype=dtype)
 
 def evaluate(embedding, method, model):
     rel_path = 'vectors_{}.txt'.format(method)
@@ -55,36 +43,168 @@ def evaluate(embedding, method, model):
     )))
     print('done evaluating {}.'.format(method))
 
-def evaluate_vectors_from_path(vector_path, results_path):
-    os.system('python3 embedding_benchmarks/scripts/evaluate_on_all.py -f {} -o results/{}'.format(vector_path, results_path))
+def evaluate_vectors_from_path(vector_path, results_path, result_store=None):
+    '''
+    Runs the WEB evaluate_on_all script on `vector_path`, writing the results table to results/`results_path`.
+    With a `result_store` (a ResultStore), the table is kept there, so vectors that were
+    already evaluated are not evaluated again: the stored table is written instead.
+    '''
+    from embedding_benchmarks.scripts.web.datasets.utils import _get_dataset_dir
+    store = result_store
+    out_fname = os.path.join('results', results_path)
+    # the script reads relative paths from the WEB data directory
+    source = vector_path if os.path.isabs(vector_path) else os.path.join(_get_dataset_dir(verbose=0), vector_path)
+    key = store.key(source, 'web_all') if store is not None and os.path.exists(source) else None
+    if key is not None and key in store:
+        print('Using stored WEB results of {}'.format(vector_path))
+        os.makedirs('results', exist_ok=True)
+        with open(out_fname, 'w') as f:
+            f.write(store.get(key))
+        return
+    status = os.system('python3 embedding_benchmarks/scripts/evaluate_on_all.py -f {} -o {}'.format(vector_path, out_fname))
+    if key is not None and status == 0 and os.path.exists(out_fname):
+        with open(out_fname) as f:
+            store.put(key, f.read(), fname=source)
+
+def web_scores(vector_path, normalize=True):
+    '''
+    {benchmark: score} of the WEB benchmarks (without categorization) on the vectors in `vector_path`.
+    '''
+    from embedding_benchmarks.scripts.web.embeddings import load_embedding as load_web_embedding
+    from embedding_benchmarks.scripts.web.evaluate import evaluate_on_all
+    w = load_web_embedding(vector_path, format=guess_format(vector_path), normalize=normalize, lower=True, clean_words=False, load_kwargs={})
+    results = evaluate_on_all(w, categorization=False)
+    return {name: float(score) for name, score in results.iloc[0].items()}
+
+
+def prepare_embedding_matrix(embedding_mat, nonneg=False, normalize=True):
+    '''
+    Clips (`nonneg`) and L2-normalizes the rows of `embedding_mat` in bulk, as a float32 matrix.
+    The input is only copied if something has to change, so a float32 memory-mapped matrix that is
+    already non-negative / normalized stays mapped (and shared between processes).
+    All-zero rows are left as zeros instead of becoming NaNs.
+    '''
+    mat = embedding_mat
+    if mat.dtype != np.float32:
+        mat = mat.astype(np.float32)
+    if nonneg and len(mat) and mat.min() < 0:
+        mat = mat.clip(min=0.0)
+    if normalize:
+        norms = row_norms(mat).astype(np.float32)[:, None]
+        if np.all((norms == 0) | (np.abs(norms - 1.) < 1e-4)):
+            return mat
+        norms[norms == 0] = 1.
+        if mat is embedding_mat:
+            mat = mat / norms
+        else:
+            mat /= norms  # already a private copy
+    return mat
+
+
+class EmbeddingDictView(Mapping):
+    '''
+    Read-only word -> vector view over an embedding matrix, rows indexed by a VocabIndex.
+    Vectors are rows of the matrix (no copies), so they must not be modified in place.
+    '''
+    def __init__(self, vocab, embedding_mat):
+        self.vocab = vocab
+        self.embedding_mat = embedding_mat
+
+    def __getitem__(self, word):
+        return self.embedding_mat[self.vocab[word]]
+
+    def __contains__(self, word):
+        return word in self.vocab
+
+    def __iter__(self):
+        return iter(self.vocab.index2word)
+
+    def __len__(self):
+        return len(self.vocab)
 
 
 class EmbeddingTaskEvaluator(object):
-    def __init__(self, method: str, fname: str=None, normalize_vects: bool=True, nonneg: bool=False, seed_bump=0, embedding_format='normal'):
+    def __init__(self, method: str, fname: str=None, normalize_vects: bool=True, nonneg: bool=False, seed_bump=0, embedding_format='normal', mmap: bool=False,
+                 result_store=None):
         '''
         `fname` is the name of an embedding vectors file 
+        The vectors are kept as one |V| x k float32 matrix (`embedding_mat`, rows in `vocab.index2word` order);
+        `embedding_dict` is a read-only dict-style view over it.
+        With `mmap`, a float32 .npy file that needs no clipping/normalization is memory-mapped instead of read.
+        Task results are kept in `result_store` (a ResultStore or its directory; off by default),
+        keyed by the content of the vectors file, so unchanged embeddings are not re-evaluated.
         '''
-        self.embedding_dict = {}
         if fname is None:
-            fname = 'vectors_{}.txt'.format(method)
+            fname = 'vectors_{}.npy'.format(method)
+            if not os.path.exists(fname):
+                fname = 'vectors_{}.txt'.format(method)
         self.fname = fname
-        with open(fname, 'r') as f:
-            for i, line in enumerate(list(f)):
-                line = line.strip()
-                if i != 0:  # (skip header)
-                    [word, vectstring] = line.split(maxsplit=1)
-                    self.embedding_dict[word] = np.fromstring(vectstring, dtype=np.float32, sep=' ')
-                    if nonneg:
-                        self.embedding_dict[word] = self.embedding_dict[word].clip(min=0.0)
-                    if normalize_vects:
-                        self.embedding_dict[word] /= np.linalg.norm(self.embedding_dict[word])
-                    self.embedding_dim = len(self.embedding_dict[word])
+        if isinstance(result_store, str):
+            result_store = ResultStore(result_store)
+        self.result_store = result_store
+        self._matrix_params = {'normalize': normalize_vects, 'nonneg': nonneg}  # what, besides the file, the matrix depends on
+        vocab, embedding_mat = load_embedding(fname, mmap=mmap)
+        self._outlier = None  # see _outlier_evaluator
+        self._set_embedding(vocab, prepare_embedding_matrix(embedding_mat, nonneg=nonneg, normalize=normalize_vects))
+        self.embedding_dim = embedding_mat.shape[1]
         self.normalize_vects = normalize_vects
         self.method = method
         self.seed_bump = seed_bump
         random.seed(42 + self.seed_bump)
         self._setup_analogy_graph(multiplicative=True)
 
+    def _set_embedding(self, vocab, embedding_mat):
+        self.vocab = vocab
+        self.embedding_mat = embedding_mat
+        self.embedding_dict = EmbeddingDictView(vocab, embedding_mat)
+        self._neighbors = None
+        self._sent_counts = {}  # split -> (reviews x |V| count matrix, labels), see get_sent_class_features
+
+    def _cached(self, task, compute, **params):
+        '''
+        Stored result of `task` with `params` on this embedding, or `compute()` (then stored).
+        Results go through json, so tuples come back as lists.
+        '''
+        if self.result_store is None:
+            return compute()
+        params.update(self._matrix_params)
+        return self.result_store.get_or_compute(self.fname, task, compute, **params)
+
+    @property
+    def neighbors(self):
+        ''' Exact cosine neighbor index over `embedding_mat` (see web.neighbors), built on first use. '''
+        if self._neighbors is None:
+            self._neighbors = NeighborIndex(self.embedding_mat, normalize=not self.normalize_vects)
+        return self._neighbors
+
+    @neighbors.setter
+    def neighbors(self, index):
+        ''' Plugs in another index over `embedding_mat` with the same `query` interface, e.g. a web.ann.IVFIndex. '''
+        self._neighbors = index
+
+    def restrict_vocab(self, words):
+        '''
+        Keeps only the rows of `words` (all of which must be in the vocab), in that order.
+        '''
+        rows = self.vocab.encode(words, drop_unknown=False)
+        if (rows < 0).any():
+            raise KeyError('{} words are not in the vocab of {}'.format(int((rows < 0).sum()), self.fname))
+        self.restrict_rows(VocabIndex(words, self.vocab.counts[rows]), rows)
+
+    def restrict_rows(self, vocab, rows):
+        '''
+        Replaces the vocab with `vocab`, whose i-th word is row `rows[i]` of the current matrix.
+        A contiguous run of rows is kept as a view of the (possibly memory-mapped) matrix, anything else is gathered once.
+        Lets several evaluators share one aligned vocab, see EmbeddingComparison.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            embedding_mat = self.embedding_mat[rows[0]:rows[0] + len(rows)]
+        else:
+            embedding_mat = self.embedding_mat[rows]
+        self._set_embedding(vocab, embedding_mat)
+        self._matrix_params['vocab'] = hashlib.sha1('\n'.join(vocab.index2word).encode('utf-8')).hexdigest()
+
     def get_word_classification_data_pos(self, split_type='train'):
         words_and_POSs = []
         with open('evaluation_data/pos.txt') as f:
@@ -140,6 +260,15 @@ class EmbeddingTaskEvaluator(object):
         return X, y
 
     def word_classification_tasks(self, print_score=False, classification_problem='PoS', train_pct=1.0):
+        score = self._cached(
+            'word_classification', lambda: self._word_classification_score(classification_problem, train_pct),
+            classification_problem=classification_problem, train_pct=train_pct, seed=self.seed_bump,
+        )
+        if print_score:
+            print('Word classification ({}, {}%) score: {}'.format(classification_problem, int(train_pct*100), score))
+        return score
+
+    def _word_classification_score(self, classification_problem, train_pct):
         if classification_problem == 'PoS':
             X, y = self.get_word_classification_data_pos('train')
             X_test, y_test = self.get_word_classification_data_pos('test')
@@ -153,10 +282,7 @@ class EmbeddingTaskEvaluator(object):
 
         classifier = LogisticRegression()
         classifier.fit(X, y)
-        score = classifier.score(X_test, y_test)
-        if print_score:
-            print('Word classification ({}, {}%) score: {}'.format(classification_problem, int(train_pct*100), score))
-        return score
+        return float(classifier.score(X_test, y_test))
 
     def get_analogy_data(self, split_type='train', seed=0, is_sem_only=False):
         from embedding_benchmarks.scripts.web.datasets.analogy import fetch_google_analogy
@@ -222,41 +348,36 @@ class EmbeddingTaskEvaluator(object):
         y = sklearn.preprocessing.normalize(y)
         return x1s, x2s, x3s, y, query_data, answer_data, category_data
 
-    def _setup_analogy_graph(self, reg_param=0.005, multiplicative=False):
+    def _setup_analogy_graph(self, reg_param=0.005, multiplicative=False, dtype=tf.float32):
         v1, v2, v3, v4 = (None,) * 4
         v4_hat = None
         train_op = None
         loss = None
         with tf.device('/cpu:0'):
-            W1 = tf.Variable(initial_value=np.identity(self.embedding_dim), name='W1', dtype=tf.float64)
-            W2 = tf.Variable(initial_value=np.identity(self.embedding_dim), name='W2', dtype=tf.float64)
-            W3 = tf.Variable(initial_value=np.identity(self.embedding_dim), name='W3', dtype=tf.float64)
-            #b = tf.Variable(tf.zeros([self.embedding_dim], dtype=tf.float64), name='b')
-            b = tf.Variable(tf.random_uniform(shape=[self.embedding_dim], minval=-1., maxval=1., dtype=tf.float64), name='b')
-            v1 = tf.placeholder(tf.float64, shape=[None, self.embedding_dim], name='v1')
-            v2 = tf.placeholder(tf.float64, shape=[None, self.embedding_dim], name='v2')
-            v3 = tf.placeholder(tf.float64, shape=[None, self.embedding_dim], name='v3')
-            v4 = tf.placeholder(tf.float64, shape=[None, self.embedding_dim], name='v4')
-
-            v1_e = tf.expand_dims(v1, -1)  # [?, 300] -> [?, 300, 1]
-            v2_e = tf.expand_dims(v2, -1)
-            v3_e = tf.expand_dims(v3, -1)
-            matmul1s = tf.scan(lambda _, v: tf.matmul(W1, v), v1_e)
-            matmul2s = tf.scan(lambda _, v: tf.matmul(W2, v), v2_e)
-            matmul3s = tf.scan(lambda _, v: tf.matmul(W3, v), v3_e)
+            W1 = tf.Variable(initial_value=np.identity(self.embedding_dim), name='W1', dtype=dtype)
+            W2 = tf.Variable(initial_value=np.identity(self.embedding_dim), name='W2', dtype=dtype)
+            W3 = tf.Variable(initial_value=np.identity(self.embedding_dim), name='W3', dtype=dtype)
+            #b = tf.Variable(tf.zeros([self.embedding_dim], dtype=dtype), name='b')
+            b = tf.Variable(tf.random_uniform(shape=[self.embedding_dim], minval=-1., maxval=1., dtype=dtype), name='b')
+            v1 = tf.placeholder(dtype, shape=[None, self.embedding_dim], name='v1')
+            v2 = tf.placeholder(dtype, shape=[None, self.embedding_dim], name='v2')
+            v3 = tf.placeholder(dtype, shape=[None, self.embedding_dim], name='v3')
+            v4 = tf.placeholder(dtype, shape=[None, self.embedding_dim], name='v4')
+
+            # W v for every row v of the batch, as one [?, k] x [k, k] matmul
+            matmul1s = tf.matmul(v1, W1, transpose_b=True)
+            matmul2s = tf.matmul(v2, W2, transpose_b=True)
+            matmul3s = tf.matmul(v3, W3, transpose_b=True)
             if False:  # if add non-linearities
                 matmul1s = tf.tanh(matmul1s)
                 matmul2s = tf.tanh(matmul2s)
                 matmul3s = tf.tanh(matmul3s)
             if multiplicative:
                 pred_value = matmul1s * matmul2s * matmul3s
-                pred_value = tf.squeeze(pred_value)
             else:
                 pred_value = -matmul1s + matmul2s + matmul3s
-                pred_value = tf.squeeze(pred_value)
                 pred_value += b
-            v4_hat = pred_value
-            v4_hat /= tf.sqrt(tf.nn.l2_loss(pred_value) * 2)  # [?, 300]
+            v4_hat = tf.nn.l2_normalize(pred_value, 1)  # [?, 300]
 
             losses = tf.reduce_sum(tf.squared_difference(v4, v4_hat), axis=1)
             self.prediction_loss = tf.reduce_mean(losses)
@@ -284,8 +405,9 @@ class EmbeddingTaskEvaluator(object):
             self.loss += self.reg_loss
             self.train_op = self.optimizer.minimize(self.loss, self.global_step)
 
-    def _train_analogy_NN(self, x1s, x2s, x3s, y, verbose=False, iter_pct=1.0):
+    def _train_analogy_NN(self, x1s, x2s, x3s, y, verbose=False, iter_pct=1.0, batch_size=25):
         def chunker(seq, size):
+            seq = np.asarray(seq, dtype=np.float32)
             return (seq[pos:pos + size] for pos in range(0, len(seq), size))
         config = tf.ConfigProto(
             allow_soft_placement=True,
@@ -299,7 +421,7 @@ class EmbeddingTaskEvaluator(object):
             for _ in range(n_iters):
                 if verbose:
                     print('running batches...')
-                for x1s_batch, x2s_batch, x3s_batch, y_batch in zip(chunker(x1s, 25), chunker(x2s, 25), chunker(x3s, 25), chunker(y, 25)):
+                for x1s_batch, x2s_batch, x3s_batch, y_batch in zip(chunker(x1s, batch_size), chunker(x2s, batch_size), chunker(x3s, batch_size), chunker(y, batch_size)):
                     _, loss_val, step, p_loss, r_loss = sess.run([
                         self.train_op,
                         self.loss,
@@ -318,8 +440,50 @@ class EmbeddingTaskEvaluator(object):
             print('Prediction loss: {:.2f}, Regularization loss: {:.2f} (at end of training)'.format(p_loss, r_loss))
         return self.W1.eval(sess), self.W2.eval(sess), self.W3.eval(sess), self.b.eval(sess)
 
+    def _fit_analogy_ridge(self, x1s, x2s, x3s, y, reg_param, regularize_all=False):
+        '''
+        Closed-form fit of the additive model y ~ -W1 x1 + W2 x2 + W3 x3 + b (one linear solve, no TF).
+        Minimizes mean squared error + the same L2 penalty as the TF graph: reg_param * l2_loss(W3),
+        or a third of it on each of W1, W2 and W3 with `regularize_all`. The bias is not penalized.
+        '''
+        k = self.embedding_dim
+        X = np.hstack([-x1s, x2s, x3s, np.ones((len(x1s), 1))]).astype(np.float64)
+        penalty = np.zeros(3 * k + 1)
+        if regularize_all:
+            penalty[:3 * k] = reg_param / 3.
+        else:
+            penalty[2 * k:3 * k] = reg_param
+        # gradient of mean((X theta - y)^2) + (penalty / 2) * theta^2 is zero at (X^T X + N / 2 * diag(penalty)) theta = X^T y
+        gram = np.dot(X.T, X)
+        gram[np.diag_indices_from(gram)] += len(X) / 2. * penalty
+        theta = np.linalg.solve(gram, np.dot(X.T, y))
+        W1, W2, W3 = (theta[i * k:(i + 1) * k].T for i in range(3))
+        return W1, W2, W3, theta[3 * k]
+
+    def _analogy_question_ids(self, questions):
+        ''' |questions| x 3 array of the rows of the words of each analogy question (all in the vocab). '''
+        return np.array([self.vocab.encode(triple, drop_unknown=False) for triple in questions], dtype=np.int64).reshape(-1, 3)
+
     def analogy_tasks(self, train_pct=1.0, verbose=True, reg_param=.001, is_sem_only=False, iter_pct=1.0, regularize_all=False,
-                      multiplicative=False):
+                      multiplicative=False, exclude_inputs=True, batch_size=25, solver='adam'):
+        '''
+        Learns W1, W2, W3 (and b) mapping analogy questions to answers, then scores the test questions.
+        `solver` is 'adam' (minibatches of `batch_size` through the TF graph) or 'ridge'
+        (closed-form least squares, only for the additive model, i.e. `multiplicative=False`).
+        Returns (semantic accuracy, syntactic accuracy).
+        '''
+        if solver not in ['adam', 'ridge']:
+            raise ValueError('Unrecognized solver {}'.format(solver))
+        if solver == 'ridge' and multiplicative:
+            raise ValueError('The ridge solver only fits the additive model')
+        params = dict(train_pct=train_pct, reg_param=reg_param, is_sem_only=is_sem_only, iter_pct=iter_pct, regularize_all=regularize_all,
+                      multiplicative=multiplicative, exclude_inputs=exclude_inputs, batch_size=batch_size, solver=solver)
+        return tuple(self._cached(
+            'analogy', lambda: self._analogy_scores(verbose=verbose, **params), seed=self.seed_bump, **params
+        ))
+
+    def _analogy_scores(self, train_pct, verbose, reg_param, is_sem_only, iter_pct, regularize_all,
+                        multiplicative, exclude_inputs, batch_size, solver):
         x1s, x2s, x3s, y, word_X_train, word_y_train, cats_train = self.get_analogy_data(
             'train',
             seed=self.seed_bump,
@@ -340,12 +504,15 @@ class EmbeddingTaskEvaluator(object):
         if verbose:
             print("{} training words".format(len(x1s)))
             print("{} testing words".format(len(x1s_test)))
-        if reg_param != self.reg_param:
-            print('creating a new set of analogy ops due to change in reg_param')
-            print('new reg_param: {}'.format(reg_param))
-            print('regularize_all: {}'.format(regularize_all))
-            self._create_analogy_ops(reg_param, regularize_all=regularize_all)
-        W1, W2, W3, b = self._train_analogy_NN(x1s, x2s, x3s, y, iter_pct=iter_pct)
+        if solver == 'ridge':
+            W1, W2, W3, b = self._fit_analogy_ridge(x1s, x2s, x3s, y, reg_param, regularize_all=regularize_all)
+        else:
+            if reg_param != self.reg_param:
+                print('creating a new set of analogy ops due to change in reg_param')
+                print('new reg_param: {}'.format(reg_param))
+                print('regularize_all: {}'.format(regularize_all))
+                self._create_analogy_ops(reg_param, regularize_all=regularize_all)
+            W1, W2, W3, b = self._train_analogy_NN(x1s, x2s, x3s, y, iter_pct=iter_pct, batch_size=batch_size)
         print('learned NN. evaluating...')
 
         correct_syn = 0
@@ -353,12 +520,7 @@ class EmbeddingTaskEvaluator(object):
         correct_sem = 0
         total_sem = 0
 
-        ordered_embedding_words = []
-        embedding_mat = []
-        for word, vect in self.embedding_dict.items():
-            ordered_embedding_words.append(word)
-            embedding_mat.append(vect)
-        embedding_mat = np.array(embedding_mat)  # |V| x k
+        ordered_embedding_words = self.vocab.index2word
         P1 = x1s_test
         P2 = x2s_test
         P3 = x3s_test
@@ -367,8 +529,9 @@ class EmbeddingTaskEvaluator(object):
         else:
             predictions = -np.dot(W1, P1.T) + np.dot(W2, P2.T) + np.dot(W3, P3.T) + np.expand_dims(b, axis=1)
         predictions = sklearn.preprocessing.normalize(predictions)
-        dots = np.dot(embedding_mat, predictions)
-        argmaxes = np.argmax(dots, axis=0)
+        exclude = self._analogy_question_ids(word_X_test) if exclude_inputs else None
+        argmaxes, _ = self.neighbors.query(predictions.T, k=1, exclude=exclude)
+        argmaxes = argmaxes[:, 0]
         predicted_words = [ordered_embedding_words[i] for i in argmaxes]
         for predicted_word, correct_word, cat in zip(predicted_words, word_y_test, categories):
             if cat == 'syntactic':
@@ -423,106 +586,127 @@ class EmbeddingTaskEvaluator(object):
         y_data = [x[1] for x in data]
         return X_data, y_data
 
-    def get_sent_class_data(self, split_type='train'):
-        pos_Xy = []
-        neg_Xy = []
-        if split_type in ['train', 'test']:
-            fix_sent = lambda s: s.replace('<br />', '').replace(',', '').replace('.', '').replace('"', '').replace("'", '').replace('!', '').replace('?', '').replace('/', ' ').replace('(', '').replace(')', '')
-            pos_dir = 'aclImdb/{}/pos/'.format(split_type)
-            for fname in os.listdir(pos_dir):
-                with open(pos_dir + fname, 'r') as f:
-                    contents = [x.strip().lower() for x in f]
-                all_words = ' '.join(contents)
-                all_words = fix_sent(all_words)
-                pos_Xy.append((all_words, True))
-            neg_dir = 'aclImdb/{}/neg/'.format(split_type)
-            for fname in os.listdir(neg_dir):
-                with open(neg_dir + fname, 'r') as f:
-                    contents = [x.strip().lower() for x in f]
-                all_words = ' '.join(contents)
-                all_words = fix_sent(all_words)
-                neg_Xy.append((all_words, False))
-        else:
-            raise ValueError('Unrecognized split type {}'.format(split_type))
-        all_data = pos_Xy + neg_Xy
+    def _sent_class_order(self, corpus):
+        ''' Shuffled review order, seeded like the other tasks. '''
+        order = list(range(len(corpus)))
         random.seed(42 + self.seed_bump)
-        random.shuffle(all_data)
+        random.shuffle(order)
+        return order
 
-        tokenized_X = [x[0].split() for x in all_data]
-        X_data = [np.array([self.embedding_dict[w] for w in sent if w in self.embedding_dict]) for sent in tokenized_X]
-        y_data = [x[1] for x in all_data]
+    def get_sent_class_data(self, split_type='train'):
+        corpus = load_imdb_split(split_type)
+        order = self._sent_class_order(corpus)
+        remap = self.vocab.encode(corpus.tokens.index2word, drop_unknown=False)
+        X_data = []
+        for i in order:
+            ids = remap[corpus.flat[corpus.offsets[i]:corpus.offsets[i + 1]]]
+            X_data.append(self.embedding_mat[ids[ids >= 0]])
+        y_data = corpus.labels[order].tolist()
         return X_data, y_data
 
+    def get_sent_class_features(self, split_type='train'):
+        '''
+        Sum of the word vectors of every review (in the order of get_sent_class_data) and the labels,
+        as one sparse (reviews x |V|) count matrix times `embedding_mat`.
+        The count matrix is only built once per split (the tokenized reviews are cached on disk, see dataset_cache).
+        '''
+        if split_type not in self._sent_counts:
+            corpus = load_imdb_split(split_type)
+            self._sent_counts[split_type] = (corpus.count_matrix(self.vocab), corpus.labels)
+        counts, labels = self._sent_counts[split_type]
+        order = self._sent_class_order(labels)
+        return np.asarray(counts[order].dot(self.embedding_mat)), labels[order]
+
     def sentiment_analysis_tasks(self, print_score=False, train_pct=1.0):
-        X, y = self.get_sent_class_data('train')
-        X_test, y_test = self.get_sent_class_data('test')
-        X = np.array([x.sum(axis=0) for x in X])[:int(train_pct*len(X))]
+        score = self._cached('sentiment', lambda: self._sentiment_analysis_score(train_pct), train_pct=train_pct, seed=self.seed_bump)
+        if print_score:
+            print('Sentiment classification score: {}'.format(score))
+        return score
+
+    def _sentiment_analysis_score(self, train_pct):
+        X, y = self.get_sent_class_features('train')
+        X_test, y_test = self.get_sent_class_features('test')
+        X = X[:int(train_pct*len(X))]
         y = y[:int(train_pct*len(y))]
-        X_test = np.array([x.sum(axis=0) for x in X_test])
 
 
         classifier = LogisticRegression()
         classifier.fit(X, y)
-        score = classifier.score(X_test, y_test)
-        if print_score:
-            print('Sentiment classification score: {}'.format(score))
-        return score
+        return float(classifier.score(X_test, y_test))
 
-    @lru_cache(maxsize=32)
     def outlier_detection(self, verbose=True, n=3):
-        from wikisem500.src.evaluator import Evaluator
-        from wikisem500.src.embeddings import WrappedEmbedding
-        from wikisem500.src.outlier_test_group import TestGroup
-        from wikisem500.src.utils import scandir
-
-        def read_dataset_directory(d):
-            for f in scandir(d):
-                if f.name.endswith('.txt') and f.is_file():
-                    yield TestGroup.from_file(f.path)
-
-        def score_embedding(embedding, groups):
-            evaluator = Evaluator(groups)
-            evaluator.evaluate(embedding, n=n)
-            if verbose:
-                print("   RESULTS")
-                print("==============")
-                print("OPP score: %f" % evaluator.opp)
-                print("Accuracy: %f" % evaluator.accuracy)
-                print("---------------------------------")
-                print("Total number of test groups: %d" % evaluator.num_total_groups)
-                print("Number of filtered test groups: %d (%f%%)" % (evaluator.num_filtered_groups, evaluator.percent_filtered_groups))
-                print("Total number of non-OOV test cases: %d" % evaluator.num_cases)
-                print("Number of filtered cluster entities: %d/%d (mean per %% cluster: %f%%)" % (evaluator.num_filtered_cluster_items, evaluator.num_total_cluster_items, evaluator.percent_filtered_cluster_items))
-                print("Number of filtered outlier entities: %d/%d (mean per %% cluster: %f%%)" % (evaluator.num_filtered_outliers, evaluator.num_total_outliers, evaluator.percent_filtered_outliers))
-            return (evaluator.opp, evaluator.accuracy)
-
-        embedding = WrappedEmbedding.from_word2vec(self.fname, binary=False)
-        dataset = list(read_dataset_directory('wikisem500/dataset/en/'))
+        '''
+        (OPP, accuracy) of the WikiSem500 outlier detection task on the vectors file (all of it, as stored).
+        '''
+        if self.result_store is None:
+            return self._outlier_scores(verbose, n)
+        return tuple(self.result_store.get_or_compute(self.fname, 'outlier', lambda: self._outlier_scores(verbose, n), n=n))
+
+    def _outlier_evaluator(self):
+        '''
+        WikiSem500 (embedding, Evaluator) over the vectors file, built on first use: the file is read (memory-mapped
+        for .npy) and the test groups are read and resolved against it once, whatever the number of evaluations.
+        '''
+        if self._outlier is None:
+            from wikisem500.src.evaluator import Evaluator
+            from wikisem500.src.embeddings import WrappedEmbedding
+            from wikisem500.src.outlier_test_group import TestGroup
+            from wikisem500.src.utils import scandir
+
+            def read_dataset_directory(d):
+                for f in scandir(d):
+                    if f.name.endswith('.txt') and f.is_file():
+                        yield TestGroup.from_file(f.path)
+
+            vocab, vectors = load_embedding(self.fname, mmap=True)
+            self._outlier = (WrappedEmbedding(vocab, vectors), Evaluator(read_dataset_directory('wikisem500/dataset/en/')))
+        return self._outlier
+
+    def _outlier_scores(self, verbose, n):
+        embedding, evaluator = self._outlier_evaluator()
         if verbose:
             print("Scoring...")
-        opp, accuracy = score_embedding(embedding, dataset)
-        return opp, accuracy
+        evaluator.evaluate(embedding, n=n)
+        if verbose:
+            print("   RESULTS")
+            print("==============")
+            print("OPP score: %f" % evaluator.opp)
+            print("Accuracy: %f" % evaluator.accuracy)
+            print("---------------------------------")
+            print("Total number of test groups: %d" % evaluator.num_total_groups)
+            print("Number of filtered test groups: %d (%f%%)" % (evaluator.num_filtered_groups, evaluator.percent_filtered_groups))
+            print("Total number of non-OOV test cases: %d" % evaluator.num_cases)
+            print("Number of filtered cluster entities: %d/%d (mean per %% cluster: %f%%)" % (evaluator.num_filtered_cluster_items, evaluator.num_total_cluster_items, evaluator.percent_filtered_cluster_items))
+            print("Number of filtered outlier entities: %d/%d (mean per %% cluster: %f%%)" % (evaluator.num_filtered_outliers, evaluator.num_total_outliers, evaluator.percent_filtered_outliers))
+        return float(evaluator.opp), float(evaluator.accuracy)
+
+    def deterministic_analogies(self, method='add', exclude_inputs=True):
+        '''
+        Answers the analogy questions without learning anything: 3CosAdd (`method='add'`) or 3CosMul (`'mul'`),
+        see web.neighbors.solve_analogies. Questions and vocabulary are streamed in blocks, so memory stays bounded.
+        Returns (semantic accuracy, syntactic accuracy).
+        '''
+        return tuple(self._cached(
+            'deterministic_analogy', lambda: self._deterministic_analogy_scores(method, exclude_inputs),
+            method=method, exclude_inputs=exclude_inputs,
+        ))
 
-    def deterministic_analogies(self):
-        x1s, x2s, x3s, y, word_X, word_y, cats = self.get_analogy_data('all', is_sem_only=False)
+    def _deterministic_analogy_scores(self, method, exclude_inputs):
+        _, _, _, _, word_X, word_y, cats = self.get_analogy_data('all', is_sem_only=False)
         correct_syn = 0
         total_syn = 0
         correct_sem = 0
         total_sem = 0
 
-        ordered_embedding_words = []
-        embedding_mat = []
-        for word, vect in self.embedding_dict.items():
-            ordered_embedding_words.append(word)
-            embedding_mat.append(vect)
-        embedding_mat = np.array(embedding_mat)  # |V| x k
-        P1 = x1s
-        P2 = x2s
-        P3 = x3s
-        predictions = -P1.T + P2.T + P3.T
-        predictions = sklearn.preprocessing.normalize(predictions)
-        dots = np.dot(embedding_mat, predictions)
-        argmaxes = np.argmax(dots, axis=0)
+        ordered_embedding_words = self.vocab.index2word
+        question_ids = self._analogy_question_ids(word_X)
+        argmaxes, _ = solve_analogies(
+            self.embedding_mat, question_ids[:, 0], question_ids[:, 1], question_ids[:, 2],
+            method=method,
+            exclude_inputs=exclude_inputs,
+            row_scale=None if self.normalize_vects else inverse_row_norms(self.embedding_mat),
+        )
+        argmaxes = argmaxes[:, 0]
         predicted_words = [ordered_embedding_words[i] for i in argmaxes]
         for predicted_word, correct_word, cat in zip(predicted_words, word_y, cats):
             if cat == 'syntactic':
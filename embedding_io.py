@@ -0,0 +1,120 @@
+import numpy as np
+import os
+import warnings
+
+from vocab_index import VocabIndex
+
+
+def guess_format(fname):
+    '''
+    Format of an embedding file, by extension (named like the `format` argument of web's `load_embedding`):
+        .npy -> 'npy' (raw matrix + VocabIndex sidecar), .bin -> 'word2vec_bin', anything else -> 'word2vec' (text)
+    '''
+    ext = os.path.splitext(fname)[1]
+    if ext == '.npy':
+        return 'npy'
+    elif ext == '.bin':
+        return 'word2vec_bin'
+    return 'word2vec'
+
+
+def npy_vocab_fname(fname):
+    ''' `vectors.npy` -> `vectors` (prefix of the VocabIndex sidecar files) '''
+    return os.path.splitext(fname)[0]
+
+
+def save_embedding(embedding, vocab, fname, dtype=np.float32, precision=7, chunk_size=10000):
+    '''
+    Writes `embedding` (|V| x k, rows in `vocab.index2word` order) to `fname`, in the format given by its extension.
+    Single pass: the header is known up front, so rows are streamed out in chunks and never re-read.
+
+    `dtype` is the on-disk float type of the .npy format (e.g. np.float16 to halve the file size).
+    The word2vec binary format is float32 by definition, and `precision` only applies to text.
+    Empty words are skipped in the word2vec formats (the readers can't parse them).
+    '''
+    fmt = guess_format(fname)
+    words = vocab.index2word
+    if fmt == 'npy':
+        out = np.lib.format.open_memmap(fname, mode='w+', dtype=dtype, shape=embedding.shape)
+        for start in range(0, len(embedding), chunk_size):
+            out[start:start + chunk_size] = embedding[start:start + chunk_size]
+        out.flush()
+        del out
+        if not isinstance(vocab, VocabIndex):
+            vocab = VocabIndex(list(words))
+        vocab.save(npy_vocab_fname(fname))
+        return
+
+    rows = np.array([i for i, word in enumerate(words) if word], dtype=np.int64)
+    dim = embedding.shape[1]
+    row_fmt = ' '.join(['%.{}f'.format(precision)] * dim)
+    with open(fname, 'wb') as f:
+        f.write('{} {}\n'.format(len(rows), dim).encode('utf-8'))
+        for start in range(0, len(rows), chunk_size):
+            chunk_rows = rows[start:start + chunk_size]
+            block = np.asarray(embedding[chunk_rows], dtype=np.float32)
+            if fmt == 'word2vec_bin':
+                f.write(b''.join(words[i].encode('utf-8') + b' ' + vec.tobytes() + b'\n' for i, vec in zip(chunk_rows, block)))
+            else:
+                f.write(''.join('{} {}\n'.format(words[i], row_fmt % tuple(vec)) for i, vec in zip(chunk_rows, block)).encode('utf-8'))
+
+
+def load_embedding(fname, mmap=False):
+    '''
+    Reads an embedding written by `save_embedding` (or any word2vec text/binary file).
+    Returns (VocabIndex, |V| x k matrix). With `mmap`, a .npy matrix is memory-mapped read-only instead of read.
+    Words repeated in a word2vec file keep their first vector, with a warning, instead of failing the load.
+    '''
+    fmt = guess_format(fname)
+    if fmt == 'npy':
+        vocab = VocabIndex.load(npy_vocab_fname(fname), mmap=mmap)
+        return vocab, np.load(fname, mmap_mode='r' if mmap else None)
+    elif fmt == 'word2vec_bin':
+        words, matrix = _load_word2vec_binary(fname)
+    else:
+        words, matrix = _load_word2vec_text(fname)
+    first = {}
+    for i, word in enumerate(words):
+        first.setdefault(word, i)
+    if len(first) != len(words):
+        warnings.warn('{}: dropping {} repeated words (keeping their first vector)'.format(fname, len(words) - len(first)))
+        rows = np.array(sorted(first.values()), dtype=np.int64)
+        words, matrix = [words[i] for i in rows], matrix[rows]
+    return VocabIndex(words), matrix
+
+
+def _load_word2vec_binary(fname, chunk_size=1 << 20):
+    ''' Streams the file through a `chunk_size` buffer, so only the matrix is held in memory, not the raw file. '''
+    with open(fname, 'rb') as f:
+        vocab_size, dim = map(int, f.readline().split())
+        words = []
+        matrix = np.empty((vocab_size, dim), dtype=np.float32)
+        nbytes = 4 * dim
+        data, pos = b'', 0
+        for i in range(vocab_size):
+            while True:
+                while data[pos:pos + 1] == b'\n':  # some writers put a newline after each vector, some don't
+                    pos += 1
+                end = data.find(b' ', pos)
+                if end != -1 and end + 1 + nbytes <= len(data):
+                    break
+                more = f.read(max(chunk_size, nbytes + 1))
+                if not more:
+                    raise ValueError('{}: file ends after {} of {} words'.format(fname, i, vocab_size))
+                data, pos = data[pos:] + more, 0
+            words.append(data[pos:end].decode('utf-8', errors='replace'))
+            matrix[i] = np.frombuffer(data, dtype=np.float32, count=dim, offset=end + 1)
+            pos = end + 1 + nbytes
+    return words, matrix
+
+
+def _load_word2vec_text(fname):
+    with open(fname, 'r') as f:
+        vocab_size, dim = map(int, f.readline().split())
+        words = []
+        matrix = np.empty((vocab_size, dim), dtype=np.float32)
+        for line in f:
+            [word, vectstring] = line.strip().split(maxsplit=1)
+            matrix[len(words)] = np.fromstring(vectstring, dtype=np.float32, sep=' ')
+            words.append(word)
+    return words, matrix[:len(words)]
@@ -0,0 +1,103 @@
+'''
+Runs independent (method x task x parameters x seed) evaluation jobs on a process pool.
+
+Jobs whose result is already in the ResultStore (keyed by the content hash of the vectors file plus the
+task configuration) are skipped, so re-running a comparison only computes what changed.
+Workers memory-map the vectors read-only (see EmbeddingComparison.share_matrices), so the
+embedding matrices are shared through the page cache instead of being copied into every process.
+'''
+from collections import namedtuple
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    # not in requirements.txt; scikit-learn bundles it
+    from sklearn.externals.joblib import Parallel, delayed
+
+from result_store import ResultStore
+
+EvalJob = namedtuple('EvalJob', ['method', 'fname', 'task', 'params', 'seed'])
+EvalJob.__doc__ = '''
+One evaluation: `task` on the vectors in `fname`, labelled `method`.
+`params` is a tuple of sorted (name, value) pairs (so that jobs are hashable), always including `normalize`.
+`seed` is the evaluator's seed_bump, None for tasks that don't depend on it.
+'''
+
+
+def make_job(method, fname, task, seed=None, **params):
+    if not TASKS[task].seeded:
+        seed = None
+    return EvalJob(method, fname, task, tuple(sorted(params.items())), seed)
+
+
+_evaluators = {}  # (fname, normalize) -> EmbeddingTaskEvaluator, reused by all the jobs a process runs
+
+def register_evaluator(evaluator, fname, normalize):
+    ''' Lets jobs on `fname` run in this process reuse `evaluator` (e.g. with n_jobs=1) instead of loading a new one. '''
+    _evaluators[(fname, normalize)] = evaluator
+
+def _get_evaluator(job):
+    from embedding_evaluation import EmbeddingTaskEvaluator
+    normalize = dict(job.params)['normalize']
+    key = (job.fname, normalize)
+    if key not in _evaluators:
+        # results are stored per job by run_jobs, the evaluator doesn't need its own store
+        _evaluators[key] = EmbeddingTaskEvaluator(method=job.method, fname=job.fname, normalize_vects=normalize, mmap=True, result_store=None)
+    evaluator = _evaluators[key]
+    if job.seed is not None:
+        evaluator.seed_bump = job.seed
+    return evaluator
+
+
+def _sentiment(job, train_pct, normalize):
+    return _get_evaluator(job).sentiment_analysis_tasks(train_pct=train_pct)
+
+def _pos(job, train_pct, normalize):
+    return _get_evaluator(job).word_classification_tasks(classification_problem='PoS', train_pct=train_pct)
+
+def _outlier(job, n, normalize):
+    return list(_get_evaluator(job).outlier_detection(verbose=False, n=n))
+
+def _web(job, normalize):
+    from embedding_evaluation import web_scores
+    return web_scores(job.fname, normalize=normalize)
+
+Task = namedtuple('Task', ['run', 'seeded'])
+TASKS = {
+    'sentiment': Task(_sentiment, seeded=True),
+    'pos': Task(_pos, seeded=True),
+    'outlier': Task(_outlier, seeded=False),
+    'web': Task(_web, seeded=False),
+}
+
+
+def _job_key(store, job):
+    # unseeded jobs have the same key as the result stored by e.g. EmbeddingComparison.compare_web
+    params = dict(job.params)
+    if job.seed is not None:
+        params['seed'] = job.seed
+    return store.key(job.fname, job.task, **params)
+
+
+def _run_job(job, store_root, key):
+    value = TASKS[job.task].run(job, **dict(job.params))
+    ResultStore(store_root).put(key, value, method=job.method, task=job.task, params=dict(job.params), seed=job.seed)
+    return value
+
+
+def run_jobs(jobs, n_jobs=1, store=None, verbose=True):
+    '''
+    Runs every EvalJob in `jobs` that is not in `store` yet on `n_jobs` processes, and returns {job: result}.
+    Each result is stored as soon as its job finishes, so an interrupted run keeps what it computed.
+    With `n_jobs=1`, jobs run in this process (see `register_evaluator`).
+    '''
+    store = store or ResultStore()
+    jobs = list(set(jobs))
+    keys = {job: _job_key(store, job) for job in jobs}
+    results = {job: store.get(keys[job]) for job in jobs if keys[job] in store}
+    todo = [job for job in jobs if job not in results]
+    if verbose:
+        print('{} of {} evaluation jobs already done, running {} on {} processes'.format(len(results), len(jobs), len(todo), n_jobs))
+    todo.sort(key=lambda job: (job.fname, job.task))  # consecutive jobs of a worker tend to share an evaluator
+    values = Parallel(n_jobs=n_jobs)(delayed(_run_job)(job, store.root, keys[job]) for job in todo)
+    results.update(zip(todo, values))
+    return results
@@ -6,6 +6,7 @@ This package contains implementations of various streaming corpus I/O format.
 from .indexedcorpus import IndexedCorpus # must appear before the other classes
 
 from .mmcorpus import MmCorpus
+from .csrcorpus import CsrCorpus
 from .bleicorpus import BleiCorpus
 from .svmlightcorpus import SvmLightCorpus
 from .lowcorpus import LowCorpus
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+
+"""
+Corpus in a binary, memory-mapped CSR (compressed sparse row) format.
+
+The corpus `fname` is stored in four files:
+
+* `fname`: a small pickled header (number of documents, features and non-zeros),
+* `fname.indptr.npy`: the offsets index, document `i` is stored at positions
+  `indptr[i]:indptr[i + 1]` of the two arrays below,
+* `fname.indices.npy`: the feature ids of all documents, one after another,
+* `fname.data.npy`: the corresponding feature weights.
+
+The arrays are memory-mapped, so opening a corpus reads no data, iteration runs at
+memory-bandwidth speed (no text parsing) and `corpus[docno]` is O(1) without a
+separate index file. Use `mm2csr` to convert a corpus in the Matrix Market format.
+"""
+
+
+import logging
+import os
+
+import numpy
+import scipy.sparse
+from numpy.lib.format import open_memmap
+
+from gensim import utils
+from gensim.corpora import IndexedCorpus, MmCorpus
+from six.moves import xrange, zip as izip
+
+
+logger = logging.getLogger('gensim.corpora.csrcorpus')
+
+
+def _array_fnames(fname):
+    return [fname + '.%s.npy' % name for name in ('indptr', 'indices', 'data')]
+
+
+def _index_dtype(num_nnz):
+    # indptr and indices share their dtype, so that scipy.sparse uses the arrays as they are
+    return numpy.int32 if num_nnz < 2 ** 31 else numpy.int64
+
+
+class CsrCorpus(IndexedCorpus):
+    """
+    Corpus in the binary CSR format, see the module docstring.
+    """
+    def __init__(self, fname, mmap='r'):
+        """
+        Open the corpus stored under `fname`. The arrays are memory-mapped with mode
+        `mmap` (None loads them into memory instead).
+        """
+        IndexedCorpus.__init__(self, fname)
+        self.fname = fname
+        if os.path.getsize(fname) == 0:
+            self.num_docs = self.num_terms = self.num_nnz = 0
+            self.indptr = numpy.zeros(1, dtype=numpy.int32)
+            self.indices = numpy.zeros(0, dtype=numpy.int32)
+            self.data = numpy.zeros(0)
+        else:
+            header = utils.unpickle(fname)
+            self.num_docs, self.num_terms, self.num_nnz = header['num_docs'], header['num_terms'], header['num_nnz']
+            self.indptr, self.indices, self.data = [numpy.load(array_fname, mmap_mode=mmap)
+                                                    for array_fname in _array_fnames(fname)]
+        # the document number is its own offset, see `docbyoffset`
+        self.index = numpy.arange(self.num_docs)
+        logger.info("loaded %s", self)
+
+    def __len__(self):
+        return self.num_docs
+
+    def __str__(self):
+        return ("CsrCorpus(%i documents, %i features, %i non-zero entries)" %
+                (self.num_docs, self.num_terms, self.num_nnz))
+
+    def __iter__(self):
+        """
+        Iterate over the documents, as lists of (feature id, weight) 2-tuples.
+        """
+        for chunk in self.iter_csr():
+            indices, data = chunk.indices.tolist(), chunk.data.tolist()  # one conversion per chunk, not per entry
+            indptr = chunk.indptr.tolist()
+            for start, end in izip(indptr, indptr[1:]):
+                yield list(izip(indices[start:end], data[start:end]))
+
+    def iter_csr(self, chunksize=10000):
+        """
+        Iterate over the corpus as scipy.sparse CSR matrices of `chunksize` documents
+        (#documents x num_terms), whose arrays are views into the memory-mapped files.
+        """
+        for start in xrange(0, self.num_docs, chunksize):
+            end = min(start + chunksize, self.num_docs)
+            yield self.csr_rows(start, end)
+
+    def csr_rows(self, start, end):
+        """Return documents `start:end` as a scipy.sparse CSR matrix (a view, no copy of the data)."""
+        first, last = self.indptr[start], self.indptr[end]
+        return scipy.sparse.csr_matrix(
+            (self.data[first: last], self.indices[first: last], self.indptr[start: end + 1] - first),
+            shape=(end - start, self.num_terms), copy=False)
+
+    def docbyoffset(self, offset):
+        """Return the document number `offset` (O(1), the offsets are in `indptr`)."""
+        start, end = self.indptr[offset], self.indptr[offset + 1]
+        return list(izip(self.indices[start:end].tolist(), self.data[start:end].tolist()))
+
+    @staticmethod
+    def _save_arrays(corpus, fname, num_docs, num_nnz, progress_cnt, dtype):
+        """
+        Write the CSR arrays of `corpus` for `save_corpus`, straight into the files if `num_docs`
+        and `num_nnz` are known. Return (number of documents, number of features, number of non-zeros).
+        """
+        indptr_fname, indices_fname, data_fname = _array_fnames(fname)
+        if num_docs is not None and num_nnz is not None:
+            index_dtype = _index_dtype(num_nnz)
+            indptr = open_memmap(indptr_fname, mode='w+', dtype=index_dtype, shape=(num_docs + 1,))
+            indices = open_memmap(indices_fname, mode='w+', dtype=index_dtype, shape=(num_nnz,))
+            data = open_memmap(data_fname, mode='w+', dtype=dtype, shape=(num_nnz,))
+            indptr[0] = 0
+        else:
+            index_dtype = numpy.int64  # until the number of non-zeros is known
+            indptr, indices, data = [0], [], []
+        pos, docno, num_terms = 0, -1, 0
+        for docno, doc in enumerate(corpus):
+            if docno % progress_cnt == 0:
+                logger.info("PROGRESS: saving document #%i", docno)
+            doc_indices = numpy.fromiter((termid for termid, _ in doc), dtype=index_dtype, count=len(doc))
+            doc_data = numpy.fromiter((weight for _, weight in doc), dtype=dtype, count=len(doc))
+            if len(doc):
+                num_terms = max(num_terms, 1 + int(doc_indices.max()))
+            if isinstance(indices, list):
+                indices.append(doc_indices)
+                data.append(doc_data)
+                indptr.append(pos + len(doc))
+            else:
+                if docno >= num_docs or pos + len(doc) > num_nnz:
+                    raise ValueError("mismatch between supplied (%i documents, %i non-zeros) and saved (at least %i, %i) "
+                                     "corpus size" % (num_docs, num_nnz, docno + 1, pos + len(doc)))
+                indices[pos: pos + len(doc)] = doc_indices
+                data[pos: pos + len(doc)] = doc_data
+                indptr[docno + 1] = pos + len(doc)
+            pos += len(doc)
+        num_docs = docno + 1
+        if isinstance(indices, list):
+            index_dtype = _index_dtype(pos)
+            numpy.save(indptr_fname, numpy.array(indptr, dtype=index_dtype))
+            numpy.save(indices_fname, numpy.concatenate(indices + [numpy.zeros(0, dtype=index_dtype)]).astype(index_dtype))
+            numpy.save(data_fname, numpy.concatenate(data + [numpy.zeros(0, dtype=dtype)]))
+        else:
+            if (num_docs, pos) != (len(indptr) - 1, len(indices)):
+                raise ValueError("mismatch between supplied (%i documents, %i non-zeros) and saved (%i, %i) corpus size" %
+                                 (len(indptr) - 1, len(indices), num_docs, pos))
+            for array in (indptr, indices, data):
+                array.flush()
+            del indptr, indices, data
+        return num_docs, num_terms, pos
+
+    @staticmethod
+    def save_corpus(fname, corpus, id2word=None, progress_cnt=10000, metadata=False, dtype=numpy.float64):
+        """
+        Save a corpus in the binary CSR format to disk, streaming it one document at a time.
+
+        If `corpus` knows its number of documents and non-zeros (`num_docs` and `num_nnz`,
+        as MmCorpus does), the arrays are written straight into the files; otherwise they
+        are collected in memory first.
+
+        This function is automatically called by `CsrCorpus.serialize`; don't
+        call it directly, call `serialize` instead.
+        """
+        logger.info("storing corpus in CSR format to %s", fname)
+        num_docs, num_nnz = getattr(corpus, 'num_docs', None), getattr(corpus, 'num_nnz', None)
+        try:
+            num_docs, num_terms, pos = CsrCorpus._save_arrays(corpus, fname, num_docs, num_nnz, progress_cnt, dtype)
+        except BaseException:
+            # don't leave half-written arrays behind
+            for array_fname in _array_fnames(fname):
+                if os.path.exists(array_fname):
+                    os.remove(array_fname)
+            raise
+        num_terms = max(num_terms, getattr(corpus, 'num_terms', 0))
+        if id2word is not None:
+            num_terms = max(num_terms, len(id2word))
+        utils.pickle({'num_docs': num_docs, 'num_terms': num_terms, 'num_nnz': pos}, fname)
+        logger.info("saved %i documents, %i features, %i non-zero entries to %s", num_docs, num_terms, pos, fname)
+
+    @classmethod
+    def serialize(serializer, fname, corpus, id2word=None, index_fname=None, progress_cnt=None, labels=None, metadata=False):
+        """
+        Save `corpus` to `fname` (see `save_corpus`). The format is indexed by itself, so
+        unlike other corpora, no separate index file is written.
+        """
+        if getattr(corpus, 'fname', None) == fname:
+            raise ValueError("identical input vs. output corpus filename, refusing to serialize: %s" % fname)
+        if progress_cnt is not None:
+            serializer.save_corpus(fname, corpus, id2word, progress_cnt=progress_cnt)
+        else:
+            serializer.save_corpus(fname, corpus, id2word)
+# endclass CsrCorpus
+
+
+def mm2csr(mm_fname, csr_fname, dtype=numpy.float64):
+    """
+    Convert the corpus in the Matrix Market file `mm_fname` to the binary CSR format
+    in `csr_fname`. The text is parsed once, and the arrays are written as it is read.
+    Return the converted corpus.
+    """
+    CsrCorpus.save_corpus(csr_fname, MmCorpus(mm_fname), dtype=dtype)
+    return CsrCorpus(csr_fname)
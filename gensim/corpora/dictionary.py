@@ -17,10 +17,11 @@ with other dictionary (:func:`Dictionary.merge_with`) etc.
 
 from __future__ import with_statement
 
-from collections import Mapping, defaultdict
+from collections import Mapping, defaultdict, deque
 import sys
 import logging
 import itertools
+import multiprocessing
 
 from gensim import utils
 
@@ -35,6 +36,14 @@ from six.moves import zip as izip
 logger = logging.getLogger('gensim.corpora.dictionary')
 
 
+def _chunk_dictionary(documents):
+    """Partial Dictionary of a chunk of documents, built in a worker process by `Dictionary.add_documents`."""
+    partial = Dictionary()
+    for document in documents:
+        partial.doc2bow(document, allow_update=True)
+    return partial
+
+
 class Dictionary(utils.SaveLoad, Mapping):
     """
     Dictionary encapsulates the mapping between normalized words and their integer ids.
@@ -42,9 +51,10 @@ class Dictionary(utils.SaveLoad, Mapping):
     The main function is `doc2bow`, which converts a collection of words to its
     bag-of-words representation: a list of (word_id, word_frequency) 2-tuples.
     """
-    def __init__(self, documents=None, prune_at=2000000):
+    def __init__(self, documents=None, prune_at=2000000, workers=1):
         """
-        If `documents` are given, use them to initialize Dictionary (see `add_documents()`).
+        If `documents` are given, use them to initialize Dictionary (see `add_documents()`,
+        also for `prune_at` and `workers`).
         """
         self.token2id = {}  # token -> tokenId
         self.id2token = {}  # reverse mapping for token2id; only formed on request, to save memory
@@ -55,7 +65,7 @@ class Dictionary(utils.SaveLoad, Mapping):
         self.num_nnz = 0  # total number of non-zeroes in the BOW matrix
 
         if documents is not None:
-            self.add_documents(documents, prune_at=prune_at)
+            self.add_documents(documents, prune_at=prune_at, workers=workers)
 
     def __getitem__(self, tokenid):
         if len(self.id2token) != len(self.token2id):
@@ -95,7 +105,7 @@ class Dictionary(utils.SaveLoad, Mapping):
     def from_documents(documents):
         return Dictionary(documents=documents)
 
-    def add_documents(self, documents, prune_at=2000000):
+    def add_documents(self, documents, prune_at=2000000, workers=1, chunksize=10000):
         """
         Update dictionary from a collection of documents. Each document is a list
         of tokens = **tokenized and normalized** strings (either utf8 or unicode).
@@ -105,9 +115,19 @@ class Dictionary(utils.SaveLoad, Mapping):
         total number of unique words <= `prune_at`. This is to save memory on very
         large inputs. To disable this pruning, set `prune_at=None`.
 
+        With `workers` > 1, chunks of `chunksize` documents are counted into partial
+        dictionaries by `workers` processes, and merged into this dictionary in
+        document order (see `merge_with`). Pruning is checked between chunks, so with
+        the default `chunksize` the result is the same as with a single process:
+        same token ids, same document frequencies. The documents must be picklable.
+
         >>> print(Dictionary(["máma mele maso".split(), "ema má máma".split()]))
         Dictionary(5 unique tokens)
         """
+        if workers > 1:
+            self._add_documents_parallel(documents, prune_at, workers, chunksize)
+            return
+
         for docno, document in enumerate(documents):
             # log progress & run a regular check for pruning, once every 10k docs
             if docno % 10000 == 0:
@@ -122,6 +142,47 @@ class Dictionary(utils.SaveLoad, Mapping):
             "built %s from %i documents (total %i corpus positions)",
             self, self.num_docs, self.num_pos)
 
+    def _add_documents_parallel(self, documents, prune_at, workers, chunksize):
+        pool = multiprocessing.Pool(workers)
+        try:
+            # keep at most 2 chunks per worker in flight, so that memory stays bounded
+            # even for huge streamed inputs (Pool.imap would read the whole input ahead)
+            chunks = utils.grouper(documents, chunksize)
+            pending = deque(pool.apply_async(_chunk_dictionary, (chunk,))
+                            for chunk in itertools.islice(chunks, 2 * workers))
+            docno = 0
+            while pending:
+                # the same pruning check as in the serial loop, once every `chunksize` docs
+                if prune_at is not None and len(self) > prune_at:
+                    self.filter_extremes(no_below=0, no_above=1.0, keep_n=prune_at)
+                logger.info("adding document #%i to %s", docno, self)
+
+                partial = pending.popleft().get()
+                for chunk in itertools.islice(chunks, 1):
+                    pending.append(pool.apply_async(_chunk_dictionary, (chunk,)))
+                self._merge_counts(partial)
+                docno += partial.num_docs
+        finally:
+            pool.terminate()
+
+        logger.info(
+            "built %s from %i documents (total %i corpus positions)",
+            self, self.num_docs, self.num_pos)
+
+    def _merge_counts(self, other):
+        """
+        Add the tokens and counts of Dictionary `other` to this dictionary, like `merge_with`
+        but without building the id transformation. New tokens get the next free ids,
+        in `other`'s id order.
+        """
+        token2id, dfs, other_dfs = self.token2id, self.dfs, other.dfs
+        for token, other_id in sorted(iteritems(other.token2id), key=lambda item: item[1]):
+            tokenid = token2id.setdefault(token, len(token2id))
+            dfs[tokenid] = dfs.get(tokenid, 0) + other_dfs.get(other_id, 0)
+        self.num_docs += other.num_docs
+        self.num_nnz += other.num_nnz
+        self.num_pos += other.num_pos
+
     def doc2bow(self, document, allow_update=False, return_missing=False):
         """
         Convert `document` (a list of words) into the bag-of-words format = list
@@ -24,7 +24,9 @@ import os
 import math
 import numpy
 import scipy.sparse as sparse
+import threading
 import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
@@ -135,14 +137,35 @@ class ShardedCorpus(IndexedCorpus):
 
     The CSR format is used for sparse data throughout.
 
+    With `shard_format='npy'`, each shard is stored as a raw .npy
+    array: dense shards in `output_prefix.N` itself, sparse shards as the CSR
+    `data` array in `output_prefix.N` plus `output_prefix.N.indices` and
+    `output_prefix.N.indptr`. These shards are memory-mapped read-only instead
+    of being unpickled, and slices that fall within one shard are returned as
+    views of the mapped shard, without copying the data (so they are
+    read-only, too: copy a batch before modifying it in place). By default,
+    shards are pickled (`shard_format='pickle'`) and retrieved batches are
+    writable, as in older versions.
+
     Internally, to retrieve data, the dataset keeps track of which shard is
     currently open and on a `__getitem__` request, either returns an item from
     the current shard, or opens a new one. The shard size is constant, except
     for the last shard.
+
+    Loaded shards are kept in a small LRU cache of `cache_size` shards, so that
+    random access (e.g. shuffled minibatch slices) does not re-read the same
+    few shards over and over. With `prefetch` set, opening shard n also starts
+    reading shard n+1 in a background thread, so that sequential passes over
+    the data do not stall at every shard boundary:
+
+    >>> sh_corpus.prefetch = True
+    >>> for batch_start in range(0, len(sh_corpus), 50):
+    ...     batch = sh_corpus[batch_start:batch_start + 50]
     """
     def __init__(self, output_prefix, corpus, dim=None,
                  shardsize=4096, overwrite=False, sparse_serialization=False,
-                 sparse_retrieval=False, gensim=False):
+                 sparse_retrieval=False, gensim=False, prefetch=False,
+                 cache_size=2, shard_format='pickle'):
         """Initializes the dataset. If `output_prefix` is not found,
         builds the shards.
 
@@ -213,7 +236,27 @@ class ShardedCorpus(IndexedCorpus):
             sparse vectors (list of tuples (id, value)) to make it behave like
             any other gensim corpus. This **will** slow the dataset down.
 
+        :type prefetch: bool
+        :param prefetch: If set, whenever a shard is opened, the next one is
+            read in a background thread (read-ahead), so that reading a shard
+            overlaps with consuming the previous one.
+
+        :type cache_size: int
+        :param cache_size: How many loaded shards to keep in memory (least
+            recently used ones are dropped first). At least the current shard
+            is always kept.
+
+        :type shard_format: str
+        :param shard_format: How shards are stored on disk: 'pickle' (the
+            default) or 'npy' (raw numpy arrays, memory-mapped when read;
+            faster, but retrieved dense data is read-only). Ignored when
+            cloning an existing dataset, which keeps the format it was
+            serialized in.
+
         """
+        if shard_format not in ('npy', 'pickle'):
+            raise ValueError('Unknown shard format {0}, expected "npy" or '
+                             '"pickle".'.format(shard_format))
         self.output_prefix = output_prefix
         self.shardsize = shardsize
 
@@ -228,6 +271,7 @@ class ShardedCorpus(IndexedCorpus):
         self.sparse_serialization = sparse_serialization
         self.sparse_retrieval = sparse_retrieval
         self.gensim = gensim
+        self.shard_format = shard_format
 
         # The "state" of the dataset.
         self.current_shard = None    # The current shard itself (numpy ndarray)
@@ -235,6 +279,12 @@ class ShardedCorpus(IndexedCorpus):
         self.current_offset = None   # The index into the dataset which
                                      # corresponds to index 0 of current shard
 
+        # Shard read-ahead and caching, see `load_shard`.
+        self.prefetch = prefetch
+        self.cache_size = cache_size
+        self._shard_cache = OrderedDict()  # shard number -> shard, least recently used first
+        self._prefetch = None  # (shard number, thread, result) of the shard being read ahead
+
         logger.info('Initializing sharded corpus with prefix '
                      '{0}'.format(output_prefix))
         if (not os.path.isfile(output_prefix)) or overwrite:
@@ -306,6 +356,9 @@ class ShardedCorpus(IndexedCorpus):
         self.n_shards = temp.n_shards
         self.n_docs = temp.n_docs
         self.offsets = temp.offsets
+        self.shardsize = temp.shardsize
+        self.shard_format = temp.shard_format
+        self.sparse_serialization = temp.sparse_serialization
 
         if temp.dim != self.dim:
             if self.dim is None:
@@ -319,8 +372,8 @@ class ShardedCorpus(IndexedCorpus):
 
     def save_shard(self, shard, n=None, filename=None):
         """
-        Pickle the given shard. If `n` is not given, will consider the shard
-        a new one.
+        Save the given shard in `shard_format`. If `n` is not given, will
+        consider the shard a new one.
 
         If `filename` is given, will use that file name instead of generating
         one.
@@ -333,7 +386,17 @@ class ShardedCorpus(IndexedCorpus):
 
         if not filename:
             filename = self._shard_name(n)
-        gensim.utils.pickle(shard, filename)
+        if self.shard_format == 'pickle':
+            gensim.utils.pickle(shard, filename)
+        elif self.sparse_serialization:
+            shard = sparse.csr_matrix(shard)
+            for fname, array in zip(self._shard_fnames(filename),
+                                    [shard.data, shard.indices, shard.indptr]):
+                with open(fname, 'wb') as fout:
+                    numpy.save(fout, array)
+        else:
+            with open(filename, 'wb') as fout:
+                numpy.save(fout, numpy.ascontiguousarray(shard))
 
         if new_shard:
             self.offsets.append(self.offsets[-1] + shard.shape[0])
@@ -343,7 +406,11 @@ class ShardedCorpus(IndexedCorpus):
     def load_shard(self, n):
         """
         Load (unpickle) the n-th shard as the "live" part of the dataset
-        into the Dataset object."""
+        into the Dataset object.
+
+        The shard is taken from the shard cache or from the background
+        read-ahead if possible. With `prefetch` set, starts reading the
+        next shard in the background."""
         #logger.debug('ShardedCorpus loading shard {0}, '
         #              'current shard: {1}'.format(n, self.current_shard_n))
 
@@ -351,23 +418,104 @@ class ShardedCorpus(IndexedCorpus):
         if self.current_shard_n == n:
             return
 
-        filename = self._shard_name(n)
-        if not os.path.isfile(filename):
-            raise ValueError('Attempting to load nonexistent shard no. {0}'.format(n))
-        shard = gensim.utils.unpickle(filename)
+        shard = self._get_shard(n)
 
         self.current_shard = shard
         self.current_shard_n = n
         self.current_offset = self.offsets[n]
 
+        if self.prefetch:
+            self._start_prefetch(n + 1)
+
+    def _read_shard(self, n):
+        """Read the n-th shard from disk (memory-map it, for npy shards)."""
+        filename = self._shard_name(n)
+        if not all(os.path.isfile(fname) for fname in self._shard_fnames(filename)):
+            raise ValueError('Attempting to load nonexistent shard no. {0}'.format(n))
+        if self.shard_format == 'pickle':
+            return gensim.utils.unpickle(filename)
+        if not self.sparse_serialization:
+            return numpy.load(filename, mmap_mode='r')
+        data, indices, indptr = [numpy.load(fname, mmap_mode='r')
+                                 for fname in self._shard_fnames(filename)]
+        return sparse.csr_matrix((data, indices, indptr),
+                                 shape=(len(indptr) - 1, self.dim), copy=False)
+
+    def _get_shard(self, n):
+        """
+        Return the n-th shard: from the cache, from the background read-ahead
+        (waiting for it to finish) or read from disk now, in this order.
+
+        """
+        if self._prefetch is not None and self._prefetch[0] == n:
+            self._poll_prefetch(wait=True)
+        if n in self._shard_cache:
+            shard = self._shard_cache.pop(n)  # re-inserted as the most recently used
+        else:
+            shard = self._read_shard(n)
+        self._cache_shard(n, shard)
+        return shard
+
+    def _cache_shard(self, n, shard):
+        self._shard_cache[n] = shard
+        while len(self._shard_cache) > max(self.cache_size, 1):
+            self._shard_cache.popitem(last=False)
+
+    def _start_prefetch(self, n):
+        """Start reading the n-th shard in a background thread, unless it is already cached or being read."""
+        if n >= self.n_shards or n in self._shard_cache:
+            return
+        if self._prefetch is not None:
+            if self._prefetch[0] == n:
+                return
+            self._poll_prefetch(wait=True)  # at most one read-ahead at a time
+        result = {}
+
+        def read():
+            try:
+                result['shard'] = self._read_shard(n)
+            except Exception as err:
+                result['error'] = err
+
+        thread = threading.Thread(target=read)
+        thread.daemon = True
+        thread.start()
+        self._prefetch = (n, thread, result)
+
+    def _poll_prefetch(self, wait=False):
+        """
+        If the background read-ahead has finished (with `wait`, once it
+        finishes), move its shard into the shard cache.
+
+        A failed read-ahead is dropped: the error is raised again when the shard
+        is actually requested and read synchronously.
+
+        """
+        if self._prefetch is None:
+            return
+        n, thread, result = self._prefetch
+        if thread.is_alive() and not wait:
+            return
+        thread.join()
+        self._prefetch = None
+        if 'shard' in result:
+            self._cache_shard(n, result['shard'])
+        else:
+            logger.debug('Shard no. {0} read-ahead failed: {1}'.format(n, result['error']))
+
     def reset(self):
         """
         Reset to no shard at all. Used for saving.
 
+        Also empties the shard cache (after waiting for any running
+        read-ahead), e.g. when the shards on disk change.
+
         """
         self.current_shard = None
         self.current_shard_n = None
         self.current_offset = None
+        self._poll_prefetch(wait=True)
+        self._shard_cache.clear()
 
     def shard_by_offset(self, offset):
         """
@@ -449,7 +597,7 @@ class ShardedCorpus(IndexedCorpus):
                     ''.format(new_shard_idx, new_stop, self.n_docs, n_new_shards)
                 new_stop = self.n_docs
 
-            new_shard = self[new_start:new_stop]
+            new_shard = self._get_slice(new_start, new_stop)
             new_shard_name = self._resized_shard_name(new_shard_idx)
             new_shard_names.append(new_shard_name)
 
@@ -458,17 +606,21 @@ class ShardedCorpus(IndexedCorpus):
             except Exception:
                 # Clean up on unsuccessful resize.
                 for new_shard_name in new_shard_names:
-                    os.remove(new_shard_name)
+                    for fname in self._shard_fnames(new_shard_name):
+                        if os.path.isfile(fname):
+                            os.remove(fname)
                 raise
 
             new_offsets.append(new_stop)
 
         # Move old shard files out, new ones in. Complicated due to possibility
         # of exceptions.
+        self.reset()  # Release the (possibly memory-mapped) old shards.
         old_shard_names = [self._shard_name(n) for n in xrange(self.n_shards)]
         try:
             for old_shard_n, old_shard_name in enumerate(old_shard_names):
-                os.remove(old_shard_name)
+                for fname in self._shard_fnames(old_shard_name):
+                    os.remove(fname)
         except Exception as e:
             logger.error('Exception occurred during old shard no. {0} '
                           'removal: {1}.\nAttempting to at least move '
@@ -478,7 +630,9 @@ class ShardedCorpus(IndexedCorpus):
             # new guys in.
             try:
                 for shard_n, new_shard_name in enumerate(new_shard_names):
-                    os.rename(new_shard_name, self._shard_name(shard_n))
+                    for new_fname, fname in zip(self._shard_fnames(new_shard_name),
+                                                self._shard_fnames(self._shard_name(shard_n))):
+                        os.rename(new_fname, fname)
             # If something happens when we're in this stage, we're screwed.
             except Exception as e:
                 print(e)
@@ -495,6 +649,16 @@ class ShardedCorpus(IndexedCorpus):
         """Generate the name for the n-th shard."""
         return self.output_prefix + '.' + str(n)
 
+    def _shard_fnames(self, filename):
+        """
+        All files of the shard saved as `filename`: for sparse npy shards, the
+        CSR `indices` and `indptr` arrays are stored next to it.
+
+        """
+        if self.shard_format == 'npy' and self.sparse_serialization:
+            return [filename, filename + '.indices', filename + '.indptr']
+        return [filename]
+
     def _resized_shard_name(self, n):
         """
         Generate the name for the n-th new shard temporary file when
@@ -589,94 +753,8 @@ class ShardedCorpus(IndexedCorpus):
             return l_result
 
         elif isinstance(offset, slice):
-            start = offset.start
-            stop = offset.stop
-            if stop > self.n_docs:
-                raise IndexError('Requested slice offset {0} out of range'
-                                 ' ({1} docs)'.format(stop, self.n_docs))
-
-            # - get range of shards over which to iterate
-            first_shard = self.shard_by_offset(start)
-
-            last_shard = self.n_shards - 1
-            if not stop == self.n_docs:
-                last_shard = self.shard_by_offset(stop)
-                # This fails on one-past
-                # slice indexing; that's why there's a code branch here.
-
-            #logger.debug('ShardedCorpus: Retrieving slice {0}: '
-            #              'shard {1}'.format((offset.start, offset.stop),
-            #                                 (first_shard, last_shard)))
-
-            self.load_shard(first_shard)
-
-            # The easy case: both in one shard.
-            if first_shard == last_shard:
-                s_result = self.current_shard[start - self.current_offset:
-                                            stop - self.current_offset]
-                # Handle different sparsity settings:
-                s_result = self._getitem_format(s_result)
-
-                return s_result
-
-            # The hard case: the slice is distributed across multiple shards
-            # - initialize numpy.zeros()
-            s_result = numpy.zeros((stop - start, self.dim),
-                                   dtype=self.current_shard.dtype)
-            if self.sparse_serialization:
-                s_result = sparse.csr_matrix((0, self.dim),
-                                             dtype=self.current_shard.dtype)
-
-            # - gradually build it up. We will be using three set of start:stop
-            #   indexes:
-            #    - into the dataset (these are the indexes the caller works with)
-            #    - into the current shard
-            #    - into the result
-
-            # Indexes into current result rows. These are always smaller than
-            # the dataset indexes by `start` (as we move over the shards,
-            # we're moving by the same number of rows through the result).
-            result_start = 0
-            result_stop = self.offsets[self.current_shard_n + 1] - start
-
-            # Indexes into current shard. These are trickiest:
-            #  - if in starting shard, these are from (start - current_offset)
-            #    to self.shardsize
-            #  - if in intermediate shard, these are from 0 to self.shardsize
-            #  - if in ending shard, these are from 0
-            #    to (stop - current_offset)
-            shard_start = start - self.current_offset
-            shard_stop = self.offsets[self.current_shard_n + 1] - \
-                         self.current_offset
-
-            #s_result[result_start:result_stop] = self.current_shard[
-            #                                         shard_start:shard_stop]
-            s_result = self.__add_to_slice(s_result, result_start, result_stop,
-                                           shard_start, shard_stop)
-
-            # First and last get special treatment, these are in between
-            for shard_n in xrange(first_shard+1, last_shard):
-                self.load_shard(shard_n)
-
-                result_start = result_stop
-                result_stop += self.shardsize
-                shard_start = 0
-                shard_stop = self.shardsize
-
-                s_result = self.__add_to_slice(s_result, result_start,
-                                               result_stop, shard_start,
-                                               shard_stop)
-
-            # Last shard
-            self.load_shard(last_shard)
-            result_start = result_stop
-            result_stop += stop - self.current_offset
-            shard_start = 0
-            shard_stop = stop - self.current_offset
-
-            s_result = self.__add_to_slice(s_result, result_start, result_stop,
-                                           shard_start, shard_stop)
-
+            s_result = self._get_slice(offset.start, offset.stop)
+            # Handle different sparsity settings:
             s_result = self._getitem_format(s_result)
 
             return s_result
@@ -687,43 +765,61 @@ class ShardedCorpus(IndexedCorpus):
 
             return s_result
 
-    def __add_to_slice(self, s_result, result_start, result_stop, start, stop):
+    def _get_slice(self, start, stop):
         """
-        Add the rows of the current shard from `start` to `stop`
-        into rows `result_start` to `result_stop` of `s_result`.
+        Rows `start` to `stop` of the dataset, as stored in the shards (dense
+        ndarray or CSR matrix).
 
-        Operation is based on the self.sparse_serialize setting. If the shard
-        contents are dense, then s_result is assumed to be an ndarray that
-        already supports row indices `result_start:result_stop`. If the shard
-        contents are sparse, assumes that s_result has `result_start` rows
-        and we should add them up to `result_stop`.
+        If all the rows are in one shard, returns a view of that shard.
+        Otherwise, the parts of the shards over which the slice is
+        distributed are concatenated in one go.
 
-        Returns the resulting s_result.
         """
-        if (result_stop - result_start) != (stop - start):
-            raise ValueError('Result start/stop range different than stop/start'
-                             'range (%d - %d vs. %d - %d)'.format(result_start,
-                                                                  result_stop,
-                                                                  start, stop))
+        if stop > self.n_docs:
+            raise IndexError('Requested slice offset {0} out of range'
+                             ' ({1} docs)'.format(stop, self.n_docs))
 
-        # Dense data: just copy using numpy's slice notation
-        if not self.sparse_serialization:
-            s_result[result_start:result_stop] = self.current_shard[start:stop]
+        # - get range of shards over which to iterate
+        first_shard = self.shard_by_offset(start)
 
-            return s_result
+        last_shard = self.n_shards - 1
+        if not stop == self.n_docs:
+            last_shard = self.shard_by_offset(stop)
+            # This fails on one-past
+            # slice indexing; that's why there's a code branch here.
 
-        # A bit more difficult, we're using a different structure to build the
-        # result.
-        else:
-            if s_result.shape != (result_start, self.dim):
-                raise ValueError('Assuption about sparse s_result shape '
-                                 'invalid: {0} expected rows, {1} real '
-                                 'rows.'.format(result_start,
-                                                s_result.shape[0]))
-
-            tmp_matrix = self.current_shard[start:stop]
-            s_result = sparse.vstack([s_result, tmp_matrix])
-            return s_result
+        #logger.debug('ShardedCorpus: Retrieving slice {0}: '
+        #              'shard {1}'.format((start, stop),
+        #                                 (first_shard, last_shard)))
+
+        parts = []
+        for shard_n in xrange(first_shard, last_shard + 1):
+            self.load_shard(shard_n)
+            # Indexes into current shard: from (start - current_offset) in
+            # the first shard (0 in the others), up to (stop - current_offset)
+            # in the last shard (the end of the shard in the others).
+            shard_start = max(start - self.current_offset, 0)
+            shard_stop = min(stop, self.offsets[shard_n + 1]) - self.current_offset
+            parts.append(self._shard_rows(self.current_shard, shard_start, shard_stop))
+
+        # The easy case: both in one shard.
+        if len(parts) == 1:
+            return parts[0]
+
+        # The slice is distributed across multiple shards.
+        if self.sparse_serialization:
+            return sparse.vstack(parts, format='csr')
+        return numpy.concatenate(parts)
+
+    @staticmethod
+    def _shard_rows(shard, start, stop):
+        """Rows `start` to `stop` of `shard`, as a view (also for CSR shards)."""
+        if not sparse.issparse(shard):
+            return shard[start:stop]
+        first, last = shard.indptr[start], shard.indptr[stop]
+        return sparse.csr_matrix((shard.data[first:last], shard.indices[first:last],
+                                  shard.indptr[start:stop + 1] - first),
+                                 shape=(stop - start, shard.shape[1]), copy=False)
 
     def _getitem_format(self, s_result):
         if self.sparse_serialization:
@@ -785,7 +881,9 @@ class ShardedCorpus(IndexedCorpus):
 
         attrs_to_ignore = ['current_shard',
                            'current_shard_n',
-                           'current_offset']
+                           'current_offset',
+                           '_shard_cache',
+                           '_prefetch']
         if 'ignore' not in kwargs:
             kwargs['ignore'] = frozenset(attrs_to_ignore)
         else:
@@ -802,7 +900,16 @@ class ShardedCorpus(IndexedCorpus):
         """
         Load itself in clean state. `mmap` has no effect here.
         """
-        return super(ShardedCorpus, cls).load(fname, mmap)
+        result = super(ShardedCorpus, cls).load(fname, mmap)
+        # corpora saved before shard caching was added
+        if not hasattr(result, 'prefetch'):
+            result.prefetch = False
+            result.cache_size = 2
+        if not hasattr(result, 'shard_format'):
+            result.shard_format = 'pickle'
+        result._shard_cache = OrderedDict()
+        result._prefetch = None
+        return result
 
     @staticmethod
     def save_corpus(fname, corpus, id2word=None, progress_cnt=1000,
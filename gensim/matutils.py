@@ -11,6 +11,7 @@ This module contains math helper functions.
 from __future__ import with_statement
 
 
+import itertools
 import logging
 import math
 
@@ -67,7 +68,53 @@ def argsort(x, topn=None, reverse=False):
     return most_extreme.take(numpy.argsort(x.take(most_extreme)))  # resort topn into order
 
 
-def corpus2csc(corpus, num_terms=None, dtype=numpy.float64, num_docs=None, num_nnz=None, printprogress=0):
+def _chunk2arrays(docs, dtype):
+    """
+    Return the documents `docs` as (document lengths, feature ids, feature weights) arrays.
+    Documents are gensim vectors, 2d numpy arrays of (feature id, weight) rows (as from
+    `chunkize(as_numpy=True)`) or scipy.sparse row vectors.
+    """
+    if all(isinstance(doc, (list, tuple)) for doc in docs):
+        # plain gensim vectors: flatten the whole chunk into (id, weight) pairs at once
+        lengths = numpy.fromiter((len(doc) for doc in docs), dtype=numpy.int64, count=len(docs))
+        pairs = numpy.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(docs)),
+                               dtype=numpy.float64, count=2 * int(lengths.sum())).reshape(-1, 2)
+        return lengths, pairs[:, 0].astype(numpy.int32), pairs[:, 1].astype(dtype)
+    indices, data = [], []
+    for doc in docs:
+        if scipy.sparse.issparse(doc):
+            doc = doc.tocsr()
+            indices.append(doc.indices)
+            data.append(doc.data)
+        else:
+            doc = numpy.asarray(doc)
+            if doc.size and (doc.ndim != 2 or doc.shape[1] != 2):
+                raise ValueError("expected a document of (feature id, weight) pairs, got an array of shape %s" % (doc.shape,))
+            doc = doc.reshape(-1, 2)
+            indices.append(doc[:, 0])
+            data.append(doc[:, 1])
+    lengths = numpy.array([len(doc_indices) for doc_indices in indices], dtype=numpy.int64)
+    indices = numpy.concatenate(indices + [[]]).astype(numpy.int32)
+    return lengths, indices, numpy.concatenate(data + [[]]).astype(dtype)
+
+
+def iter_corpus_arrays(corpus, chunksize=10000, dtype=numpy.float64):
+    """
+    Iterate over `corpus` in chunks of `chunksize` documents, as (document lengths,
+    feature ids, feature weights) arrays, the CSR representation of the chunk without its
+    offsets. A corpus that has `iter_csr` (such as `gensim.corpora.CsrCorpus`) yields
+    its own array blocks, with no per-document conversion at all.
+    """
+    if hasattr(corpus, 'iter_csr'):
+        for chunk in corpus.iter_csr(chunksize):
+            yield numpy.diff(chunk.indptr), chunk.indices, chunk.data.astype(dtype)
+        return
+    for docs in utils.grouper(corpus, chunksize):
+        yield _chunk2arrays(docs, dtype)
+
+
+def corpus2csc(corpus, num_terms=None, dtype=numpy.float64, num_docs=None, num_nnz=None, printprogress=0,
+               chunksize=10000):
     """
     Convert a streamed corpus into a sparse matrix, in scipy.sparse.csc_matrix format,
     with documents as columns.
@@ -75,7 +122,8 @@ def corpus2csc(corpus, num_terms=None, dtype=numpy.float64, num_docs=None, num_n
     If the number of terms, documents and non-zero elements is known, you can pass
     them here as parameters and a more memory efficient code path will be taken.
 
-    The input corpus may be a non-repeatable stream (generator).
+    The input corpus may be a non-repeatable stream (generator). Documents are
+    processed `chunksize` at a time, see `iter_corpus_arrays` for the accepted formats.
 
     This is the mirror function to `Sparse2Corpus`.
 
@@ -93,39 +141,42 @@ def corpus2csc(corpus, num_terms=None, dtype=numpy.float64, num_docs=None, num_n
         pass # not a MmCorpus...
     if printprogress:
         logger.info("creating sparse matrix from corpus")
-    if num_terms is not None and num_docs is not None and num_nnz is not None:
-        # faster and much more memory-friendly version of creating the sparse csc
-        posnow, indptr = 0, [0]
+    preallocated = num_docs is not None and num_nnz is not None
+    if preallocated:
+        # more memory-friendly version: the chunks are copied straight into their place
         indices = numpy.empty((num_nnz,), dtype=numpy.int32) # HACK assume feature ids fit in 32bit integer
         data = numpy.empty((num_nnz,), dtype=dtype)
-        for docno, doc in enumerate(corpus):
-            if printprogress and docno % printprogress == 0:
-                logger.info("PROGRESS: at document #%i/%i" % (docno, num_docs))
-            posnext = posnow + len(doc)
-            indices[posnow: posnext] = [feature_id for feature_id, _ in doc]
-            data[posnow: posnext] = [feature_weight for _, feature_weight in doc]
-            indptr.append(posnext)
-            posnow = posnext
+    else:
+        # determine the sparse matrix parameters during iteration
+        indices, data = [], []
+    lengths = []
+    docno, posnow = 0, 0
+    for chunk_lengths, chunk_indices, chunk_data in iter_corpus_arrays(corpus, chunksize, dtype):
+        if printprogress and docno // printprogress != (docno + len(chunk_lengths)) // printprogress:
+            logger.info("PROGRESS: at document #%i" % (docno))
+        posnext = posnow + len(chunk_indices)
+        if preallocated:
+            assert posnext <= num_nnz, "mismatch between supplied and computed number of non-zeros"
+            indices[posnow: posnext] = chunk_indices
+            data[posnow: posnext] = chunk_data
+        else:
+            indices.append(chunk_indices)
+            data.append(chunk_data)
+        lengths.append(chunk_lengths)
+        docno += len(chunk_lengths)
+        posnow = posnext
+    if preallocated:
         assert posnow == num_nnz, "mismatch between supplied and computed number of non-zeros"
-        result = scipy.sparse.csc_matrix((data, indices, indptr), shape=(num_terms, num_docs), dtype=dtype)
     else:
-        # slower version; determine the sparse matrix parameters during iteration
-        num_nnz, data, indices, indptr = 0, [], [], [0]
-        for docno, doc in enumerate(corpus):
-            if printprogress and docno % printprogress == 0:
-                logger.info("PROGRESS: at document #%i" % (docno))
-            indices.extend([feature_id for feature_id, _ in doc])
-            data.extend([feature_weight for _, feature_weight in doc])
-            num_nnz += len(doc)
-            indptr.append(num_nnz)
-        if num_terms is None:
-            num_terms = max(indices) + 1 if indices else 0
-        num_docs = len(indptr) - 1
-        # now num_docs, num_terms and num_nnz contain the correct values
-        data = numpy.asarray(data, dtype=dtype)
-        indices = numpy.asarray(indices)
-        result = scipy.sparse.csc_matrix((data, indices, indptr), shape=(num_terms, num_docs), dtype=dtype)
-    return result
+        indices = numpy.concatenate(indices + [numpy.zeros(0, dtype=numpy.int32)])
+        data = numpy.concatenate(data + [numpy.zeros(0, dtype=dtype)])
+    if num_terms is None:
+        num_terms = int(indices.max()) + 1 if len(indices) else 0
+    if num_docs is None:
+        num_docs = docno
+    # now num_docs, num_terms and num_nnz contain the correct values
+    indptr = numpy.concatenate([[0]] + lengths).cumsum()
+    return scipy.sparse.csc_matrix((data, indices, indptr), shape=(num_terms, num_docs), dtype=dtype)
 
 
 def pad(mat, padrow, padcol):
@@ -251,19 +302,24 @@ def corpus2dense(corpus, num_terms, num_docs=None, dtype=numpy.float32):
     You can optionally supply `num_docs` (=the corpus length) as well, so that
     a more memory-efficient code path is taken.
 
+    Documents are processed in chunks, see `iter_corpus_arrays` for the accepted formats.
+
     This is the mirror function to `Dense2Corpus`.
 
     """
-    if num_docs is not None:
-        # we know the number of documents => don't bother column_stacking
-        docno, result = -1, numpy.empty((num_terms, num_docs), dtype=dtype)
-        for docno, doc in enumerate(corpus):
-            result[:, docno] = sparse2full(doc, num_terms)
-        assert docno + 1 == num_docs
-    else:
-        result = numpy.column_stack(sparse2full(doc, num_terms) for doc in corpus)
-    return result.astype(dtype)
-
+    blocks = iter_corpus_arrays(corpus, dtype=dtype)
+    if num_docs is None:
+        # unknown number of documents => collect the (sparse) chunks first
+        blocks = list(blocks)
+        num_docs = sum(len(lengths) for lengths, _, _ in blocks)
+    # fill the result chunk by chunk
+    docno, result = 0, numpy.zeros((num_terms, num_docs), dtype=dtype)
+    for lengths, indices, data in blocks:
+        docnos = numpy.repeat(numpy.arange(docno, docno + len(lengths)), lengths)
+        result[indices, docnos] = data  # like sparse2full, the last of duplicate ids wins
+        docno += len(lengths)
+    assert docno == num_docs
+    return result
 
 
 class Dense2Corpus(object):
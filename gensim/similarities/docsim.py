@@ -54,6 +54,7 @@ import logging
 import itertools
 import os
 import heapq
+import threading
 
 import numpy
 import scipy.sparse
@@ -67,8 +68,9 @@ logger = logging.getLogger(__name__)
 PARALLEL_SHARDS = False
 try:
     import multiprocessing
+    from multiprocessing.pool import ThreadPool
     # by default, don't parallelize queries. uncomment the following line if you want that.
-#    PARALLEL_SHARDS = multiprocessing.cpu_count() # use #parallel processes = #CPus
+#    PARALLEL_SHARDS = multiprocessing.cpu_count() # use #parallel threads = #CPus
 except ImportError:
     pass
 
@@ -131,6 +133,40 @@ class Shard(utils.SaveLoad):
         return index[query]
 
 
+class TailSegment(Shard):
+    """
+    A shard that is kept in memory instead of on disk: the recently added documents
+    of a `Similarity` index, until they are compacted into full disk-based shards.
+
+    Queried exactly like a `Shard`.
+
+    """
+    def __init__(self, index, num_nnz):
+        self.length = len(index)
+        self.cls = index.__class__
+        self.index = index
+        self.num_nnz = num_nnz
+
+    def __getstate__(self):
+        return self.__dict__.copy()  # nothing on disk, the index has to be pickled
+
+    def __str__(self):
+        return ("%s TailSegment(%i documents in memory)" % (self.cls.__name__, len(self)))
+
+
+def segment_index(matrix, num_features):
+    """
+    Wrap an index matrix (sparse CSR or dense, already normalized) into a
+    `SparseMatrixSimilarity` or `MatrixSimilarity` object, without copying it.
+    """
+    if scipy.sparse.issparse(matrix):
+        index = SparseMatrixSimilarity(None)
+    else:
+        index = MatrixSimilarity(None, num_features=num_features, corpus_len=0)
+    index.index = matrix
+    return index
+
+
 def query_shard(args):
     query, shard = args  # simulate starmap (not part of multiprocessing in older Pythons)
     logger.debug("querying shard %s num_best=%s in process %s", shard, shard.num_best, os.getpid())
@@ -139,6 +175,64 @@ def query_shard(args):
     return result
 
 
+def clipped_top_k(sims, topn, eps=1e-9):
+    """
+    Array version of `matutils.full2sparse_clipped` for a 2d block of similarities
+    (one row per query document).
+
+    Return `(indices, values, valid)` arrays of shape `(n_queries, min(topn, n_columns))`:
+    the column positions and values of the `topn` elements of greatest magnitude of each
+    row, by decreasing magnitude. `valid` is False for elements of magnitude <= `eps`,
+    which `full2sparse_clipped` leaves out.
+    """
+    if scipy.sparse.issparse(sims):
+        sims = sims.toarray()
+    sims = numpy.atleast_2d(numpy.asarray(sims, dtype=float))
+    rows = numpy.arange(sims.shape[0])[:, None]
+    topn = min(topn, sims.shape[1])
+    magnitudes = numpy.abs(sims)
+    if topn < sims.shape[1]:
+        indices = numpy.argpartition(-magnitudes, topn - 1, axis=1)[:, :topn]
+    else:
+        indices = numpy.tile(numpy.arange(sims.shape[1]), (sims.shape[0], 1))
+    indices = indices[rows, numpy.argsort(-magnitudes[rows, indices], axis=1, kind='mergesort')]
+    values = sims[rows, indices]
+    return indices, values, numpy.abs(values) > eps
+
+
+def query_shard_top_k(args):
+    """Query a shard with a batch of documents, return its `clipped_top_k` arrays."""
+    query, shard, topn = args
+    logger.debug("querying shard %s top %s in process %s", shard, topn, os.getpid())
+    return clipped_top_k(shard[query], topn)
+
+
+def merge_top_k(shard_results, offsets, topn):
+    """
+    Merge the `clipped_top_k` arrays of several shards (the document positions of shard
+    `i` start at `offsets[i]`) into the `topn` most similar documents of each query:
+    a list of `[(document position, similarity), ...]` lists, by decreasing similarity.
+
+    Same result as `heapq.nlargest(topn, candidates of all shards, key=similarity)` for
+    each query, but with one partition over the candidates of the whole batch.
+    """
+    indices = numpy.hstack([result[0] + offset for result, offset in izip(shard_results, offsets)])
+    values = numpy.hstack([result[1] for result in shard_results])
+    keys = numpy.where(numpy.hstack([result[2] for result in shard_results]), values, -numpy.inf)
+    rows = numpy.arange(keys.shape[0])[:, None]
+    if topn < keys.shape[1]:
+        best = numpy.argpartition(-keys, topn - 1, axis=1)[:, :topn]
+        best.sort(axis=1)  # back to shard order, so that the stable sort below breaks ties like heapq
+    else:
+        best = numpy.tile(numpy.arange(keys.shape[1]), (keys.shape[0], 1))
+    best = best[rows, numpy.argsort(-keys[rows, best], axis=1, kind='mergesort')]
+    result = []
+    for row_indices, row_values, row_keys in izip(indices[rows, best], values[rows, best], keys[rows, best]):
+        valid = row_keys > -numpy.inf
+        result.append(list(izip(row_indices[valid].tolist(), row_values[valid].tolist())))
+    return result
+
+
 class Similarity(interfaces.SimilarityABC):
     """
     Compute cosine similarity of a dynamic query against a static corpus of documents
@@ -148,6 +242,11 @@ class Similarity(interfaces.SimilarityABC):
     fits into core memory (see the `(Sparse)MatrixSimilarity` classes in this module).
     The shards themselves are simply stored as files to disk and mmap'ed back as needed.
 
+    Documents added after the index was built go to a small in-memory tail of
+    `TailSegment` objects first: adding documents (even between queries) only costs
+    O(new documents), and the tail is compacted into full disk shards in a background
+    thread, once it holds `shardsize` documents.
+
     """
     def __init__(self, output_prefix, corpus, num_features, num_best=None, chunksize=256, shardsize=32768, norm='l2'):
         """
@@ -198,27 +297,33 @@ class Similarity(interfaces.SimilarityABC):
         self.chunksize = int(chunksize)
         self.shardsize = shardsize
         self.shards = []
+        self.tail = []  # in-memory TailSegments of documents not compacted into shards yet
         self.fresh_docs, self.fresh_nnz = [], 0
+        self._pool = None  # threads querying the shards in parallel, see `query_shards`
+        self._compaction = None  # (thread, number of tail segments it compacts, result), see `_seal`
 
         if corpus is not None:
             self.add_documents(corpus)
 
     def __len__(self):
-        return len(self.fresh_docs) + sum([len(shard) for shard in self.shards])
+        return len(self.fresh_docs) + sum([len(shard) for shard in self.shards + self.tail])
 
     def __str__(self):
-        return ("Similarity index with %i documents in %i shards (stored under %s)" %
-                (len(self), len(self.shards), self.output_prefix))
+        return ("Similarity index with %i documents in %i shards and %i in-memory segments (stored under %s)" %
+                (len(self), len(self.shards), len(self.tail), self.output_prefix))
 
     def add_documents(self, corpus):
         """
         Extend the index with new documents.
 
-        Internally, documents are buffered and then spilled to disk when there's
-        `self.shardsize` of them (or when a query is issued).
+        Internally, documents are buffered and then appended to the in-memory tail
+        when there's `self.shardsize` of them (or when a query is issued). The tail is
+        written to disk as full shards by a background compaction.
         """
         min_ratio = 1.0  # 0.5 to only reopen shards that are <50% complete
-        if self.shards and len(self.shards[-1]) < min_ratio * self.shardsize:
+        self._poll_compaction()
+        if (self.shards and len(self.shards[-1]) < min_ratio * self.shardsize and
+                not (self.tail or self.fresh_docs or self._compaction)):
             # The last shard was incomplete (<; load it back and add the documents there, don't start a new shard
             self.reopen_shard()
         for doc in corpus:
@@ -235,7 +340,7 @@ class Similarity(interfaces.SimilarityABC):
             self.fresh_docs.append(doc)
             self.fresh_nnz += doclen
             if len(self.fresh_docs) >= self.shardsize:
-                self.close_shard()
+                self._seal()
             if len(self.fresh_docs) % 10000 == 0:
                 logger.info("PROGRESS: fresh_shard size=%i", len(self.fresh_docs))
 
@@ -250,58 +355,174 @@ class Similarity(interfaces.SimilarityABC):
         Force the latest shard to close (be converted to a matrix and stored
         to disk). Do nothing if no new documents added since last call.
 
+        Waits for a running background compaction, then writes the whole in-memory
+        tail to disk.
+
         **NOTE**: the shard is closed even if it is not full yet (its size is smaller
         than `self.shardsize`). If documents are added later via `add_documents()`,
         this incomplete shard will be loaded again and completed.
         """
-        if not self.fresh_docs:
-            return
-        shardid = len(self.shards)
-        # consider the shard sparse if its density is < 30%
-        issparse = 0.3 > 1.0 * self.fresh_nnz / (len(self.fresh_docs) * self.num_features)
-        if issparse:
-            index = SparseMatrixSimilarity(self.fresh_docs, num_terms=self.num_features,
-                                           num_docs=len(self.fresh_docs), num_nnz=self.fresh_nnz)
+        self._poll_compaction(wait=True)
+        self._seal(compact=False)
+        if self.tail:
+            shards, _ = self._write_shards(self.tail, flush=True)
+            self.shards.extend(shards)
+            self.tail = []
+
+    def _build_index(self, docs, num_nnz):
+        # consider the index sparse if its density is < 30%
+        if 0.3 > 1.0 * num_nnz / (len(docs) * self.num_features):
+            return SparseMatrixSimilarity(docs, num_terms=self.num_features, num_docs=len(docs), num_nnz=num_nnz)
+        return MatrixSimilarity(docs, num_features=self.num_features)
+
+    def _merge_segments(self, segments):
+        """Stack the index matrices of `segments` (in order) into a single new TailSegment."""
+        if len(segments) == 1:
+            return segments[0]
+        num_docs = sum(len(segment) for segment in segments)
+        num_nnz = sum(segment.num_nnz for segment in segments)
+        matrices = [segment.get_index().index for segment in segments]
+        if 0.3 > 1.0 * num_nnz / (num_docs * self.num_features):
+            matrix = scipy.sparse.vstack([scipy.sparse.csr_matrix(m) for m in matrices], format='csr')
         else:
-            index = MatrixSimilarity(self.fresh_docs, num_features=self.num_features)
-        logger.info("creating %s shard #%s", 'sparse' if issparse else 'dense', shardid)
-        shard = Shard(self.shardid2filename(shardid), index)
-        shard.num_best = self.num_best
-        shard.num_nnz = self.fresh_nnz
-        self.shards.append(shard)
-        self.fresh_docs, self.fresh_nnz = [], 0
+            matrix = numpy.vstack([m.toarray() if scipy.sparse.issparse(m) else m for m in matrices])
+        return TailSegment(segment_index(matrix, self.num_features), num_nnz)
+
+    def _write_shards(self, segments, flush=False):
+        """
+        Merge `segments` and write them to disk as shards of `shardsize` documents,
+        numbered from `len(self.shards)` on. Return the new shards and a TailSegment with
+        the remaining (< shardsize) documents, or None. With `flush`, the remaining
+        documents are written as a last, incomplete shard too.
+        """
+        matrix = self._merge_segments(segments).get_index().index
+        shards, rest = [], None
+        for start in xrange(0, matrix.shape[0], self.shardsize):
+            part = matrix[start: start + self.shardsize]
+            num_nnz = part.nnz if scipy.sparse.issparse(part) else numpy.count_nonzero(part)
+            if part.shape[0] < self.shardsize and not flush:
+                rest = TailSegment(segment_index(part.copy(), self.num_features), num_nnz)
+                break
+            shardid = len(self.shards) + len(shards)
+            logger.info("creating %s shard #%s", 'sparse' if scipy.sparse.issparse(part) else 'dense', shardid)
+            shard = Shard(self.shardid2filename(shardid), segment_index(part, self.num_features))
+            shard.num_best = self.num_best
+            shard.num_nnz = num_nnz
+            shards.append(shard)
+        return shards, rest
+
+    def _seal(self, compact=True):
+        """
+        Append the fresh documents to the in-memory tail, as a new TailSegment.
+
+        Consecutive segments are merged whenever a segment is at least as large as the
+        one before it (so each document is copied O(log(shardsize)) times), and once the
+        tail holds `shardsize` documents, a background thread starts compacting it into
+        disk shards. Segments being compacted are left alone until the compaction is done.
+        """
+        self._poll_compaction()
+        if self.fresh_docs:
+            self.tail.append(TailSegment(self._build_index(self.fresh_docs, self.fresh_nnz), self.fresh_nnz))
+            self.fresh_docs, self.fresh_nnz = [], 0
+        num_frozen = self._compaction[1] if self._compaction else 0
+        while len(self.tail) - num_frozen >= 2 and len(self.tail[-2]) <= len(self.tail[-1]):
+            last = self.tail.pop()
+            self.tail.append(self._merge_segments([self.tail.pop(), last]))
+        if compact and self._compaction is None and sum(len(segment) for segment in self.tail) >= self.shardsize:
+            self._start_compaction()
+
+    def _start_compaction(self):
+        segments, result = list(self.tail), {}
+
+        def compact():
+            try:
+                result['shards'], result['rest'] = self._write_shards(segments)
+            except Exception as err:
+                result['error'] = err
+
+        logger.debug("compacting %i in-memory segments in the background", len(segments))
+        thread = threading.Thread(target=compact)
+        thread.daemon = True
+        thread.start()
+        self._compaction = (thread, len(segments), result)
+
+    def _poll_compaction(self, wait=False):
+        """
+        If a background compaction has finished (with `wait`, once it finishes), replace
+        the tail segments it compacted by its new shards. Re-raise its error, if any.
+        """
+        if getattr(self, '_compaction', None) is None:
+            return
+        thread, num_segments, result = self._compaction
+        if thread.is_alive() and not wait:
+            return
+        thread.join()
+        self._compaction = None
+        if 'error' in result:
+            raise result['error']  # the segments stay in the tail, the index is still complete
+        self.shards.extend(result['shards'])
+        self.tail[:num_segments] = [result['rest']] if result['rest'] is not None else []
+
+    def finish_compaction(self):
+        """Wait until the background compaction of the in-memory tail, if any, is done."""
+        self._poll_compaction(wait=True)
 
     def reopen_shard(self):
         assert self.shards
-        if self.fresh_docs:
+        if self.fresh_docs or self.tail:
             raise ValueError("cannot reopen a shard with fresh documents in index")
         last_shard = self.shards[-1]
         last_index = last_shard.get_index()
         logger.info("reopening an incomplete shard of %i documents", len(last_shard))
 
-        self.fresh_docs = list(last_index.index)
-        self.fresh_nnz = last_shard.num_nnz
+        # copy the index out of the mmap'ed file: the file is overwritten once the shard is complete again
+        matrix = last_index.index.copy() if scipy.sparse.issparse(last_index.index) else numpy.array(last_index.index)
+        self.tail = [TailSegment(segment_index(matrix, self.num_features), last_shard.num_nnz)]
         del self.shards[-1]  # remove the shard from index, *but its file on disk is not deleted*
         logger.debug("reopen complete")
 
-    def query_shards(self, query):
+    def query_shards(self, query, topn=None):
         """
-        Return the result of applying shard[query] for each shard in self.shards,
-        as a sequence.
-
-        If PARALLEL_SHARDS is set, the shards are queried in parallel, using
-        the multiprocessing module.
+        Return the result of applying shard[query] for each shard in self.shards
+        and then each in-memory segment in self.tail, as a sequence. With `topn`, each result is the `clipped_top_k(shard[query], topn)`
+        arrays instead (for a batch of query documents, with shard.num_best = None).
+
+        If PARALLEL_SHARDS is set, the shards are queried in parallel by a pool of
+        PARALLEL_SHARDS threads (the BLAS / scipy.sparse products release the GIL).
+        The pool is kept across queries and the shards stay mmap'ed in this process,
+        so a query pays no process start-up, pickling or shard reloading cost.
         """
-        args = zip([query] * len(self.shards), self.shards)
-        if PARALLEL_SHARDS and PARALLEL_SHARDS > 1:
-            logger.debug("spawning %i query processes", PARALLEL_SHARDS)
-            pool = multiprocessing.Pool(PARALLEL_SHARDS)
-            result = pool.imap(query_shard, args, chunksize=1 + len(args) / PARALLEL_SHARDS)
+        shards = self.shards + self.tail
+        if topn is None:
+            func, args = query_shard, list(zip([query] * len(shards), shards))
         else:
-            # serial processing, one shard after another
-            pool = None
-            result = imap(query_shard, args)
-        return pool, result
+            func, args = query_shard_top_k, [(query, shard, topn) for shard in shards]
+        pool = self.get_pool()
+        if pool is not None:
+            return pool.imap(func, args)
+        # serial processing, one shard after another
+        return imap(func, args)
+
+    def get_pool(self):
+        """
+        Return the persistent pool of shard query threads (started on first use),
+        or None if PARALLEL_SHARDS is not set.
+        """
+        if not (PARALLEL_SHARDS and PARALLEL_SHARDS > 1):
+            return None
+        if getattr(self, '_pool', None) is None:
+            logger.debug("starting %i query threads", PARALLEL_SHARDS)
+            self._pool = ThreadPool(PARALLEL_SHARDS)
+        return self._pool
+
+    def close_pool(self):
+        """
+        Stop the shard query threads, if any. They are started again by the next
+        parallel query.
+        """
+        if getattr(self, '_pool', None) is not None:
+            self._pool.terminate()
+            self._pool = None
 
     def __getitem__(self, query):
         """Get similarities of document `query` to all documents in the corpus.
@@ -312,10 +533,11 @@ class Similarity(interfaces.SimilarityABC):
         of all query documents vs. all corpus document. This batch query is more
         efficient than computing the similarities one document after another.
         """
-        self.close_shard()  # no-op if no documents added to index since last query
+        self._seal()  # no-op if no documents added to index since last query
+        shards = self.shards + self.tail
 
         # reset num_best and normalize parameters, in case they were changed dynamically
-        for shard in self.shards:
+        for shard in shards:
             shard.num_best = self.num_best
             shard.normalize = self.norm
 
@@ -323,51 +545,44 @@ class Similarity(interfaces.SimilarityABC):
         # a corpus (or numpy/scipy matrix) or a single document, and whether the
         # similarity result should be a full array or only num_best most similar
         # documents.
-        pool, shard_results = self.query_shards(query)
         if self.num_best is None:
             # user asked for all documents => just stack the sub-results into a single matrix
             # (works for both corpus / single doc query)
-            result = numpy.hstack(shard_results)
-        else:
+            return numpy.hstack(list(self.query_shards(query)))
+
+        is_corpus, query = utils.is_corpus(query)
+        is_corpus = is_corpus or hasattr(query, 'ndim') and query.ndim > 1 and query.shape[0] > 1
+        offsets = numpy.cumsum([0] + [len(shard) for shard in shards])
+        if not is_corpus:
+            # user asked for num_best most similar and query is a single doc.
             # the following uses a lot of lazy evaluation and (optionally) parallel
             # processing, to improve query latency and minimize memory footprint.
-            offsets = numpy.cumsum([0] + [len(shard) for shard in self.shards])
             convert = lambda doc, shard_no: [(doc_index + offsets[shard_no], sim)
                                              for doc_index, sim in doc]
-            is_corpus, query = utils.is_corpus(query)
-            is_corpus = is_corpus or hasattr(query, 'ndim') and query.ndim > 1 and query.shape[0] > 1
-            if not is_corpus:
-                # user asked for num_best most similar and query is a single doc
-                results = (convert(result, shard_no) for shard_no, result in enumerate(shard_results))
-                result = heapq.nlargest(self.num_best, itertools.chain(*results), key=lambda item: item[1])
-            else:
-                # the trickiest combination: returning num_best results when query was a corpus
-                results = []
-                for shard_no, result in enumerate(shard_results):
-                    shard_result = [convert(doc, shard_no) for doc in result]
-                    results.append(shard_result)
-                result = []
-                for parts in izip(*results):
-                    merged = heapq.nlargest(self.num_best, itertools.chain(*parts), key=lambda item: item[1])
-                    result.append(merged)
-        if pool:
-            # gc doesn't seem to collect the Pools, eventually leading to
-            # "IOError 24: too many open files". so let's terminate it manually.
-            pool.terminate()
-
-        return result
+            results = (convert(result, shard_no) for shard_no, result in enumerate(self.query_shards(query)))
+            return heapq.nlargest(self.num_best, itertools.chain(*results), key=lambda item: item[1])
+
+        # the trickiest combination: returning num_best results when query was a corpus.
+        # every shard returns its candidates as arrays (instead of lists of tuples), and the
+        # candidates of all shards are merged for the whole batch at once
+        if not shards or self.num_best <= 0:
+            return [[] for _ in query]
+        for shard in shards:
+            shard.num_best = None
+        return merge_top_k(list(self.query_shards(query, topn=self.num_best)), offsets, self.num_best)
 
     def vector_by_id(self, docpos):
         """
         Return indexed vector corresponding to the document at position `docpos`.
         """
-        self.close_shard()  # no-op if no documents added to index since last query
+        self._seal()  # no-op if no documents added to index since last query
+        shards = self.shards + self.tail
         pos = 0
-        for shard in self.shards:
+        for shard in shards:
             pos += len(shard)
             if docpos < pos:
                 break
-        if not self.shards or docpos < 0 or docpos >= pos:
+        if not shards or docpos < 0 or docpos >= pos:
             raise ValueError("invalid document position: %s (must be 0 <= x < %s)" %
                              (docpos, len(self)))
         result = shard.get_document_id(docpos - pos + len(shard))
@@ -409,13 +624,13 @@ class Similarity(interfaces.SimilarityABC):
         The size of the chunk may be smaller than requested; it is up to the caller
         to check the result for real length, using `chunk.shape[0]`.
         """
-        self.close_shard()
+        self._seal()
 
         if chunksize is None:
             # if not explicitly specified, use the chunksize from the constructor
             chunksize = self.chunksize
 
-        for shard in self.shards:
+        for shard in self.shards + self.tail:  # a copy, compactions don't change what is iterated
             query = shard.get_index().index
             for chunk_start in xrange(0, query.shape[0], chunksize):
                 # scipy.sparse doesn't allow slicing beyond real size of the matrix
@@ -438,14 +653,24 @@ class Similarity(interfaces.SimilarityABC):
         Save the object via pickling (also see load) under filename specified in
         the constructor.
 
-        Calls `close_shard` internally to spill any unfinished shards to disk first.
+        Calls `close_shard` internally to spill any unfinished shards (and the
+        in-memory tail) to disk first. The shard query threads are not saved.
 
         """
         self.close_shard()
         if fname is None:
             fname = self.output_prefix
+        kwargs['ignore'] = set(kwargs.get('ignore', [])) | set(['_pool', '_compaction'])
         super(Similarity, self).save(fname, *args, **kwargs)
 
+    @classmethod
+    def load(cls, *args, **kwargs):
+        result = super(Similarity, cls).load(*args, **kwargs)
+        if not hasattr(result, 'tail'):
+            result.tail = []  # saved by an older version, without the in-memory tail
+        result._compaction = None
+        return result
+
     def destroy(self):
         """
         Delete all files under self.output_prefix. Object is not usable after calling
@@ -453,6 +678,8 @@ class Similarity(interfaces.SimilarityABC):
 
         """
         import glob
+        self.close_pool()
+        self._poll_compaction(wait=True)
         for fname in glob.glob(self.output_prefix + '*'):
             logger.info("deleting %s", fname)
             os.remove(fname)
@@ -473,12 +700,19 @@ class MatrixSimilarity(interfaces.SimilarityABC):
     See also `Similarity` and `SparseMatrixSimilarity` in this module.
 
     """
-    def __init__(self, corpus, num_best=None, dtype=numpy.float32, num_features=None, chunksize=256, corpus_len=None):
+    max_query_memory = 256 * 1024 ** 2  # default, for indexes saved before the parameter existed
+
+    def __init__(self, corpus, num_best=None, dtype=numpy.float32, num_features=None, chunksize=256, corpus_len=None,
+                 max_query_memory=256 * 1024 ** 2):
         """
         `num_features` is the number of features in the corpus (will be determined
         automatically by scanning the corpus if not specified). See `Similarity`
         class for description of the other parameters.
 
+        Batch queries (a corpus or a scipy.sparse matrix) are kept sparse, and processed
+        in chunks of query documents so that the temporary dense blocks of each chunk take
+        about `max_query_memory` bytes at most.
+
         """
         if num_features is None:
             logger.warning("scanning corpus to determine the number of features (consider setting `num_features` explicitly)")
@@ -488,6 +722,7 @@ class MatrixSimilarity(interfaces.SimilarityABC):
         self.num_best = num_best
         self.normalize = True
         self.chunksize = chunksize
+        self.max_query_memory = max_query_memory
         if corpus_len is None:
             corpus_len = len(corpus)
 
@@ -497,21 +732,31 @@ class MatrixSimilarity(interfaces.SimilarityABC):
             logger.info("creating matrix with %i documents and %i features", corpus_len, num_features)
             self.index = numpy.empty(shape=(corpus_len, num_features), dtype=dtype)
             # iterate over corpus, populating the numpy index matrix with (normalized)
-            # document vectors
-            for docno, vector in enumerate(corpus):
-                if docno % 1000 == 0:
-                    logger.debug("PROGRESS: at document #%i/%i", docno, corpus_len)
+            # document vectors, a chunk of documents at a time
+            docno = 0
+            for chunk in utils.grouper(corpus, 1000):
+                logger.debug("PROGRESS: at document #%i/%i", docno, corpus_len)
                 # individual documents in fact may be in numpy.scipy.sparse format as well.
                 # it's not documented because other it's not fully supported throughout.
                 # the user better know what he's doing (no normalization, must
                 # explicitly supply num_features etc).
-                if isinstance(vector, numpy.ndarray):
-                    pass
-                elif scipy.sparse.issparse(vector):
-                    vector = vector.toarray().flatten()
+                if any(isinstance(vector, numpy.ndarray) or scipy.sparse.issparse(vector) for vector in chunk):
+                    for vector in chunk:
+                        if isinstance(vector, numpy.ndarray):
+                            pass
+                        elif scipy.sparse.issparse(vector):
+                            vector = vector.toarray().flatten()
+                        else:
+                            vector = matutils.unitvec(matutils.sparse2full(vector, num_features))
+                        self.index[docno] = vector
+                        docno += 1
                 else:
-                    vector = matutils.unitvec(matutils.sparse2full(vector, num_features))
-                self.index[docno] = vector
+                    # plain gensim vectors: convert and normalize the whole chunk at once
+                    vectors = matutils.corpus2dense(chunk, num_features, num_docs=len(chunk)).T.astype(float)
+                    lengths = numpy.sqrt((vectors ** 2).sum(axis=1))
+                    lengths[lengths == 0] = 1.0  # zero vectors are left unchanged, like by unitvec
+                    self.index[docno: docno + len(chunk)] = vectors / lengths[:, None]
+                    docno += len(chunk)
 
     def __len__(self):
         return self.index.shape[0]
@@ -530,28 +775,70 @@ class MatrixSimilarity(interfaces.SimilarityABC):
         """
         is_corpus, query = utils.is_corpus(query)
         if is_corpus:
-            query = numpy.asarray(
-                [matutils.sparse2full(vec, self.num_features) for vec in query],
-                dtype=self.index.dtype)
-        else:
-            if scipy.sparse.issparse(query):
-                query = query.toarray()  # convert sparse to dense
-            elif isinstance(query, numpy.ndarray):
-                pass
-            else:
-                # default case: query is a single vector in sparse gensim format
-                query = matutils.sparse2full(query, self.num_features)
-            query = numpy.asarray(query, dtype=self.index.dtype)
+            query = matutils.corpus2csc(query, self.num_features, dtype=self.index.dtype).T
+        if scipy.sparse.issparse(query):
+            # batch query: keep it sparse, never build the dense #queries x #features matrix
+            query = scipy.sparse.csr_matrix(query, dtype=self.index.dtype)
+            result = numpy.empty((query.shape[0], len(self)), dtype=self.index.dtype)
+            self.sparse_similarities(query, result)
+            return result
+
+        if not isinstance(query, numpy.ndarray):
+            # default case: query is a single vector in sparse gensim format
+            query = matutils.sparse2full(query, self.num_features)
+        query = numpy.asarray(query, dtype=self.index.dtype)
 
         # do a little transposition dance to stop numpy from making a copy of
         # self.index internally in numpy.dot (very slow).
         result = numpy.dot(self.index, query.T).T  # return #queries x #index
         return result  # XXX: removed casting the result from array to list; does anyone care?
 
+    def sparse_similarities(self, query, out):
+        """
+        Store the similarities of the documents in `query` (a scipy.sparse CSR matrix of
+        #queries x #features) to all index documents into `out` (#queries x #index).
+
+        Only the index columns of the features that occur in `query` are gathered, and
+        multiplied with the sparse query (a sparse x dense product, O(query nnz x #index)),
+        unless the query density is >= 30% (then the query is densified, for BLAS).
+        Query chunks whose dense blocks would exceed `max_query_memory` are split in two.
+        """
+        columns = numpy.unique(query.indices)
+        use_columns = query.nnz < 0.3 * query.shape[0] * self.num_features
+        itemsize = self.index.dtype.itemsize
+        if use_columns:
+            memory = len(columns) * len(self) * itemsize  # the gathered index columns
+        else:
+            memory = query.shape[0] * self.num_features * itemsize  # the dense query
+        if query.shape[0] > 1 and memory > self.max_query_memory:
+            half = query.shape[0] // 2
+            self.sparse_similarities(query[:half], out[:half])
+            self.sparse_similarities(query[half:], out[half:])
+            return
+        if use_columns:
+            # rows of index.T: a C-contiguous #columns x #index block, so scipy multiplies it without a copy
+            out[:] = query[:, columns].dot(self.index.T[columns])
+        else:
+            out[:] = numpy.dot(self.index, query.toarray().T).T
+
     def __str__(self):
         return "%s<%i docs, %i features>" % (self.__class__.__name__, len(self), self.index.shape[1])
 #endclass MatrixSimilarity
 
+_wmd_model, _wmd_corpus = None, None  # the model and corpus of WmdSimilarity worker processes
+
+
+def _init_wmd_worker(w2v_model, corpus):
+    global _wmd_model, _wmd_corpus
+    _wmd_model, _wmd_corpus = w2v_model, corpus
+
+
+def _wmd_distances(args):
+    """Return the WMD of `query` to each of the corpus documents `docnos`, in a worker process."""
+    query, docnos = args
+    return [_wmd_model.wmdistance(_wmd_corpus[docno], query) for docno in docnos]
+
+
 class WmdSimilarity(interfaces.SimilarityABC):
     """
     Document similarity (like MatrixSimilarity) that uses the negative of WMD
@@ -559,7 +846,14 @@ class WmdSimilarity(interfaces.SimilarityABC):
     information.
 
     When a `num_best` value is provided, only the most similar documents are
-    retrieved.
+    retrieved. The exact WMD is then only computed for the documents that can be
+    among them: the corpus documents are ranked by a cheap lower bound of their WMD
+    to the query (the larger of the word centroid distance and the relaxed WMD of
+    Kusner et al.), and the search stops as soon as the lower bound of the next
+    document exceeds the `num_best`-th smallest WMD found so far. The documents left
+    out get similarity 0 in `get_similarities`, which the `num_best` results drop anyway.
+
+    With `workers` > 1, the exact WMDs are computed by a pool of worker processes.
 
     When using this code, please consider citing the following papers:
 
@@ -577,18 +871,21 @@ class WmdSimilarity(interfaces.SimilarityABC):
         >>> query = 'Very good, you should seat outdoor.'
         >>> sims = instance[query]
     """
-    def __init__(self, corpus, w2v_model, num_best=None, normalize_w2v_and_replace=True, chunksize=256):
+    def __init__(self, corpus, w2v_model, num_best=None, normalize_w2v_and_replace=True, chunksize=256, workers=1):
         """
         corpus:                         List of lists of strings, as in gensim.models.word2vec.
         w2v_model:                      A trained word2vec model.
         num_best:                       Number of results to retrieve.
         normalize_w2v_and_replace:      Whether or not to normalize the word2vec vectors to
                                         length 1.
+        workers:                        Number of processes computing the exact WMDs.
         """
         self.corpus = corpus
         self.w2v_model = w2v_model
         self.num_best = num_best
         self.chunksize = chunksize
+        self.workers = workers
+        self._nbow = None  # nBOW matrix of the corpus, for the WMD lower bounds (see `nbow`)
 
         # Normalization of features is not possible, as corpus is a list (of lists) of strings.
         self.normalize = False
@@ -616,14 +913,22 @@ class WmdSimilarity(interfaces.SimilarityABC):
 
         n_queries = len(query)
         result = []
-        for qidx in range(n_queries):
-            # Compute similarity for each query.
-            qresult = [self.w2v_model.wmdistance(document, query[qidx]) for document in self.corpus]
-            qresult = numpy.array(qresult)
-            qresult = 1./(1.+qresult)  # Similarity is the negative of the distance.
+        pool = self.get_pool()
+        try:
+            for qidx in range(n_queries):
+                # Compute similarity for each query.
+                if self.num_best is None:
+                    qresult = self.wmdistances(query[qidx], list(range(len(self.corpus))), pool)
+                else:
+                    qresult = self.best_wmdistances(query[qidx], self.num_best, pool)
+                qresult = numpy.array(qresult)
+                qresult = 1./(1.+qresult)  # Similarity is the negative of the distance.
 
-            # Append single query result to list of all results.
-            result.append(qresult)
+                # Append single query result to list of all results.
+                result.append(qresult)
+        except BaseException:
+            self.close_pool()  # e.g. interrupted: don't reuse workers that may still be busy
+            raise
 
         if len(result) == 1:
             # Only one query.
@@ -633,6 +938,123 @@ class WmdSimilarity(interfaces.SimilarityABC):
 
         return result
 
+    def get_pool(self):
+        """
+        Return the persistent pool of `workers` WMD processes (started on first use, each
+        with a copy of the model and the corpus), or None if `workers` <= 1.
+        """
+        if self.workers <= 1:
+            return None
+        if getattr(self, '_pool', None) is None:
+            logger.debug("starting %i WMD worker processes", self.workers)
+            self._pool = multiprocessing.Pool(self.workers, _init_wmd_worker, (self.w2v_model, self.corpus))
+        return self._pool
+
+    def close_pool(self):
+        """
+        Stop the WMD worker processes, if any. They are started again by the next
+        query, so call this after changing the model or the corpus, too.
+        """
+        if getattr(self, '_pool', None) is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def __del__(self):
+        self.close_pool()
+
+    def save(self, *args, **kwargs):
+        """Save the index (also see load). The WMD worker processes are not saved."""
+        kwargs['ignore'] = set(kwargs.get('ignore', [])) | set(['_pool'])
+        super(WmdSimilarity, self).save(*args, **kwargs)
+
+    def wmdistances(self, query, docnos, pool=None):
+        """Return the WMD of `query` to each of the corpus documents `docnos`, using the worker `pool` if given."""
+        if pool is None:
+            return [self.w2v_model.wmdistance(self.corpus[docno], query) for docno in docnos]
+        chunksize = max(1, -(-len(docnos) // (4 * self.workers)))
+        chunks = [(query, docnos[start: start + chunksize]) for start in xrange(0, len(docnos), chunksize)]
+        return list(itertools.chain(*pool.map(_wmd_distances, chunks)))
+
+    def nbow(self, documents):
+        """
+        Return the normalized bag-of-words of `documents`, as a sparse CSR matrix of
+        (#documents x #vocabulary) word frequencies. Out-of-vocabulary words are left
+        out (like `wmdistance` does), so their documents may have empty rows.
+        """
+        vocab = self.w2v_model.vocab
+        ids = [[vocab[token].index for token in document if token in vocab] for document in documents]
+        rows = numpy.repeat(numpy.arange(len(ids)), [len(doc_ids) for doc_ids in ids])
+        weights = numpy.concatenate([[1. / len(doc_ids)] * len(doc_ids) for doc_ids in ids] + [[]])
+        cols = numpy.fromiter(itertools.chain(*ids), dtype=numpy.int64, count=len(rows))
+        shape = (len(ids), len(self.w2v_model.syn0))
+        return scipy.sparse.csr_matrix((weights, (rows, cols)), shape=shape)  # sums repeated words
+
+    def wmd_lower_bounds(self, query, chunksize=4096):
+        """
+        Return lower bounds of the WMD of `query` to every corpus document: the larger of
+        the word centroid distance and the relaxed WMD (Kusner et al., 2015), lowered by a relative
+        1e-5 for the single precision word distances of `wmdistance`. Documents with no word in
+        the vocabulary get `inf`, like from `wmdistance`.
+        """
+        from scipy.spatial.distance import cdist
+        if self._nbow is None:
+            self._nbow = self.nbow(self.corpus)
+        nbow = self._nbow
+        vectors = self.w2v_model.syn0
+        query = self.nbow([query])
+        query_ids, query_weights = query.indices, query.data
+        query_vectors = vectors[query_ids].astype(numpy.float64)
+        bounds = numpy.empty(nbow.shape[0])
+        for start in xrange(0, nbow.shape[0], chunksize):
+            docs = nbow[start: start + chunksize]
+            # word centroid distance
+            centroids = numpy.asarray(docs.dot(vectors), dtype=numpy.float64)
+            wcd = numpy.sqrt(((centroids - query.dot(vectors)) ** 2).sum(axis=1))
+            # relaxed WMD: every word moves all its weight to the nearest word of the other document
+            lengths = numpy.diff(docs.indptr)
+            distances = cdist(vectors[docs.indices].astype(numpy.float64), query_vectors)
+            rows = numpy.repeat(numpy.arange(docs.shape[0]), lengths)
+            doc_to_query = numpy.bincount(rows, weights=docs.data * distances.min(axis=1), minlength=docs.shape[0])
+            query_to_doc = numpy.zeros(docs.shape[0])
+            nonempty = lengths > 0
+            if nonempty.any():
+                nearest = numpy.minimum.reduceat(distances, docs.indptr[:-1][nonempty], axis=0)
+                query_to_doc[nonempty] = nearest.dot(query_weights)
+            bounds[start: start + docs.shape[0]] = numpy.where(
+                nonempty, numpy.maximum(wcd, numpy.maximum(doc_to_query, query_to_doc)), numpy.inf)
+        return bounds * (1 - 1e-5)
+
+    def best_wmdistances(self, query, topn, pool=None, batchsize=None):
+        """
+        Return the WMD of `query` to every corpus document, as an array in which only the
+        `topn` smallest distances are guaranteed to be exact: documents whose WMD lower bound
+        already exceeds the `topn`-th smallest distance are not computed and get `inf`.
+
+        Candidates are computed in order of increasing lower bound, `batchsize` at a
+        time (by default, 1 without `pool` and `4 * workers` with it).
+        """
+        distances = numpy.empty(len(self.corpus))
+        distances.fill(numpy.inf)
+        if topn <= 0 or not len(self.corpus):
+            return distances
+        query = [token for token in query if token in self.w2v_model.vocab]
+        if not query:
+            return distances  # `wmdistance` is inf for every document
+        bounds = self.wmd_lower_bounds(query)
+        candidates = numpy.argsort(bounds, kind='mergesort')
+        batchsize = batchsize or (1 if pool is None else 4 * self.workers)
+        best = []  # the `topn` smallest distances so far
+        start, end = 0, min(topn, len(candidates))
+        while start < len(candidates):
+            if len(best) == topn and bounds[candidates[start]] > best[-1]:
+                break  # neither this candidate nor the following ones can be among the best
+            docnos = candidates[start: end].tolist()
+            distances[docnos] = self.wmdistances(query, docnos, pool)
+            best = sorted(best + list(distances[docnos]))[:topn]
+            start, end = end, end + batchsize
+        logger.debug("computed %i of %i WMDs for a top-%i query", start, len(candidates), topn)
+        return distances
+
     def __str__(self):
         return "%s<%i docs, %i features>" % (self.__class__.__name__, len(self), self.w2v_model.syn0.shape[1])
 #endclass WmdSimilarity
@@ -679,15 +1101,30 @@ class SparseMatrixSimilarity(interfaces.SimilarityABC):
                 num_terms = num_features
             if num_terms is None:
                 raise ValueError("refusing to guess the number of sparse features: specify num_features explicitly")
-            corpus = (matutils.scipy2sparse(v) if scipy.sparse.issparse(v) else
-                      (matutils.full2sparse(v) if isinstance(v, numpy.ndarray) else
-                       matutils.unitvec(v)) for v in corpus)
+            normalized = []  # plain gensim vectors are normalized (after the conversion), the others not
+
+            def vectors(corpus):
+                for v in corpus:
+                    normalized.append(not (scipy.sparse.issparse(v) or isinstance(v, numpy.ndarray)))
+                    yield (matutils.scipy2sparse(v) if scipy.sparse.issparse(v) else
+                           (matutils.full2sparse(v) if isinstance(v, numpy.ndarray) else v))
+
             self.index = matutils.corpus2csc(
-                corpus, num_terms=num_terms, num_docs=num_docs, num_nnz=num_nnz,
+                vectors(corpus), num_terms=num_terms, num_docs=num_docs, num_nnz=num_nnz,
                 dtype=dtype, printprogress=10000).T
 
             # convert to Compressed Sparse Row for efficient row slicing and multiplications
             self.index = self.index.tocsr()  # currently no-op, CSC.T is already CSR
+
+            # normalize all gensim vectors at once, scaling the index data in place (lengths in float64)
+            row_nnz = numpy.diff(self.index.indptr)
+            rows = numpy.repeat(numpy.arange(self.index.shape[0]), row_nnz)
+            lengths = numpy.sqrt(numpy.bincount(
+                rows, weights=numpy.square(self.index.data, dtype=numpy.float64), minlength=self.index.shape[0]))
+            keep = numpy.ones(len(lengths), dtype=bool)
+            keep[:len(normalized)] = numpy.logical_not(normalized)
+            lengths[keep | (lengths == 0)] = 1.0
+            self.index.data *= numpy.repeat(1.0 / lengths, row_nnz)
             logger.info("created %r", self.index)
 
     def __len__(self):
@@ -17,9 +17,10 @@ import itertools
 import numpy as np
 
 from gensim.utils import to_unicode
+from gensim import matutils
 from gensim.interfaces import TransformedCorpus
 from gensim.corpora import (bleicorpus, mmcorpus, lowcorpus, svmlightcorpus,
-                            ucicorpus, malletcorpus, textcorpus, indexedcorpus)
+                            ucicorpus, malletcorpus, textcorpus, indexedcorpus, csrcorpus)
 
 # needed because sample data files are located in the same folder
 module_path = os.path.dirname(__file__)
@@ -231,6 +232,98 @@ class TestMmCorpus(CorpusTestCase):
         self.assertEqual(tuple(self.corpus.index), (97, 121, 169, 201, 225, 249, 258, 276, 303))
 
 
+class TestCsrCorpus(CorpusTestCase):
+    def setUp(self):
+        self.corpus_class = csrcorpus.CsrCorpus
+        self.corpus = self.corpus_class(datapath('testcorpus.csr'))
+        self.file_extension = '.csr'
+
+    def tearDown(self):
+        super(TestCsrCorpus, self).tearDown()
+        for fname in csrcorpus._array_fnames(testfile()):
+            if os.path.exists(fname):
+                os.remove(fname)
+
+    def test_serialize_compressed(self):
+        # the arrays are memory-mapped => no compressed files
+        pass
+
+    def test_load(self):
+        self.assertEqual(self.corpus.num_docs, 9)
+        self.assertEqual(self.corpus.num_terms, 12)
+        self.assertEqual(self.corpus.num_nnz, 28)
+        self.assertEqual(list(self.corpus), list(mmcorpus.MmCorpus(datapath('testcorpus.mm'))))
+
+    def test_mm2csr(self):
+        mm = mmcorpus.MmCorpus(datapath('testcorpus.mm'))
+        corpus = csrcorpus.mm2csr(datapath('testcorpus.mm'), testfile())
+        self.assertEqual((corpus.num_docs, corpus.num_terms, corpus.num_nnz), (mm.num_docs, mm.num_terms, mm.num_nnz))
+        self.assertEqual(list(corpus), list(mm))
+        self.assertEqual(corpus[4], mm[4])
+
+        # the same corpus, without knowing its size in advance
+        self.corpus_class.serialize(testfile(), iter(list(mm)))
+        self.assertEqual(list(self.corpus_class(testfile(), mmap=None)), list(mm))
+
+    def test_size_mismatch(self):
+        # wrong declared sizes => ValueError, and no half-written arrays left behind
+        class SizedCorpus(list):
+            pass
+
+        for num_docs, num_nnz in [(9, 27), (8, 28), (9, 29), (10, 28)]:
+            corpus = SizedCorpus(mmcorpus.MmCorpus(datapath('testcorpus.mm')))
+            corpus.num_docs, corpus.num_nnz = num_docs, num_nnz
+            self.assertRaises(ValueError, self.corpus_class.save_corpus, testfile(), corpus)
+            for fname in csrcorpus._array_fnames(testfile()):
+                self.assertFalse(os.path.exists(fname))
+
+    def test_iter_csr(self):
+        docs = list(self.corpus)
+        for chunksize in [1, 4, 100]:
+            chunks = list(self.corpus.iter_csr(chunksize))
+            self.assertEqual(len(chunks), -(-len(docs) // chunksize))
+            rows = [list(zip(row.indices.tolist(), row.data.tolist())) for chunk in chunks for row in chunk]
+            self.assertEqual(rows, docs)
+        self.assertEqual(self.corpus.csr_rows(0, 9).shape, (9, 12))
+
+
+class TestCorpus2Matrix(unittest.TestCase):
+    def setUp(self):
+        self.corpus = list(mmcorpus.MmCorpus(datapath('testcorpus.mm')))
+        self.expected = np.column_stack([matutils.sparse2full(doc, 12) for doc in self.corpus])
+
+    def test_corpus2csc(self):
+        for chunksize in [1, 4, 100]:
+            for num_docs, num_nnz in [(None, None), (9, 28)]:
+                result = matutils.corpus2csc(iter(self.corpus), num_terms=12, num_docs=num_docs, num_nnz=num_nnz,
+                                             chunksize=chunksize)
+                self.assertEqual(result.shape, (12, 9))
+                self.assertTrue(np.array_equal(result.toarray(), self.expected))
+        self.assertEqual(matutils.corpus2csc(self.corpus).shape, (12, 9))
+        self.assertEqual(matutils.corpus2csc([]).shape, (0, 0))
+
+    def test_numpy_backed_corpora(self):
+        numpy_docs = [np.array(doc) for doc in self.corpus]  # as from utils.chunkize(as_numpy=True)
+        scipy_docs = [matutils.corpus2csc([doc], num_terms=12).T for doc in self.corpus]
+        csr = csrcorpus.CsrCorpus(datapath('testcorpus.csr'))
+        for corpus in [numpy_docs, scipy_docs, self.corpus[:3] + numpy_docs[3:], csr]:
+            result = matutils.corpus2csc(corpus, num_terms=12, chunksize=4)
+            self.assertTrue(np.array_equal(result.toarray(), self.expected))
+        self.assertRaises(ValueError, matutils.corpus2csc, [np.ones(12)])
+
+    def test_corpus2dense(self):
+        for num_docs in [None, 9]:
+            result = matutils.corpus2dense(self.corpus, 12, num_docs=num_docs)
+            self.assertEqual(result.dtype, np.float32)
+            self.assertTrue(np.array_equal(result, self.expected))
+
+        # repeated feature ids: the last value wins, as in sparse2full
+        corpus = [[(1, 1.0), (1, 2.0)], [(0, 3.0)]]
+        expected = np.column_stack([matutils.sparse2full(doc, 2) for doc in corpus])
+        for num_docs in [None, 2]:
+            self.assertTrue(np.array_equal(matutils.corpus2dense(corpus, 2, num_docs=num_docs), expected))
+
+
 class TestSvmLightCorpus(CorpusTestCase):
     def setUp(self):
         self.corpus_class = svmlightcorpus.SvmLightCorpus
@@ -115,6 +115,23 @@ class TestDictionary(unittest.TestCase):
         f.merge_with(g)
         self.assertEqual(sorted(d.token2id.keys()), sorted(f.token2id.keys()))
 
+    def testBuildParallel(self):
+        d = Dictionary(self.texts)
+        for chunksize in [1, 2, 100]:
+            p = Dictionary()
+            p.add_documents(iter(self.texts), workers=2, chunksize=chunksize)
+            self.assertEqual(d.token2id, p.token2id)
+            self.assertEqual(d.dfs, p.dfs)
+            self.assertEqual((d.num_docs, d.num_pos, d.num_nnz), (p.num_docs, p.num_pos, p.num_nnz))
+
+        # pruning happens at the same points as in the serial build
+        texts = [['w%i' % (i % 997), 'w%i' % (i * 7 % 25013), 'x%i' % i] for i in range(25000)]
+        d = Dictionary(texts, prune_at=1000)
+        p = Dictionary(texts, prune_at=1000, workers=2)
+        self.assertEqual(d.token2id, p.token2id)
+        self.assertEqual(d.dfs, p.dfs)
+        self.assertEqual(d.num_docs, p.num_docs)
+
     def testFilter(self):
         d = Dictionary(self.texts)
         d.filter_extremes(no_below=2, no_above=1.0, keep_n=4)
@@ -261,6 +261,136 @@ class TestShardedCorpus(unittest.TestCase):
             fname = dataset._shard_name(n)
             self.assertTrue(os.path.isfile(fname))
 
+    def test_prefetch(self):
+
+        expected = [self.corpus[i] for i in xrange(len(self.corpus))]
+
+        dataset = ShardedCorpus.load(self.tmp_fname)
+        dataset.prefetch = True
+        dataset.load_shard(0)
+        self.assertEqual(1, dataset._prefetch[0])
+
+        for i, doc in enumerate(dataset):
+            self.assertTrue(np.array_equal(expected[i], doc))
+            self.assertTrue(len(dataset._shard_cache) <= dataset.cache_size)
+
+        dslice = dataset[150:750]
+        self.assertTrue(np.array_equal(np.array(expected[150:750]), dslice))
+
+        # a failed read-ahead only fails when the shard is actually needed
+        dataset.reset()
+        os.remove(dataset._shard_name(1))
+        dataset.load_shard(0)
+        self.assertRaises(ValueError, dataset.load_shard, 1)
+
+    def test_shard_cache(self):
+
+        expected = self.corpus[250]
+        dataset = ShardedCorpus.load(self.tmp_fname)
+        dataset.cache_size = 3
+        for n in [0, 1, 2, 0, 3]:
+            dataset.load_shard(n)
+        self.assertEqual([2, 0, 3], list(dataset._shard_cache))
+
+        # cached shards are not read from disk again, evicted ones are
+        os.remove(dataset._shard_name(1))
+        os.remove(dataset._shard_name(2))
+        dataset.load_shard(2)
+        self.assertTrue(np.array_equal(dataset[250], expected))
+        self.assertRaises(ValueError, dataset.load_shard, 1)
+
+    def test_resize_clears_cache(self):
+
+        dataset = ShardedCorpus(self.tmp_fname, self.data, shardsize=100,
+                                dim=self.dim, prefetch=True, cache_size=4)
+        expected = dataset[0:len(dataset)]
+
+        dataset.resize_shards(250)
+
+        self.assertEqual(0, len(dataset._shard_cache))
+        self.assertTrue(np.array_equal(expected, dataset[0:len(dataset)]))
+
+        dataset.save()
+        loaded = ShardedCorpus.load(self.tmp_fname)
+        self.assertTrue(loaded.prefetch)
+        self.assertEqual(4, loaded.cache_size)
+        self.assertTrue(np.array_equal(expected[300:550], loaded[300:550]))
+
+    def test_npy_shards(self):
+
+        for sparse_serialization in [False, True]:
+            tmp_fname = self.tmp_fname + str(sparse_serialization)
+            dataset = ShardedCorpus(tmp_fname, self.data, shardsize=100, dim=self.dim,
+                                    sparse_serialization=sparse_serialization, shard_format='npy')
+            pickled = ShardedCorpus(tmp_fname + '.pkl', self.data, shardsize=100, dim=self.dim,
+                                    sparse_serialization=sparse_serialization, shard_format='pickle')
+
+            self.assertEqual(b'\x93NUMPY', open(dataset._shard_name(0), 'rb').read(6))
+            shard = dataset._read_shard(3)
+            self.assertTrue(np.array_equal(pickled._read_shard(3).toarray()
+                                           if sparse_serialization else pickled._read_shard(3),
+                                           shard.toarray() if sparse_serialization else shard))
+
+            for start, stop in [(120, 180), (0, 100), (150, 750), (950, 1000), (300, 300)]:
+                dslice = dataset._get_slice(start, stop)
+                pslice = pickled._get_slice(start, stop)
+                self.assertEqual(pslice.shape, dslice.shape)
+                if sparse_serialization:
+                    dslice, pslice = dslice.toarray(), pslice.toarray()
+                self.assertTrue(np.array_equal(pslice, dslice))
+                self.assertTrue(np.array_equal(pickled[start:stop], dataset[start:stop]))
+
+            # slices within one shard are views of the memory-mapped shard
+            dataset.load_shard(1)
+            dslice = dataset._get_slice(120, 180)
+            if sparse_serialization:
+                self.assertTrue(np.shares_memory(dslice.data, dataset.current_shard.data))
+            else:
+                self.assertTrue(np.shares_memory(dslice, dataset.current_shard))
+                self.assertFalse(dslice.flags.writeable)
+
+            expected = pickled[0:len(pickled)]
+            dataset.resize_shards(250)
+            self.assertEqual(4, dataset.n_shards)
+            self.assertTrue(np.array_equal(expected, dataset[0:len(dataset)]))
+            for n in xrange(dataset.n_shards):
+                for fname in dataset._shard_fnames(dataset._shard_name(n)):
+                    self.assertTrue(os.path.isfile(fname))
+
+            dataset.save()
+            clone = ShardedCorpus(tmp_fname, None, shard_format='pickle')
+            self.assertEqual('npy', clone.shard_format)
+            self.assertEqual(sparse_serialization, clone.sparse_serialization)
+            self.assertTrue(np.array_equal(expected[200:300], clone[200:300]))
+
+    def test_writable_batches(self):
+
+        # default (pickled) shards: batches can be modified in place, as before
+        self.assertEqual('pickle', self.corpus.shard_format)
+        for batch in [self.corpus[5], self.corpus[120:180], self.corpus[150:750]]:
+            batch *= 2.0
+
+        # npy shards are memory-mapped: batches within one shard are read-only views
+        dataset = ShardedCorpus(self.tmp_fname + '.npy', self.data, shardsize=100,
+                                dim=self.dim, shard_format='npy')
+        for batch in [dataset[5], dataset[120:180]]:
+            self.assertFalse(batch.flags.writeable)
+            self.assertRaises(ValueError, batch.__imul__, 2.0)
+        batch = dataset[150:750]  # concatenated, so a writable copy
+        batch *= 2.0
+
+    def test_load_pickled_shards(self):
+
+        # corpora saved before the npy format have pickled shards
+        dataset = ShardedCorpus(self.tmp_fname + '.old', self.data, shardsize=100,
+                                dim=self.dim, shard_format='pickle')
+        del dataset.shard_format
+        dataset.save()
+
+        loaded = ShardedCorpus.load(self.tmp_fname + '.old')
+        self.assertEqual('pickle', loaded.shard_format)
+        self.assertTrue(np.array_equal(self.corpus[50:250], loaded[50:250]))
+
 ##############################################################################
 
 if __name__ == '__main__':
@@ -310,6 +310,20 @@ class TestMatrixSimilarity(unittest.TestCase, _TestSimilarityABC):
     def setUp(self):
         self.cls = similarities.MatrixSimilarity
 
+    def testSparseQueries(self):
+        """test batch queries kept sparse, with and without splitting them to the memory budget"""
+        index = self.cls(corpus, num_features=len(dictionary))
+        query = [matutils.unitvec(doc) for doc in corpus]
+        expected = numpy.dot(index.index, numpy.array([matutils.sparse2full(doc, len(dictionary)) for doc in query]).T).T
+        for max_query_memory in [256 * 1024 ** 2, 1]:
+            index.max_query_memory = max_query_memory
+            self.assertTrue(numpy.allclose(index[corpus], expected))
+            self.assertTrue(numpy.allclose(index[matutils.corpus2csc(query, len(dictionary)).T], expected))
+            self.assertTrue(numpy.allclose(index[[[], corpus[5]]], expected[[0, 5]] * [[0], [1]]))
+        dense = scipy.sparse.csr_matrix(numpy.ones((2, len(dictionary))))  # densified, for BLAS
+        self.assertTrue(numpy.allclose(index[dense], index.index.sum(axis=1) * numpy.ones((2, 1))))
+
+
 class TestWmdSimilarity(unittest.TestCase, _TestSimilarityABC):
     def setUp(self):
         self.cls = similarities.WmdSimilarity
@@ -385,6 +399,38 @@ class TestWmdSimilarity(unittest.TestCase, _TestSimilarityABC):
             self.assertTrue(numpy.alltrue(sims >= 0.0))
             self.assertTrue(numpy.alltrue(sims <= 1.0))
 
+    def testPruned(self):
+        """test the lower-bound pruned num_best search against the exact WMD of every document"""
+        if not PYEMD_EXT:
+            return
+
+        index = self.cls(texts, self.w2v_model)
+        queries = texts + [['graph', 'unknownword', 'trees', 'trees']]
+        exact = index[queries]
+        for query, sims in zip(queries, exact):
+            distances = 1. / sims - 1.
+            self.assertTrue(numpy.all(index.wmd_lower_bounds(query) <= distances))
+
+        for workers in [1, 2]:
+            index.workers = workers
+            for num_best in [1, 3, 100]:
+                index.num_best = num_best
+                for sims, expected in zip(index[queries], exact):
+                    expected = matutils.full2sparse_clipped(expected, num_best)
+                    self.assertTrue(numpy.allclose([sim for _, sim in sims], [sim for _, sim in expected]))
+                    self.assertEqual(set(doc for doc, _ in sims), set(doc for doc, _ in expected))
+
+        # the worker processes persist across queries, and are not saved
+        pool = index.get_pool()
+        index[queries[0]]
+        self.assertIs(pool, index.get_pool())
+        fname = testfile()
+        index.save(fname)
+        self.assertIs(pool, index._pool)
+        self.assertIsNone(self.cls.load(fname)._pool)
+        index.close_pool()
+        self.assertIsNone(index._pool)
+
 
 class TestSparseMatrixSimilarity(unittest.TestCase, _TestSimilarityABC):
     def setUp(self):
@@ -426,6 +472,105 @@ class TestSimilarity(unittest.TestCase, _TestSimilarityABC):
         self.assertTrue(numpy.allclose(expected, sims))
         index.destroy()
 
+    def testBatchNumBest(self):
+        """test the array top-k merge of corpus queries against merging the per-shard results with heapq"""
+        import heapq
+        rng = numpy.random.RandomState(0)
+        docs = rng.randn(23, 6)  # dense with negative values, so that the merge order != magnitude order
+        docs[rng.rand(*docs.shape) < 0.3] = 0
+        queries = [matutils.full2sparse(q) for q in rng.randn(7, 6)] + [[]]
+        for shardsize in [1, 5, 100]:
+            index = self.cls(None, docs, num_features=6, shardsize=shardsize)
+            for num_best in [0, 1, 3, 50]:
+                index.num_best = num_best
+                sims = index[queries]
+                for query, query_sims in zip(queries, sims):
+                    candidates = []
+                    offset = 0
+                    for shard in index.shards + index.tail:
+                        full = shard.get_index()[matutils.unitvec(query)] if query else numpy.zeros(len(shard))
+                        candidates.extend((pos + offset, sim) for pos, sim in matutils.full2sparse_clipped(full, num_best))
+                        offset += len(shard)
+                    expected = heapq.nlargest(num_best, candidates, key=lambda item: item[1])
+                    self.assertEqual([pos for pos, _ in query_sims], [pos for pos, _ in expected])
+                    self.assertTrue(numpy.allclose([sim for _, sim in query_sims], [sim for _, sim in expected]))
+            index.destroy()
+
+    def testParallelShards(self):
+        """test querying the shards with a persistent thread pool"""
+        from gensim.similarities import docsim
+        index = self.cls(None, corpus, num_features=len(dictionary), shardsize=2)
+        expected = {}
+        for num_best in [None, 3]:
+            index.num_best = num_best
+            expected[num_best] = (index[corpus[0]], index[corpus])
+        parallel = docsim.PARALLEL_SHARDS
+        docsim.PARALLEL_SHARDS = 3
+        try:
+            for num_best in [None, 3]:
+                index.num_best = num_best
+                single, batch = index[corpus[0]], index[corpus]
+                if num_best is None:
+                    self.assertTrue(numpy.allclose(single, expected[num_best][0]))
+                    self.assertTrue(numpy.allclose(batch, expected[num_best][1]))
+                else:
+                    self.assertEqual([doc for doc, _ in single], [doc for doc, _ in expected[num_best][0]])
+                    self.assertEqual([[doc for doc, _ in sims] for sims in batch],
+                                     [[doc for doc, _ in sims] for sims in expected[num_best][1]])
+            pool = index.get_pool()
+            self.assertTrue(pool is not None)
+            index[corpus[1]]
+            self.assertTrue(index.get_pool() is pool)  # the pool is reused across queries
+
+            fname = testfile() + '.parallel'
+            index.save(fname)
+            index2 = self.cls.load(fname)
+            self.assertTrue(index2._pool is None)
+            self.assertTrue(numpy.allclose(index2[corpus[0]], index[corpus[0]]))
+            index2.close_pool()
+            os.remove(fname)
+        finally:
+            docsim.PARALLEL_SHARDS = parallel
+            index.destroy()
+        self.assertTrue(index._pool is None)
+
+    def testInterleavedAdds(self):
+        """test adding documents between queries, with the tail compacted into shards in the background"""
+        rng = numpy.random.RandomState(0)
+        docs = [matutils.full2sparse(doc) for doc in rng.rand(40, len(dictionary)) * (rng.rand(40, len(dictionary)) < 0.2)]
+        expected = self.cls(None, docs, num_features=len(dictionary), shardsize=1000)
+        index = self.cls(None, docs[:3], num_features=len(dictionary), shardsize=8)
+        for num_docs in range(3, len(docs)):
+            sims = index[corpus]
+            self.assertEqual(sims.shape, (len(corpus), num_docs))
+            self.assertTrue(numpy.allclose(sims, expected[corpus][:, :num_docs]))
+            index.add_documents(docs[num_docs: num_docs + 1])
+        index.finish_compaction()
+        self.assertTrue(index.shards)  # full shards were written to disk along the way
+        self.assertTrue(all(len(shard) == 8 for shard in index.shards))
+        self.assertEqual(len(index), len(docs))
+        dense = lambda vec: numpy.ravel(vec.toarray() if scipy.sparse.issparse(vec) else vec)
+        for docpos in [0, 8, 37, 39]:
+            self.assertTrue(numpy.allclose(dense(index.vector_by_id(docpos)), dense(expected.vector_by_id(docpos))))
+        index.num_best = 5
+        expected.num_best = 5
+        for sims, expected_sims in zip(index[corpus], expected[corpus]):
+            self.assertTrue(numpy.allclose([sim for _, sim in sims], [sim for _, sim in expected_sims]))
+
+        fname = testfile() + '.interleaved'
+        index.save(fname)
+        self.assertEqual(index.tail, [])
+        index2 = self.cls.load(fname)
+        self.assertEqual(len(index2), len(docs))
+        index2.num_best = None
+        expected.num_best = None
+        self.assertTrue(numpy.allclose(index2[corpus], expected[corpus]))
+        index2.add_documents(docs[:2])
+        self.assertTrue(numpy.allclose(index2[corpus][:, :len(docs)], expected[corpus]))
+        os.remove(fname)
+        index.destroy()
+        expected.destroy()
+
     def testMmapCompressed(self):
         pass
         # turns out this test doesn't exercise this because there are no arrays
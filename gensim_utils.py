@@ -2,10 +2,12 @@ from nltk import bigrams
 import gensim
 import numpy as np
 
-def get_context_matrix(model, word_vocabs, word_index, fixed_size=True, padding_words=False):
+from vocab_index import VocabIndex
+
+def get_context_matrix(model, word_ids, word_index, fixed_size=True, padding_words=False):
     """
-    `word_index` is the index in word_vocabs where the target word appears.
-    # word_vocabs is a list of vocabs corresponding to sentence indices
+    `word_index` is the index in word_ids where the target word appears.
+    # word_ids is a list of vocab indices corresponding to sentence indices
 
     if `fixed_size` is false, it will not put anything in the list for things out of range - it will simply no-op.
     """
@@ -14,10 +16,10 @@ def get_context_matrix(model, word_vocabs, word_index, fixed_size=True, padding_
     for i in range(start, word_index + model.window + 1):
         if i == word_index:
             continue
-        if 0 <= i < len(word_vocabs):
-            context_matrix.append(word_vocabs[i].index)
-            #assert word_vocabs[i] != len(model.vocab)
-            #assert word_vocabs[i] != len(model.vocab) + 1
+        if 0 <= i < len(word_ids):
+            context_matrix.append(word_ids[i])
+            #assert word_ids[i] != len(model.vocab)
+            #assert word_ids[i] != len(model.vocab) + 1
         elif i < 0: # before sentence
             if fixed_size and padding_words:
                 context_matrix.append(len(model.vocab)) # this is a "padding" vector (<S> token)
@@ -29,12 +31,14 @@ def get_context_matrix(model, word_vocabs, word_index, fixed_size=True, padding_
     return context_matrix
 
 
-def get_target_y(word_vocabs, word_index):
-    return word_vocabs[word_index].index
+def get_target_y(word_ids, word_index):
+    return word_ids[word_index]
 
 
-def batch_generator(model, sentences, batch_size=512, n_iters=1, fixed_size=True, stopwords=set()):
+def batch_generator(model, sentences, batch_size=512, n_iters=1, fixed_size=True, stopwords=set(), vocab=None):
     '''
+    `vocab` is a VocabIndex for `model` (built from the model if not given)
+
     if `fixed_size` is True, sentences will only include words and contexts in the middle of sentences
         (because the first word in the sentence doesn't have 5 words before it)
     otherwise, it will include all words in the sentence. In that case, the context will
@@ -42,20 +46,24 @@ def batch_generator(model, sentences, batch_size=512, n_iters=1, fixed_size=True
     '''
     if not n_iters:
         n_iters = model.iter
+    if vocab is None:
+        vocab = model if isinstance(model, VocabIndex) else VocabIndex.from_model(model)
     batch = []
     for i in range(n_iters):
         #print('STARTING NEW TRAINING SET ITER!!!!\nITER {}\n'.format(i))
         for sentence in sentences:
-            word_vocabs = [model.vocab[w] for w in sentence if w in model.vocab and w not in stopwords]
-            for pos, word in enumerate(word_vocabs):
+            if stopwords:
+                sentence = [w for w in sentence if w not in stopwords]
+            word_ids = vocab.encode(sentence).tolist()
+            for pos, word in enumerate(word_ids):
                 if fixed_size:
                     if pos < model.window:
                         continue
-                    if pos + model.window >= len(word_vocabs):
+                    if pos + model.window >= len(word_ids):
                         break
                 # `word` is the word we're trying to predict
-                word_matrix = get_context_matrix(model, word_vocabs, pos, fixed_size=fixed_size)
-                target_y = get_target_y(word_vocabs, pos)
+                word_matrix = get_context_matrix(model, word_ids, pos, fixed_size=fixed_size)
+                target_y = get_target_y(word_ids, pos)
                 batch.append((word_matrix, target_y))
             if len(batch) >= batch_size:
                 yield batch
@@ -63,16 +71,20 @@ def batch_generator(model, sentences, batch_size=512, n_iters=1, fixed_size=True
         if batch:
             yield batch
 
-def batch_generator2(model, sentences, batch_size):
+def batch_generator2(model, sentences, batch_size, vocab=None):
     '''
     Outputs sentences in chunks of 11. No word/context pairs or anything. 
+    `model` can be a gensim model or a VocabIndex (anything with `window`).
+    `vocab` is a VocabIndex for `model` (built from the model if not given)
     '''
+    if vocab is None:
+        vocab = model if isinstance(model, VocabIndex) else VocabIndex.from_model(model)
     batch = []
     def append_chunks(l, n):
         for i in range(0, len(l), n):
             batch.append(l[i:i+n])
     for sentence in sentences:
-        words = [model.vocab[w].index for w in sentence if w in model.vocab]
+        words = vocab.encode(sentence).tolist()
         append_chunks(words, 1 + 2*model.window)
         if len(batch) >= batch_size:
             yield batch
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from embedding_io import guess_format, npy_vocab_fname
+
+# Part of every key: bump it whenever a change to the evaluation code changes scores,
+# so that results computed by the old code are not returned anymore.
+RESULTS_VERSION = 1
+
+
+def _atomic_write_json(fname, obj):
+    ''' Writes `obj` to `fname` through a temporary file, so concurrent readers/writers never see a partial file. '''
+    fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_fname, fname)
+
+
+class ResultStore(object):
+    '''
+    Persistent evaluation results, one small json file per (vectors content hash, task, parameters) under `root`.
+
+    Keys depend on the content of the vectors file (and of its vocab sidecar for .npy files), not on its name,
+    so re-running an evaluation on unchanged vectors is a file read, across processes and sessions.
+    Content hashes are themselves memoized by (path, size, mtime) in `root/hashes.json`.
+    Values must be json-serializable.
+    Keys cannot see changes to the code that computed a result, see `RESULTS_VERSION`.
+    '''
+    def __init__(self, root='results_cache'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._hashes_fname = os.path.join(root, 'hashes.json')
+        self._hashes = None
+
+    def file_hash(self, fname, chunk_size=1 << 20):
+        ''' sha1 of the contents of the vectors file `fname` (plus its vocab sidecar for .npy files). '''
+        fnames = [fname]
+        if guess_format(fname) == 'npy':
+            fnames.append(npy_vocab_fname(fname) + '.words.npy')
+        stats = [[os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)] for f in fnames]
+        memo_key = json.dumps(stats)
+        if self._hashes is None:
+            self._hashes = {}
+            if os.path.exists(self._hashes_fname):
+                with open(self._hashes_fname) as f:
+                    self._hashes = json.load(f)
+        if memo_key not in self._hashes:
+            sha = hashlib.sha1()
+            for f_name in fnames:
+                with open(f_name, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        sha.update(chunk)
+            self._hashes[memo_key] = sha.hexdigest()
+            _atomic_write_json(self._hashes_fname, self._hashes)
+        return self._hashes[memo_key]
+
+    def key(self, vectors_fname, task, **params):
+        ''' Store key of the result of `task` with `params` on the vectors in `vectors_fname`. '''
+        blob = json.dumps([RESULTS_VERSION, self.file_hash(vectors_fname), task, params], sort_keys=True)
+        return '{}_{}'.format(task, hashlib.sha1(blob.encode('utf-8')).hexdigest())
+
+    def _fname(self, key):
+        return os.path.join(self.root, key + '.json')
+
+    def __contains__(self, key):
+        return os.path.exists(self._fname(key))
+
+    def get(self, key, default=None):
+        try:
+            with open(self._fname(key)) as f:
+                return json.load(f)['value']
+        except (IOError, OSError, ValueError):
+            return default
+
+    def put(self, key, value, **info):
+        ''' Stores `value` under `key`. `info` (e.g. the method name) is saved alongside it, for humans only. '''
+        _atomic_write_json(self._fname(key), {'value': value, 'info': info})
+
+    def get_or_compute(self, vectors_fname, task, compute, **params):
+        ''' Stored result of `task` on `vectors_fname` with `params`, or `compute()` (then stored). '''
+        key = self.key(vectors_fname, task, **params)
+        if key in self:
+            return self.get(key)
+        value = compute()
+        self.put(key, value, fname=vectors_fname)
+        return value
@@ -4,7 +4,9 @@ import numpy as np
 import os
 import random
 import tensorflow as tf
+from embedding_io import save_embedding
 from tensor_decomp import CPDecomp
+from vocab_index import VocabIndex
 import time
 import scipy
 
@@ -22,6 +24,11 @@ def update_counts(self, batch):
     return batch_counts, num_samples
 
 
+def _vocab_len(model):
+    ''' Vocabulary size of a VocabIndex (without decoding its words) or of a gensim model. '''
+    return len(model) if isinstance(model, VocabIndex) else len(model.vocab)
+
+
 class TensorEmbedding(object):
     def __init__(self, vocab_model, embedding_dim, window_size=10, optimizer_type='adam', ndims=3):
         self.model = vocab_model
@@ -32,35 +39,10 @@ class TensorEmbedding(object):
         if self.ndims > 3:
             raise ValueError('As of right now, ndims can be at most 3')
 
-        self.vocab_len = len(self.model.vocab)
+        self.vocab_len = _vocab_len(self.model)
 
     def write_embedding_to_file(self, fname='vectors.txt'):
-        vectors = {}
-        model = self.model
-        embedding = self.get_embedding_matrix()
-        count = 0 # number of vects written
-        for word in model.vocab:
-            word_vocab = model.vocab[word]
-            word_vect = embedding[word_vocab.index]
-            vect_list = ['{:.3f}'.format(x) for x in word_vect]
-            vectors[word] = ' '.join(vect_list)
-        with open(fname, 'w') as f:
-            for word in vectors:
-                if not word:
-                    continue
-                try:
-                    f.write(word.encode('utf-8') + ' ' + vectors[word] + '\n')
-                    count += 1
-                except TypeError:
-                    f.write(word + ' ' + vectors[word] + '\n')
-                    count += 1
-                except:
-                    pass
-        with open(fname, 'r+') as f:
-            content = f.read()
-            f.seek(0, 0)
-            f.write('{} {}\n'.format(count, self.embedding_dim))  # write the number of vects
-            f.write(content)
+        save_embedding(self.get_embedding_matrix(), self.model, fname, precision=3)
 
     def get_embedding_matrix(self):
         embedding = self.decomp_method.U.eval(self.sess)
@@ -142,7 +124,7 @@ class PpmiSvdEmbedding(TensorEmbedding):
 class PMIGatherer(object):
     def __init__(self, vocab_model, n=2):
         self.model = vocab_model
-        self.vocab_len = len(self.model.vocab)
+        self.vocab_len = _vocab_len(self.model)
         self.n = n
         self.debug = True
 
@@ -331,7 +313,7 @@ class PMIGatherer(object):
             new_indices = []
             new_values = []
             for _ in range(int(neg_sample_percent * len(indices))):
-                ix = np.random.randint(low=0, high=len(self.model.vocab), size=(self.n,))
+                ix = np.random.randint(low=0, high=self.vocab_len, size=(self.n,))
                 ix = tuple(sorted(ix))
                 if ix not in self.n_counts:
                     if len(ix) < self.n:
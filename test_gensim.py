@@ -20,12 +20,16 @@ from nltk.corpus import stopwords
 from sklearn.utils import shuffle
 from tensor_embedding import PMIGatherer, PpmiSvdEmbedding
 from tensor_decomp import CPDecomp, SymmetricCPDecomp, JointSymmetricCPDecomp
+from vocab_index import VocabIndex
 
 
 stopwords = set(stopwords.words('english'))
 grammar_stopwords = {',', "''", '``', '.', 'the'}
 stopwords = stopwords.union(grammar_stopwords)
 
+# methods trained by the (modified) gensim Word2Vec, which need the full model, not just the vocab
+GENSIM_METHODS = ['cnn', 'cbow', 'tt', 'subspace', 'sgns', 'hosg']
+
 
 class GensimSandbox(object):
     def __init__(self, method, embedding_dim, num_articles, min_count, gpu=True):
@@ -37,6 +41,7 @@ class GensimSandbox(object):
 
         # To be assigned later
         self.model = None
+        self.vocab = None  # VocabIndex, see get_vocab
         self.sess = None
         self.embedding = None
         self.to_save = {}
@@ -64,7 +69,25 @@ class GensimSandbox(object):
         print("num articles: {}".format(count))
         raise StopIteration
 
+    def get_vocab(self, fname='wikimodel'):
+        '''
+        Loads the vocab artifact saved next to the gensim model (`wikimodel_*.words.npy`, `.counts.npy`, `.config.json`).
+        This is all most methods need, and it loads in milliseconds without depickling the full Word2Vec model.
+        The model is only built / depickled if the artifact doesn't exist yet, or was saved without the model's window.
+        '''
+        fname += '_{}_{}'.format(self.num_articles, self.min_count)
+        if VocabIndex.exists(fname):
+            t = time.time()
+            self.vocab = VocabIndex.load(fname)
+            if 'window' in self.vocab.config:
+                print('Loading vocab took {:.3f} secs. length of vocab: {}'.format(time.time() - t, len(self.vocab)))
+                return self.vocab
+            print('vocab artifact {} has no window, rebuilding it from the model'.format(fname))
+        self.get_model_with_vocab()
+        return self.vocab
+
     def get_model_with_vocab(self, fname='wikimodel'):
+        ''' Full gensim model, only needed for the gensim-trained methods (cbow, sgns, ...). '''
         fname += '_{}_{}'.format(self.num_articles, self.min_count)
         model = gensim.models.Word2Vec(
             iter=1,
@@ -82,6 +105,10 @@ class GensimSandbox(object):
             print('depickling model...')
             with open(fname, 'rb') as f:
                 model = dill.load(f)
+        self.vocab = VocabIndex.load(fname) if VocabIndex.exists(fname) else None
+        if self.vocab is None or 'window' not in self.vocab.config:
+            self.vocab = VocabIndex.from_model(model, num_articles=self.num_articles, min_count=self.min_count)
+            self.vocab.save(fname)
         model.tt = 0
         model.cbow = 0
         model.sgns = 0
@@ -123,7 +150,7 @@ class GensimSandbox(object):
         sess.run(tf.global_variables_initializer())
         saver.save(sess, os.path.join(LOG_DIR, "model.ckpt"), global_step)
         f = open(LOG_DIR + '/metadata.tsv', 'w')
-        for i in range(len(self.model.vocab)): f.write(self.model.index2word[i] + '\n')
+        for word in self.vocab.index2word: f.write(word + '\n')
         f.close()
         from tensorflow.contrib.tensorboard.plugins import projector
         print('Adding projector config...')
@@ -138,7 +165,7 @@ class GensimSandbox(object):
 
     def train_gensim_embedding(self):
         print('training...')
-        batches = batch_generator(self.model, self.sentences_generator(), batch_size=128, stopwords=stopwords)
+        batches = batch_generator(self.model, self.sentences_generator(), batch_size=128, stopwords=stopwords, vocab=self.vocab)
         self.model.train(sentences=None, batches=batches, gpu=self.gpu)
         print('finished training!')
 
@@ -163,8 +190,8 @@ class GensimSandbox(object):
                 print('Loading gatherer took {} secs'.format(time.time() - t))
         else:
             # batch_size doesn't matter. But higher is probably better (in terms of threading & speed)
-            batches = batch_generator2(self.model, self.sentences_generator(num_articles=self.num_articles), batch_size=1000)
-            gatherer = PMIGatherer(self.model, n=n)
+            batches = batch_generator2(self.vocab, self.sentences_generator(num_articles=self.num_articles), batch_size=1000)
+            gatherer = PMIGatherer(self.vocab, n=n)
             if self.num_articles <= 1e4:
                 gatherer.populate_counts(batches, huge_vocab=False)
             else:
@@ -183,7 +210,7 @@ class GensimSandbox(object):
         shifts = [-np.log2(s) for s in exp_shifts]
 
         def sparse_tensor_batches(batch_size=1000):
-            batches = batch_generator2(self.model, self.sentences_generator(num_articles=self.num_articles), batch_size=batch_size)
+            batches = batch_generator2(self.vocab, self.sentences_generator(num_articles=self.num_articles), batch_size=batch_size)
             for batch in batches:
                 pairlist = [
                     gatherer.create_pmi_tensor(
@@ -209,7 +236,7 @@ class GensimSandbox(object):
             self.to_save['reg_param'] = reg_param
             print('reg_param: {}'.format(reg_param))
             decomp_method = JointSymmetricCPDecomp(
-                size=len(self.model.vocab),
+                size=len(self.vocab),
                 dimlist=dimlist,
                 dimweights=dimweights,
                 rank=self.embedding_dim,
@@ -268,7 +295,7 @@ class GensimSandbox(object):
                     for sampled_indices, sampled_values in zip(grouper(batch_size, indices_shuffled), grouper(batch_size, values_shuffled)):
                         yield (sampled_indices, sampled_values)
             else:  # not is_glove
-                batches = batch_generator2(self.model, self.sentences_generator(), batch_size=batch_size)
+                batches = batch_generator2(self.vocab, self.sentences_generator(), batch_size=batch_size)
                 for batch in batches:
                     sparse_ppmi_tensor_pair = gatherer.create_pmi_tensor(
                         batch=batch,
@@ -304,7 +331,7 @@ class GensimSandbox(object):
                 self.to_save['reg_param'] = reg_param
                 print('reg_param: {}'.format(reg_param))
                 decomp_method = SymmetricCPDecomp(
-                    dim=len(self.model.vocab),
+                    dim=len(self.vocab),
                     ndims=ndims,
                     rank=self.embedding_dim,
                     sess=self.sess,
@@ -318,7 +345,7 @@ class GensimSandbox(object):
             else:
                 decomp_method = CPDecomp(
                     ndims=ndims,
-                    shape=(len(self.model.vocab),)*ndims,
+                    shape=(len(self.vocab),)*ndims,
                     rank=self.embedding_dim,
                     sess=self.sess,
                     optimizer_type='adagrad' if is_glove else 'adam',
@@ -360,10 +387,10 @@ class GensimSandbox(object):
     def train_random_embedding(self, param=0.5, gauss=True):
         if gauss:
             # Gaussian(0, param)
-            self.embedding = np.random.normal(0, param, size=(len(self.model.vocab), self.embedding_dim))
+            self.embedding = np.random.normal(0, param, size=(len(self.vocab), self.embedding_dim))
         else:
             # uniform in [-param/2, param/2]
-            self.embedding = (np.random.rand(len(self.model.vocab), self.embedding_dim) - param) * 2
+            self.embedding = (np.random.rand(len(self.vocab), self.embedding_dim) - param) * 2
 
     def train_save_sp_tensor(self, pmi=True):
         gatherer = self.get_pmi_gatherer(3)
@@ -381,7 +408,7 @@ class GensimSandbox(object):
         config = tf.ConfigProto(allow_soft_placement=True)
         with tf.Session(config=config) as sess:
             U = tf.Variable(tf.random_uniform(
-                shape=[len(self.model.vocab), self.embedding_dim],
+                shape=[len(self.vocab), self.embedding_dim],
                 minval=-1.0,
                 maxval=1.0,
             ), name="U")
@@ -440,12 +467,12 @@ class GensimSandbox(object):
         dense_ppmi_tensor = gatherer.create_pmi_tensor(positive=True, numpy_dense_tensor=True, debug=True)
         del gatherer
 
-        embedding_model = PpmiSvdEmbedding(self.model, embedding_dim=self.embedding_dim)
-        print("calculating SVD on {0}x{0}...".format(len(self.model.vocab)))
+        embedding_model = PpmiSvdEmbedding(self.vocab, embedding_dim=self.embedding_dim)
+        print("calculating SVD on {0}x{0}...".format(len(self.vocab)))
         t = time.time()
         embedding_model.learn_embedding(dense_ppmi_tensor)
         total_svd_time = time.time() - t
-        print("SVD on {}x{} took {}s".format(len(self.model.vocab), len(self.model.vocab), total_svd_time))
+        print("SVD on {}x{} took {}s".format(len(self.vocab), len(self.vocab), total_svd_time))
         self.embedding = embedding_model.get_embedding_matrix()
 
     def evaluate_embedding(self):
@@ -476,18 +503,20 @@ class GensimSandbox(object):
         timestamp = str(datetime.datetime.now())
         with open(parent_dir + '/metadata.txt', 'w') as f:
             f.write('Evaluation time: {}\n'.format(timestamp))
-            f.write('Vocab size: {}\n'.format(len(self.model.vocab)))
+            f.write('Vocab size: {}\n'.format(len(self.vocab)))
             f.write('Elapsed training time: {}\n'.format(time.time() - self.start_time))
             print('Elapsed training time: {}\n'.format(time.time() - self.start_time))
-        write_embedding_to_file(self.embedding, self.model, parent_dir + '/vectors.txt')
+        write_embedding_to_file(self.embedding, self.vocab, parent_dir + '/vectors.npy')  # read by the evaluators
+        write_embedding_to_file(self.embedding, self.vocab, parent_dir + '/vectors.bin')  # portable word2vec binary
         with open(parent_dir + '/embedding.pkl', 'wb') as f:
             dill.dump(self.embedding, f)
-        try:
-            with open(parent_dir + '/model.pkl', 'wb') as f:
-                dill.dump(self.model, f)
-        except Exception as e:
-            print(e)
-            print('caught exception trying to dump model. wooops. carrying on...')
+        if self.model is not None:  # only the gensim methods load the full model
+            try:
+                with open(parent_dir + '/model.pkl', 'wb') as f:
+                    dill.dump(self.model, f)
+            except Exception as e:
+                print(e)
+                print('caught exception trying to dump model. wooops. carrying on...')
         for name, obj in self.to_save.items():
             fname = parent_dir + '/' + name + '.pkl'
             with open(fname, 'wb') as f:
@@ -495,7 +524,10 @@ class GensimSandbox(object):
         self.create_embedding_visualization()
 
     def train(self, experiment='', kwargs={}):
-        self.get_model_with_vocab()
+        if self.method in GENSIM_METHODS:
+            self.get_model_with_vocab()  # also loads (or builds) the vocab artifact
+        else:
+            self.get_vocab()
         self.start_time = time.time()
         if experiment != '':
             experiment = '_' + experiment.replace(' ', '_')
@@ -531,7 +563,7 @@ class GensimSandbox(object):
         elif self.method in ['glove']:
             self.method += experiment
             self.train_online_cp_embedding(ndims=2, symmetric=True, nonneg=False, is_glove=True, **kwargs)
-        elif self.method in ['cnn', 'cbow', 'tt', 'subspace', 'sgns', 'hosg']:
+        elif self.method in GENSIM_METHODS:
             self.method += experiment
             self.train_gensim_embedding()
         elif self.method in ['svd']:
@@ -556,7 +588,7 @@ class GensimSandbox(object):
             print(e)
             import pdb; pdb.set_trace()
             print(e)
-        write_embedding_to_file(self.embedding, self.model, 'vectors_{}.txt'.format(self.method))
+        write_embedding_to_file(self.embedding, self.vocab, 'vectors_{}.npy'.format(self.method))
         results = self.evaluate_embedding()
         self.save_metadata()
         print('All done training and evaluating {}!'.format(self.method))
@@ -0,0 +1,168 @@
+import json
+import os
+import numpy as np
+
+
+class VocabIndex(object):
+    '''
+    Compact, read-only vocabulary: a frozen word -> id table, an id -> word array and the word counts.
+
+    Meant to replace per-token `model.vocab[w].index` lookups (dict lookup + `Vocab` attribute access) in hot loops.
+    Ids are the same as the gensim model's indices, i.e. `index2word[i]` is the word whose `model.vocab[word].index == i`.
+
+    `config` holds the vocab-building parameters that callers need besides the words themselves
+    (`window`, `min_count`, `num_articles`, ...).
+
+    Only depends on numpy, so it can be loaded without TF or the Cython word2vec modules.
+    '''
+    def __init__(self, words, counts=None, config=None):
+        index2word = np.empty(len(words), dtype=object)
+        index2word[:] = list(words)
+        if counts is None:
+            counts = np.zeros(len(words), dtype=np.int64)
+        self._init(index2word, None, np.asarray(counts, dtype=np.int64), config)
+        self._word2id = self._build_word2id()
+
+    def _init(self, index2word, blob, counts, config):
+        self._index2word = index2word
+        self._blob = blob  # utf-8, newline-separated words (only set when loaded from disk)
+        self._offsets = None
+        self._word2id = None
+        self.counts = counts
+        self.config = dict(config or {})
+        if index2word is not None and len(index2word) != len(counts):
+            raise ValueError('Got {} words but {} counts'.format(len(index2word), len(counts)))
+
+    def _build_word2id(self):
+        word2id = {word: i for i, word in enumerate(self.index2word)}
+        if len(word2id) != len(self):
+            raise ValueError('Vocabulary has duplicate words')
+        return word2id
+
+    @classmethod
+    def from_model(cls, model, **config):
+        ''' Builds the index from a gensim `Word2Vec` model (or anything with `vocab` and `index2word`). '''
+        words = model.index2word
+        counts = np.fromiter((model.vocab[w].count for w in words), dtype=np.int64, count=len(words))
+        if hasattr(model, 'window'):
+            config.setdefault('window', model.window)
+        return cls(words, counts, config=config)
+
+    @property
+    def index2word(self):
+        ''' id -> word array. Decoded from the on-disk blob on first access. '''
+        if self._index2word is None:
+            words = self._blob.tobytes().decode('utf-8').split('\n') if len(self.counts) else []
+            index2word = np.empty(len(words), dtype=object)
+            index2word[:] = words
+            if len(index2word) != len(self.counts):
+                raise ValueError('Got {} words but {} counts'.format(len(index2word), len(self.counts)))
+            self._index2word = index2word
+        return self._index2word
+
+    @property
+    def word2id(self):
+        ''' word -> id dict. Built on first lookup, so loading an index stays cheap. '''
+        if self._word2id is None:
+            self._word2id = self._build_word2id()
+        return self._word2id
+
+    @property
+    def window(self):
+        if 'window' not in self.config:
+            raise ValueError('This vocab index was saved without a window; rebuild it from the model (see VocabIndex.from_model)')
+        return self.config['window']
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, word):
+        return word in self.word2id
+
+    def __getitem__(self, word):
+        return self.word2id[word]
+
+    def __iter__(self):
+        return iter(self.index2word)
+
+    def get(self, word, default=None):
+        return self.word2id.get(word, default)
+
+    def encode(self, tokens, drop_unknown=True):
+        '''
+        Maps a list of tokens to an int32 array of ids.
+        Out-of-vocabulary tokens are dropped, or mapped to -1 if `drop_unknown` is False.
+        '''
+        get = self.word2id.get
+        if drop_unknown:
+            ids = [i for i in map(get, tokens) if i is not None]
+        else:
+            ids = [get(w, -1) for w in tokens]
+        return np.array(ids, dtype=np.int32)
+
+    def decode(self, ids):
+        '''
+        Maps an iterable of ids back to a list of words.
+        Before `index2word` has been materialized, only the requested words are decoded from the blob.
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._index2word is not None:
+            return self._index2word[ids].tolist()
+        if self._offsets is None:
+            ends = np.flatnonzero(np.asarray(self._blob) == ord('\n'))
+            self._offsets = np.concatenate(([0], ends + 1, [len(self._blob) + 1]))
+        starts, ends = self._offsets[ids], self._offsets[ids + 1] - 1
+        return [self._blob[s:e].tobytes().decode('utf-8') for s, e in zip(starts, ends)]
+
+    def save(self, fname):
+        '''
+        Writes the index next to `fname` as plain .npy arrays plus a json config (no pickling of python objects):
+            `fname.words.npy` (utf-8 bytes, newline-separated), `fname.counts.npy`, `fname.config.json`
+        '''
+        blob = '\n'.join(self.index2word).encode('utf-8')
+        np.save(fname + '.words.npy', np.frombuffer(blob, dtype=np.uint8))
+        np.save(fname + '.counts.npy', self.counts)
+        with open(fname + '.config.json', 'w') as f:
+            json.dump(self.config, f)
+
+    @staticmethod
+    def exists(fname):
+        return all(os.path.exists(fname + ext) for ext in ['.words.npy', '.counts.npy'])
+
+    @classmethod
+    def load(cls, fname, mmap=True):
+        '''
+        Loads an index written by `save`. With `mmap`, the arrays are memory-mapped and the
+        word table is only decoded when first needed, so this takes milliseconds.
+        '''
+        mmap_mode = 'r' if mmap else None
+        blob = np.load(fname + '.words.npy', mmap_mode=mmap_mode)
+        counts = np.load(fname + '.counts.npy', mmap_mode=mmap_mode)
+        config = {}
+        if os.path.exists(fname + '.config.json'):
+            with open(fname + '.config.json') as f:
+                config = json.load(f)
+        vocab = cls.__new__(cls)
+        vocab._init(None, blob, counts, config)
+        return vocab
+
+
+def intersect_vocabs(vocabs):
+    '''
+    Shared vocabulary of several VocabIndexes, in the order of the first one.
+    Returns (shared VocabIndex, [row-index array into each input vocab]), so that
+    `rows[i][j]` is the id of `shared.index2word[j]` in `vocabs[i]`.
+    '''
+    first = vocabs[0]
+    words = first.index2word
+    all_rows = [np.arange(len(first), dtype=np.int64)]
+    mask = np.ones(len(first), dtype=bool)
+    for vocab in vocabs[1:]:
+        if vocab is first:
+            rows = all_rows[0]
+        else:
+            rows = vocab.encode(words, drop_unknown=False).astype(np.int64)
+        mask &= rows >= 0
+        all_rows.append(rows)
+    shared = VocabIndex(words[mask], first.counts[mask], config=first.config)
+    return shared, [rows[mask] for rows in all_rows]
@@ -46,6 +46,7 @@ class Embedding(object):
         self.supports_phrases = kwargs.get("supports_phrases", False)
         self.google_news_normalize = kwargs.get("google_news_normalize", False)
         self.case_sensitive = kwargs.get("case_sensitive", False)
+        self._normalized = {}  # memoized get_normalized
         if "case_sensitive" not in kwargs:
             for word in self.vocabulary:
                 if word[0].isupper() and (word[0] != word[0].lower()):
@@ -65,12 +66,22 @@ class Embedding(object):
         If the given word is out-of-vocabulary, None is returned."""
         pass
 
+    def get_vectors(self, words):
+        """Looks up every word of the given list in this embedding (None for out-of-vocabulary words)."""
+        return [self.get_vector(w) for w in words]
+
     @abc.abstractmethod
     def in_vocabulary(self, word):
         """Returns true if the given word/phrase is in this embedding's vocabulary"""
         pass
 
     def get_normalized(self, text):
+        key = (text, self.case_sensitive, self.google_news_normalize)
+        if key not in self._normalized:
+            self._normalized[key] = self._normalize(text)
+        return self._normalized[key]
+
+    def _normalize(self, text):
         if not self.case_sensitive:
             text = text.lower()
         if not self.google_news_normalize:
@@ -81,6 +92,19 @@ class Embedding(object):
             exploded[start:end] = '#' * (end - start)
         return ''.join(exploded)
 
+    def lookup_all(self, texts):
+        """Looks up all the given words and phrases at once. Returns a dict text -> vector (None if OOV).
+        Every distinct text is normalized and looked up once; single words are fetched with get_vectors."""
+        result = {}
+        words = []
+        for text in set(texts):
+            if '_' in text:
+                result[text] = self.lookup_phrase(text)
+            else:
+                words.append(text)
+        result.update(zip(words, self.get_vectors([self.get_normalized(w) for w in words])))
+        return result
+
     # Disable normalization by default, since it doesn't affect cosine similarity
     @lru_cache(maxsize=64)
     def lookup_phrase(self, phrase, normalize_vec=False):
@@ -115,7 +139,10 @@ class Embedding(object):
 
             
 class WrappedEmbedding(Embedding, polyglot_mapping.Embedding):
-    """Convenience wrapper around polyglot_mapping.Embedding"""
+    """Convenience wrapper around polyglot_mapping.Embedding
+
+    `vocabulary` can be any word -> row mapping with `get`, `__len__` and `__iter__`
+    (e.g. an already loaded vocabulary index), `vectors` any matrix (e.g. memory-mapped)."""
     def __init__(self, vocabulary, vectors, **kwargs):
         polyglot_mapping.Embedding.__init__(self, vocabulary, vectors)
         Embedding.__init__(self, **kwargs)
@@ -129,6 +156,13 @@ class WrappedEmbedding(Embedding, polyglot_mapping.Embedding):
             return None
         return self.vectors[vec]
 
+    def get_vectors(self, words):
+        # one fancy-indexing operation for all the known words
+        ids = [self.vocabulary.get(w) for w in words]
+        known = [i for i in ids if i is not None]
+        rows = iter(self.vectors[known]) if known else iter(())
+        return [None if i is None else next(rows) for i in ids]
+
     @staticmethod
     def __wrap(e, **kwargs):
         return WrappedEmbedding(e.vocabulary, e.vectors, **kwargs)
@@ -20,6 +20,7 @@ class Evaluator(object):
     def __init__(self, test_groups):
         self.reset()
         self.test_groups = list(test_groups)
+        self._resolved = (None, None)  # (embedding, resolved test groups), see resolve
 
     def reset(self):
         self.num_total_groups = 0
@@ -52,8 +53,20 @@ class Evaluator(object):
         op, size = self.extract_op(test_case)
         return (float(op) / size, op == size)
 
-    def score_test_cases(self, test_group, embedding, n):
-        resolved = test_group.resolve(embedding, n=n)
+    def resolve(self, embedding):
+        """Returns the test groups resolved against the given embedding.
+        The words of all groups are looked up in one pass, and the result is kept for the
+        next evaluations of the same embedding (e.g. with another n)."""
+        if self._resolved[0] is not embedding:
+            vectors = embedding.lookup_all([w for g in self.test_groups for w in g.cluster + g.outliers])
+            self._resolved = (embedding, [g.resolve(embedding, vectors=vectors) for g in self.test_groups])
+        return self._resolved[1]
+
+    def score_test_cases(self, test_group, embedding, n, resolved=None):
+        if resolved is None:
+            resolved = test_group.resolve(embedding, n=n)
+        else:
+            resolved = resolved.with_n(n)
 
         self.num_total_cluster_items += len(test_group.cluster)
         self.num_total_outliers += len(test_group.outliers)
@@ -76,9 +89,9 @@ class Evaluator(object):
 
     def evaluate(self, embedding, n):
         self.reset()
-        for test_group in self.test_groups:
+        for test_group, resolved in zip(self.test_groups, self.resolve(embedding)):
             self.num_total_groups += 1
-            self.score_test_cases(test_group, embedding, n=n)
+            self.score_test_cases(test_group, embedding, n=n, resolved=resolved)
 
     @property
     def opp(self):
@@ -14,8 +14,9 @@
 # limitations under the License.
 #
 import os.path
+import numpy as np
 from collections import defaultdict
-from .utils import decode, similarity, similarity3
+from .utils import decode, similarity3_from_gram
 
 class TestGroup(object):
     def __init__(self, name, cluster, outliers):
@@ -37,10 +38,14 @@ class TestGroup(object):
         ''' We need at least n words in the cluster to get the outlier compactness '''
         return len(self.cluster) >= self.n and len(self.outliers) > 0
 
-    def resolve(self, embedding, n=2):
+    def resolve(self, embedding, n=2, vectors=None):
+        """`vectors` is an optional dict word -> vector (None if OOV) of the words of this group,
+        as returned by embedding.lookup_all, to look the words of many groups up at once"""
+        if vectors is None:
+            vectors = embedding.lookup_all(self.cluster + self.outliers)
         # Keep original name as well for possible debugging information
-        filtered_cluster = [(c, embedding[c]) for c in self.cluster if c in embedding]
-        filtered_outliers = [(o, embedding[o]) for o in self.outliers if o in embedding]
+        filtered_cluster = [(c, vectors[c]) for c in self.cluster if vectors[c] is not None]
+        filtered_outliers = [(o, vectors[o]) for o in self.outliers if vectors[o] is not None]
         return ResolvedTestGroup(embedding, self.name, filtered_cluster, filtered_outliers, n=n)
 
     @staticmethod
@@ -69,64 +74,46 @@ class ResolvedTestGroup(TestGroup):
     def resolve(self):
         raise RuntimeError("Cannot resolve resolved test group")
 
+    def with_n(self, n):
+        """The same resolved group, scored with n-wise compactness"""
+        return ResolvedTestGroup(self.embedding, self.name, self.cluster, self.outliers, n=n)
+
     def __iter__(self):
         """Yields tuples of the following form:
         ([(cluster-item-name, cluster-item-vec, cluster-item-compactness) ...],
-          (outlier-item-name, outlier-item-vec, outlier-item-compactness))"""
-        for o in self.outliers:
-            if self.n == 2:
-                with_similarities = []
-
-                l = len(self.cluster)
-                for i in range(l):
-                   e1 = self.cluster[i]
-                   compactness = 0.0
-                   for j in range(l):
-                       if i == j: continue
-                       e2 = self.cluster[j]
-                       #outlier_compactness += similarity(e1[1], e2[1])
-                       compactness += similarity(e2[1], o[1])
-                       for k in range(j+1, l):
-                           if k == i:
-                               continue
-                           e3 = self.cluster[k]
-                           compactness += similarity(e2[1], e3[1])
-                   with_similarities.append((e1[0], e1[1], compactness)) # try replaceing one of the cluster words with the outlier, see if the predicted word remains the same
-
-                words_seen = set()
-                outlier_compactness = 0.0
-                for i, e1 in enumerate(self.cluster):
-                   for j in range(i+1, l):
-                       e2 = self.cluster[j]
-                       outlier_compactness += similarity(e1[1], e2[1])
-                yield (with_similarities, (o[0], o[1], outlier_compactness))
-            elif self.n == 3:
-                with_similarities = []
-                l = len(self.cluster)
-                for i in range(l):
-                   e1 = self.cluster[i]
-                   compactness = 0.0
-                   for j in range(l):
-                       if i == j: continue
-                       e2 = self.cluster[j]
-                       for k in range(j+1, l):
-                           if k == i:
-                               continue
-                           e3 = self.cluster[k]
-                           compactness += similarity3(e2[1], e3[1], o[1])
-                           for m in range(k+1, l):
-                               if m == i:
-                                   continue
-                               e4 = self.cluster[m]
-                               compactness += similarity3(e2[1], e3[1], e4[1])
-                   with_similarities.append((e1[0], e1[1], compactness)) # try replaceing one of the cluster words with the outlier, see if the predicted word remains the same
+          (outlier-item-name, outlier-item-vec, outlier-item-compactness))
 
-                outlier_compactness = 0.0
-                for i, e1 in enumerate(self.cluster):
-                   for j in range(i+1, l):
-                       e2 = self.cluster[j]
-                       for k in range(j+1, l):
-                           e3 = self.cluster[k]
-                           outlier_compactness += similarity3(e1[1], e2[1], e3[1])
-                yield (with_similarities, (o[0], o[1], outlier_compactness))
+        The compactness of a cluster item is that of the cluster with the item replaced by the outlier:
+        the sum of the similarities of every pair (n=2) or triple (n=3) of words in it. All of them are
+        derived from the Gram matrix of the group's vectors, the sums over the cluster being computed
+        once per group and the ones involving the outlier once per outlier (inclusion-exclusion)."""
+        l = len(self.cluster)
+        vectors = np.array([e[1] for e in self.cluster] + [o[1] for o in self.outliers], dtype=np.float64)
+        gram = np.dot(vectors, vectors.T)
+        idx = np.arange(l)
+        if self.n == 2:
+            norms = np.sqrt(np.diag(gram))
+            cos = gram / np.outer(norms, norms)
+            pairs = np.triu(cos[:l, :l], 1)
+            # sum of the similarities of the pairs of cluster items, and of the pairs containing each item
+            outlier_compactness = pairs.sum()
+            without_item = outlier_compactness - (pairs.sum(axis=0) + pairs.sum(axis=1))
+            for t, o in enumerate(self.outliers):
+                outlier_sims = cos[:l, l + t]
+                compactness = (outlier_sims.sum() - outlier_sims) + without_item
+                yield (self._with_compactness(compactness), (o[0], o[1], outlier_compactness))
+        elif self.n == 3:
+            distinct = (idx[:, None, None] != idx[None, :, None]) & (idx[None, :, None] != idx[None, None, :]) & \
+                (idx[:, None, None] != idx[None, None, :])
+            triples = similarity3_from_gram(gram, idx[:, None, None], idx[None, :, None], idx[None, None, :]) * distinct
+            # every unordered triple is counted 6 times in `triples`, every one containing a given item twice in its slice
+            outlier_compactness = triples.sum() / 6.0
+            without_item = outlier_compactness - triples.sum(axis=(1, 2)) / 2.0
+            off_diagonal = idx[:, None] != idx[None, :]
+            for t, o in enumerate(self.outliers):
+                outlier_triples = similarity3_from_gram(gram, idx[:, None], idx[None, :], l + t) * off_diagonal
+                compactness = (outlier_triples.sum() / 2.0 - outlier_triples.sum(axis=1)) + without_item
+                yield (self._with_compactness(compactness), (o[0], o[1], outlier_compactness))
 
+    def _with_compactness(self, compactness):
+        return [(e[0], e[1], c) for e, c in zip(self.cluster, compactness)]
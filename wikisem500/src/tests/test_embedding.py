@@ -61,6 +61,18 @@ class EmbeddingTest(EmbeddingTestCase):
         self.assertTrue(self.vectors.google_news_normalize)
         self.assertTrue('NIKON_2002' in self.vectors)
 
+    def test_lookup_all(self):
+        self.build_test_vectors(google_news_normalize=True, supports_phrases=True)
+        words = ['dog', 'DOG', 'cat_dog', 'NIKON_2002', 'unknown', 'dog']
+        found = self.vectors.lookup_all(words)
+        self.assertEqual(sorted(found), sorted(set(words)))
+        for w in words:
+            if self.vectors[w] is None:
+                self.assertIsNone(found[w])
+            else:
+                self.assertTrue(np.array_equal(found[w], self.vectors[w]))
+        self.assertIsNone(found['unknown'])
+
 suite = unittest.TestLoader().loadTestsFromTestCase(EmbeddingTest)
 
 if __name__ == "__main__":
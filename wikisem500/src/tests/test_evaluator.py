@@ -37,6 +37,19 @@ class EvaluatorTest(EmbeddingTestCase):
         self.assertEquals(op, 1.0)
         self.assertTrue(detected)
 
+    def test_resolution_reused(self):
+        groups = [self.group, TestGroup("tgroup2", ["cat", "dog", "fish", "unknown"], ["NIKON_2002", "obama"])]
+        evaluator = Evaluator(groups)
+        for n in [2, 3, 2]:
+            evaluator.evaluate(self.vectors, n=n)
+            fresh = Evaluator(groups)
+            fresh.resolve = lambda embedding: [g.resolve(embedding) for g in groups]
+            fresh.evaluate(self.vectors, n=n)
+            self.assertEqual((evaluator.opp, evaluator.accuracy, evaluator.num_cases),
+                             (fresh.opp, fresh.accuracy, fresh.num_cases))
+            self.assertEqual(evaluator.num_filtered_cluster_items, 1)
+        self.assertIs(evaluator.resolve(self.vectors), evaluator.resolve(self.vectors))
+
 suite = unittest.TestLoader().loadTestsFromTestCase(EvaluatorTest)
 
 if __name__ == "__main__":
@@ -13,9 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import itertools
 import unittest
 
+import numpy as np
+
 from ..outlier_test_group import TestGroup, ResolvedTestGroup
+from ..utils import similarity, similarity3
 
 
 from .utils_tests import EmbeddingTestCase
@@ -38,6 +42,23 @@ class TestGroupTest(EmbeddingTestCase):
         self.assertEqual(len([x for x in self.resolved]), 2)
         self.assertEqual([o[0] for c,o in self.resolved], ["cat_dog", "obama"])
 
+    def test_compactness(self):
+        rng = np.random.RandomState(0)
+        cluster = [("c%d" % i, v) for i, v in enumerate(rng.randn(6, 5))]
+        cluster.append(("dup", cluster[0][1].copy()))
+        outliers = [("o%d" % i, v) for i, v in enumerate(rng.randn(3, 5))]
+        for n, sim in [(2, similarity), (3, similarity3)]:
+            resolved = ResolvedTestGroup(None, "random", cluster, outliers, n=n)
+            for (with_similarities, outlier), o in zip(resolved, outliers):
+                self.assertEqual(outlier[0], o[0])
+                self.assertAlmostEqual(outlier[2], sum(sim(*[v for _, v in words]) for words in itertools.combinations(cluster, n)))
+                for i, (name, _, compactness) in enumerate(with_similarities):
+                    # the cluster with its i-th item replaced by the outlier
+                    replaced = cluster[:i] + cluster[i + 1:] + [o]
+                    expected = sum(sim(*[v for _, v in words]) for words in itertools.combinations(replaced, n))
+                    self.assertEqual(name, cluster[i][0])
+                    self.assertAlmostEqual(compactness, expected, places=5)
+
 suite = unittest.TestLoader().loadTestsFromTestCase(TestGroupTest)
 
 if __name__ == "__main__":
@@ -62,3 +62,14 @@ def similarity3(v1, v2, v3, centroid_dist_method=True):
         return np.dot(v1 * v2, v3) / (np.linalg.norm(v1, ord=3) * np.linalg.norm(v2, ord=3) * np.linalg.norm(v3, ord=3))
 
 
+def similarity3_from_gram(gram, i, j, k):
+    """Vectorized similarity3 (centroid distance method) of the vectors with indices i, j and k
+    (broadcastable index arrays), computed from the Gram matrix of the vectors"""
+    def scaled_sq_dist(a, b, c):
+        # 9 * squared distance of vector a to the centroid of a, b and c
+        return (4 * gram[a, a] + gram[b, b] + gram[c, c]
+                - 4 * gram[a, b] - 4 * gram[a, c] + 2 * gram[b, c])
+    mean_dist = sum(np.sqrt(np.maximum(scaled_sq_dist(a, b, c), 0.0))
+                    for a, b, c in [(i, j, k), (j, i, k), (k, i, j)]) / 9.0
+    with np.errstate(divide='ignore'):
+        return np.where(mean_dist == 0.0, 1 / .00001, 1 / mean_dist)